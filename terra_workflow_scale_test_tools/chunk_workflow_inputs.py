@@ -0,0 +1,88 @@
+"""Chunk Workflow Inputs
+This script splits the DRS URIs listed in the `test_drs_uris` manifests, or the lines of
+a plain list file, into chunks written as the rows of a TSV file, which the
+`md5_n_by_m_scatter_prechunked` workflow reads as its `Array[Array[String]]` scatter input.
+
+This replaces running the `chunk_array` task of `md5_n_by_m_scatter` for every submission:
+the inputs are streamed and each chunk is written as soon as it is complete, so the time
+taken is linear in the number of inputs, and no VM needs to be started to split the list.
+"""
+
+import argparse
+import itertools
+
+from typing import Iterable, Iterator, List
+
+from terra_workflow_scale_test_tools.drs_uri_manifest import find_manifest_files, read_drs_manifest
+
+
+def iter_manifest_drs_uris(manifest_paths: Iterable[str]) -> Iterator[str]:
+    """Return the DRS URIs in the manifest files or directories, in order, including any repeats."""
+    for path in manifest_paths:
+        for manifest_filename in find_manifest_files(path):
+            for info in read_drs_manifest(manifest_filename):
+                yield info.drs_uri
+
+
+def iter_list_file_values(list_filenames: Iterable[str]) -> Iterator[str]:
+    """Return the non-empty lines of the list files."""
+    for list_filename in list_filenames:
+        with open(list_filename) as list_file:
+            for line in list_file:
+                value = line.strip()
+                if value:
+                    yield value
+
+
+def iter_chunks(values: Iterable[str], chunk_size: int) -> Iterator[List[str]]:
+    iterator = iter(values)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def write_chunks_tsv(values: Iterable[str], chunk_size: int, output_filename: str) -> int:
+    """Write the values as rows of up to `chunk_size` tab-separated values, and return the number of rows."""
+    chunk_count = 0
+    with open(output_filename, 'w') as output_file:
+        for chunk in iter_chunks(values, chunk_size):
+            output_file.write("\t".join(chunk))
+            output_file.write("\n")
+            chunk_count += 1
+    return chunk_count
+
+
+def parse_arg_list(arg_list: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Split workflow inputs into a TSV file of scatter chunks.")
+    input_group = parser.add_mutually_exclusive_group(required=True)
+    input_group.add_argument('--manifest', type=str, action='append',
+                             help="Manifest file, or directory of manifest files, of the DRS URIs to chunk. "
+                                  "May be given more than once.")
+    input_group.add_argument('--input-list', type=str, action='append',
+                             help="File containing a value to chunk on each line. May be given more than once.")
+    parser.add_argument('--chunk-size', type=int, required=True,
+                        help="Number of inputs per chunk, i.e. per scatter shard")
+    parser.add_argument('--max-inputs', type=int, required=False, default=None,
+                        help="Chunk at most this many of the inputs")
+    parser.add_argument('--output', type=str, required=True,
+                        help="Output TSV file, containing a chunk per line")
+    args = parser.parse_args(arg_list)
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+    return args
+
+
+def main(arg_list: list = None) -> None:
+    args = parse_arg_list(arg_list)
+    values = iter_manifest_drs_uris(args.manifest) if args.manifest is not None \
+        else iter_list_file_values(args.input_list)
+    if args.max_inputs is not None:
+        values = itertools.islice(values, args.max_inputs)
+    chunk_count = write_chunks_tsv(values, args.chunk_size, args.output)
+    print(f"Wrote {chunk_count} chunks of up to {args.chunk_size} inputs to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,569 @@
+"""Copy Workflow Logs
+Copy selected Terra workflow log files from a Terra workspace bucket to the local
+file system to facilitate exploratory mining of them.
+
+Each `gs://<bucket>/<object name>` URI is copied to `<destination directory>/<object name>`,
+the same path layout as `copy_workflow_logs_to_local_fs.sh` creates. The URI list is
+streamed to a pool of worker threads that share a single storage client and its
+connection pool, rather than starting a new gsutil process for each log file.
+
+The log files of a submission can be listed by this module too. The listing uses the
+Cromwell execution directory layout (workflow id / call-* / shard-N) to split it into
+many small listings that are run concurrently, and the listed log files are copied as
+the listings complete.
+
+When a copy manifest is used, the object name, size and generation of every copied
+log file is recorded in it, and a rerun only copies the objects that are new or have
+changed since. This allows an interrupted copy to be resumed, and the logs of a running
+submission to be copied incrementally.
+
+To reduce the transfer volume and local disk use, the logs can instead be copied only
+up to the end of the DRS localization block near their start, which is all that the
+DRS localization event extraction needs.
+
+The storage backend is pluggable, so that the copy can also be run against a local
+directory tree standing in for the bucket, e.g. for testing and benchmarking.
+"""
+
+import argparse
+import os
+import re
+import threading
+import time
+
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from terra_workflow_scale_test_tools.extract_drs_localization_events import find_localization_block_end
+
+
+def parse_gcs_uri(uri: str) -> Tuple[str, str]:
+    """Return the bucket name and object name of a gs:// URI."""
+    assert uri.startswith("gs://"), f"Not a GCS URI: '{uri}'"
+    bucket_name, _, object_name = uri[len("gs://"):].partition("/")
+    return bucket_name, object_name
+
+
+@dataclass(frozen=True)
+class ObjectInfo:
+    uri: str
+    size: int
+    # Changes whenever the object content is replaced
+    generation: str
+
+
+class StorageBackend(ABC):
+    @abstractmethod
+    def download_to_file(self, uri: str, local_path: str) -> int:
+        """Download the object to the local path and return the number of bytes copied."""
+        pass
+
+    @abstractmethod
+    def read_range(self, uri: str, start: int, end: int) -> bytes:
+        """Return the bytes of the object from `start` up to, but not including, `end`.
+
+        Fewer bytes are returned if the object ends before `end`.
+        """
+        pass
+
+    @abstractmethod
+    def list_objects(self, uri_prefix: str) -> Iterator[ObjectInfo]:
+        """List the objects whose URIs start with the prefix."""
+        pass
+
+    @abstractmethod
+    def list_prefixes(self, uri_prefix: str) -> Iterator[str]:
+        """List the "subdirectory" prefixes, ending with "/", directly under a prefix ending with "/"."""
+        pass
+
+
+class GcsStorageBackend(StorageBackend):
+    """Google Cloud Storage backend using one client, and HTTP connection pool, for all threads."""
+
+    def __init__(self, max_connections: int = 32, project: str = None):
+        from google.cloud import storage
+        import requests.adapters
+        self.client = storage.Client(project=project)
+        # The default pool size of 10 would serialize the downloads of a larger worker pool.
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        self.client._http.mount("https://", adapter)
+
+    def download_to_file(self, uri: str, local_path: str) -> int:
+        bucket_name, object_name = parse_gcs_uri(uri)
+        blob = self.client.bucket(bucket_name).blob(object_name)
+        blob.download_to_filename(local_path)
+        return os.path.getsize(local_path)
+
+    def read_range(self, uri: str, start: int, end: int) -> bytes:
+        from google.api_core.exceptions import RequestRangeNotSatisfiable
+        bucket_name, object_name = parse_gcs_uri(uri)
+        blob = self.client.bucket(bucket_name).blob(object_name)
+        try:
+            # The end of a GCS byte range is inclusive.
+            return blob.download_as_bytes(start=start, end=end - 1)
+        except RequestRangeNotSatisfiable:
+            # The range starts at or after the end of the object.
+            return b""
+
+    def list_objects(self, uri_prefix: str) -> Iterator[ObjectInfo]:
+        bucket_name, object_prefix = parse_gcs_uri(uri_prefix)
+        # Request only the needed fields to keep the listing pages small.
+        for blob in self.client.list_blobs(bucket_name, prefix=object_prefix,
+                                           fields="items(name,size,generation),nextPageToken"):
+            yield ObjectInfo(f"gs://{bucket_name}/{blob.name}", blob.size, str(blob.generation))
+
+    def list_prefixes(self, uri_prefix: str) -> Iterator[str]:
+        bucket_name, object_prefix = parse_gcs_uri(uri_prefix)
+        iterator = self.client.list_blobs(bucket_name, prefix=object_prefix, delimiter="/",
+                                          fields="prefixes,nextPageToken")
+        for page in iterator.pages:
+            for prefix in page.prefixes:
+                yield f"gs://{bucket_name}/{prefix}"
+
+
+class LocalFsStorageBackend(StorageBackend):
+    """Serves `gs://<bucket>/<object name>` URIs from `<root directory>/<bucket>/<object name>`."""
+
+    copy_buffer_size = 1024 * 1024
+
+    def __init__(self, root_directory: str):
+        self.root_directory = root_directory
+
+    def get_local_source_path(self, uri: str) -> str:
+        bucket_name, object_name = parse_gcs_uri(uri)
+        return os.path.join(self.root_directory, bucket_name, object_name)
+
+    def download_to_file(self, uri: str, local_path: str) -> int:
+        bytes_copied = 0
+        with open(self.get_local_source_path(uri), 'rb') as src, open(local_path, 'wb') as dst:
+            while True:
+                data = src.read(self.copy_buffer_size)
+                if not data:
+                    break
+                dst.write(data)
+                bytes_copied += len(data)
+        return bytes_copied
+
+    def read_range(self, uri: str, start: int, end: int) -> bytes:
+        with open(self.get_local_source_path(uri), 'rb') as fh:
+            fh.seek(start)
+            return fh.read(max(end - start, 0))
+
+    def list_objects(self, uri_prefix: str) -> Iterator[ObjectInfo]:
+        """List the files under the directory containing the prefix, using the modification time as the generation."""
+        bucket_name, object_prefix = parse_gcs_uri(uri_prefix)
+        bucket_dir = os.path.join(self.root_directory, bucket_name)
+        local_prefix = os.path.join(bucket_dir, object_prefix)
+        for dirpath, dirnames, filenames in os.walk(os.path.dirname(local_prefix)):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                if path.startswith(local_prefix):
+                    stat = os.stat(path)
+                    object_name = os.path.relpath(path, bucket_dir).replace(os.sep, "/")
+                    yield ObjectInfo(f"gs://{bucket_name}/{object_name}", stat.st_size, str(stat.st_mtime_ns))
+
+    def list_prefixes(self, uri_prefix: str) -> Iterator[str]:
+        local_dir = self.get_local_source_path(uri_prefix)
+        if not os.path.isdir(local_dir):
+            return
+        for name in sorted(entry.name for entry in os.scandir(local_dir) if entry.is_dir()):
+            yield f"{uri_prefix}{name}/"
+
+
+@dataclass(frozen=True)
+class WorkflowShape:
+    workflow_name: str
+    # The call directory of the task that localizes the DRS URIs
+    call_dir_name: str
+    # Whether the task is scattered, with a shard-N directory per scatter shard
+    is_scattered: bool
+    # Matches the URIs of the task log files
+    log_uri_pattern: re.Pattern
+
+
+# The workflow shapes, and log files, that were selected by the gsutil globs in copy_workflow_logs_to_local_fs.sh
+WORKFLOW_SHAPES = [
+    # ${GCS_SUBMISSION_FOLDER}/ga4ghMd5/**/call-md5/md5.log
+    WorkflowShape("ga4ghMd5", "call-md5", False, re.compile(r"/ga4ghMd5/.+/call-md5/md5\.log$")),
+    # ${GCS_SUBMISSION_FOLDER}/md5_n_by_m_scatter/**/call-md5s/**/*.log
+    WorkflowShape("md5_n_by_m_scatter", "call-md5s", True,
+                  re.compile(r"/md5_n_by_m_scatter/.+/call-md5s/.+/[^/]*\.log$")),
+    # ${GCS_SUBMISSION_FOLDER}/md5_n_by_m_scatter_prechunked/**/call-md5s/**/*.log
+    WorkflowShape("md5_n_by_m_scatter_prechunked", "call-md5s", True,
+                  re.compile(r"/md5_n_by_m_scatter_prechunked/.+/call-md5s/.+/[^/]*\.log$")),
+]
+
+# Each listing task returns the log objects found, and the further listing tasks to run.
+ListingTask = Tuple[Callable, tuple]
+ListingTaskResult = Tuple[List[ObjectInfo], List[ListingTask]]
+
+
+class SubmissionLogLister:
+    """ Lists the task log files of a submission using many concurrent, small listings
+
+    Rather than one recursive listing of the whole submission folder, the workflow id
+    directories are listed first, then the task call directory of each workflow, or for
+    a scattered task each of its shard-N directories, is listed separately.
+    The other call directories, containing most of the objects, are never listed.
+    """
+    max_workers = 32
+
+    def __init__(self, backend: StorageBackend, submission_uri: str, max_workers: int = None):
+        self.backend = backend
+        self.submission_prefix = submission_uri.rstrip("/") + "/"
+        if max_workers is not None:
+            self.max_workers = max_workers
+
+    def detect_workflow_shape(self) -> WorkflowShape:
+        workflow_prefixes = set(self.backend.list_prefixes(self.submission_prefix))
+        for shape in WORKFLOW_SHAPES:
+            if f"{self.submission_prefix}{shape.workflow_name}/" in workflow_prefixes:
+                return shape
+        raise Exception(f"Unrecognized workflow name, cannot determine workflow \"shape\": "
+                        f"{sorted(workflow_prefixes)}")
+
+    def _list_workflows(self, shape: WorkflowShape) -> ListingTaskResult:
+        workflow_prefixes = self.backend.list_prefixes(f"{self.submission_prefix}{shape.workflow_name}/")
+        return list(), [(self._list_call, (f"{prefix}{shape.call_dir_name}/", shape)) for prefix in workflow_prefixes]
+
+    def _list_call(self, call_prefix: str, shape: WorkflowShape) -> ListingTaskResult:
+        if shape.is_scattered:
+            return list(), [(self._list_logs, (shard_prefix, shape))
+                            for shard_prefix in self.backend.list_prefixes(call_prefix)]
+        return self._list_logs(call_prefix, shape)
+
+    def _list_logs(self, uri_prefix: str, shape: WorkflowShape) -> ListingTaskResult:
+        return [info for info in self.backend.list_objects(uri_prefix) if shape.log_uri_pattern.search(info.uri)], list()
+
+    def iter_log_objects(self) -> Iterator[ObjectInfo]:
+        """Yield the log objects of the submission as the concurrent listings complete."""
+        shape = self.detect_workflow_shape()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {executor.submit(self._list_workflows, shape)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    log_objects, listing_tasks = future.result()
+                    for task, task_args in listing_tasks:
+                        pending.add(executor.submit(task, *task_args))
+                    yield from log_objects
+
+
+class CopyManifest:
+    """ Append-only record of the copied objects
+
+    Each line is `<URI>\t<size>\t<generation>\t<local size>`, and the last line for a URI is
+    the current one. The local size is smaller than the object size when only the head
+    of the object was copied. A line is only added once the copy is complete, so an
+    interrupted copy is never recorded as complete.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries: Dict[str, Tuple[int, str, int]] = self._load()
+        self._file = open(self.path, 'a')
+
+    def _load(self) -> Dict[str, Tuple[int, str, int]]:
+        entries = dict()
+        if os.path.exists(self.path):
+            with open(self.path) as fh:
+                for line in fh:
+                    fields = line.rstrip("\n").split("\t")
+                    # Ignore a truncated last line left by an interrupted write.
+                    if len(fields) == 4 and fields[1].isdigit() and fields[3].isdigit():
+                        entries[fields[0]] = (int(fields[1]), fields[2], int(fields[3]))
+        return entries
+
+    def is_current(self, info: ObjectInfo, local_path: str, require_complete: bool = False) -> bool:
+        """Return whether this version of the object was copied, and the local copy is still present.
+        When `require_complete`, a copy of only the head of the object is not current.
+        """
+        entry = self.entries.get(info.uri)
+        if entry is None or entry[:2] != (info.size, info.generation):
+            return False
+        if require_complete and entry[2] < entry[0]:
+            return False
+        try:
+            return os.path.getsize(local_path) == entry[2]
+        except FileNotFoundError:
+            return False
+
+    def record(self, info: ObjectInfo, local_size: int) -> None:
+        with self._lock:
+            self._file.write(f"{info.uri}\t{info.size}\t{info.generation}\t{local_size}\n")
+            self._file.flush()
+            self.entries[info.uri] = (info.size, info.generation, local_size)
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+@dataclass
+class CopyResult:
+    uri_count: int = 0
+    copied_count: int = 0
+    # Objects skipped because the manifest shows they were already copied
+    up_to_date_count: int = 0
+    bytes_copied: int = 0
+    elapsed_seconds: float = 0.0
+    failed_uris: List[str] = field(default_factory=list)
+
+    def summary(self) -> str:
+        rate = self.copied_count / self.elapsed_seconds if self.elapsed_seconds > 0 else 0.0
+        return (f"Copied {self.copied_count} of {self.uri_count} files ({self.bytes_copied} bytes) "
+                f"in {round(self.elapsed_seconds, 1)} seconds ({round(rate, 1)} files/second), "
+                f"{self.up_to_date_count} already up to date, {len(self.failed_uris)} failed.")
+
+    def is_complete(self) -> bool:
+        return not self.failed_uris and self.copied_count + self.up_to_date_count == self.uri_count
+
+
+class WorkflowLogCopier:
+    max_workers = 32
+    # Bound the number of URIs read ahead of the workers, so the URI list is streamed.
+    max_pending_per_worker = 4
+
+    def __init__(self, backend: StorageBackend, dest_dir: str, max_workers: int = None, head_bytes: int = None):
+        """When `head_bytes` is given, only the head of each log is copied, see `download_head_to_file`."""
+        self.backend = backend
+        self.dest_dir = dest_dir
+        if max_workers is not None:
+            self.max_workers = max_workers
+        self.head_bytes = head_bytes
+        self._created_dirs = set()
+        self._lock = threading.Lock()
+
+    def get_local_path(self, uri: str) -> str:
+        bucket_name, object_name = parse_gcs_uri(uri)
+        return os.path.join(self.dest_dir, object_name)
+
+    def _make_parent_dir(self, local_path: str) -> None:
+        parent_dir = os.path.dirname(local_path)
+        if parent_dir not in self._created_dirs:
+            os.makedirs(parent_dir, exist_ok=True)
+            self._created_dirs.add(parent_dir)
+
+    def copy_uri(self, uri: str) -> int:
+        local_path = self.get_local_path(uri)
+        self._make_parent_dir(local_path)
+        # Download to a temporary file, so that an interrupted copy never leaves a partial log behind.
+        tmp_path = f"{local_path}.partial"
+        try:
+            if self.head_bytes is None:
+                bytes_copied = self.backend.download_to_file(uri, tmp_path)
+            else:
+                bytes_copied = self.download_head_to_file(uri, tmp_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, local_path)
+        return bytes_copied
+
+    def download_head_to_file(self, uri: str, local_path: str) -> int:
+        """Download the log up to the end of its DRS localization block.
+
+        The first `head_bytes` are read, and the range is doubled until it includes the
+        end of the localization block, or the end of the log.
+        """
+        data = bytearray()
+        range_size = self.head_bytes
+        while True:
+            chunk = self.backend.read_range(uri, len(data), len(data) + range_size)
+            data += chunk
+            block_end = find_localization_block_end(data)
+            if block_end != -1:
+                del data[block_end:]
+                break
+            if len(chunk) < range_size:
+                break
+            range_size = len(data)
+        with open(local_path, 'wb') as fh:
+            fh.write(data)
+        return len(data)
+
+    def _record(self, result: CopyResult, uri: str, future,
+                on_copied: Optional[Callable[[str, int], None]]) -> None:
+        with self._lock:
+            ex = future.exception()
+            if ex is None:
+                result.copied_count += 1
+                result.bytes_copied += future.result()
+                if on_copied is not None:
+                    on_copied(uri, future.result())
+            else:
+                print(f"Failed to copy {uri}: {ex}")
+                result.failed_uris.append(uri)
+
+    def copy_uris(self, uris: Iterable[str], result: CopyResult = None,
+                  on_copied: Callable[[str, int], None] = None) -> CopyResult:
+        result = CopyResult() if result is None else result
+        start_time = time.monotonic()
+        max_pending = self.max_workers * self.max_pending_per_worker
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = dict()
+            for uri in uris:
+                result.uri_count += 1
+                if len(pending) >= max_pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._record(result, pending.pop(future), future, on_copied)
+                pending[executor.submit(self.copy_uri, uri)] = uri
+            for future in wait(pending).done:
+                self._record(result, pending.pop(future), future, on_copied)
+        result.elapsed_seconds += time.monotonic() - start_time
+        return result
+
+    def sync_objects(self, objects: Iterable[ObjectInfo], manifest: CopyManifest,
+                     result: CopyResult = None) -> CopyResult:
+        """Copy only the listed objects that are not in the manifest, or have changed since they were copied."""
+        result = CopyResult() if result is None else result
+        objects_to_copy: Dict[str, ObjectInfo] = dict()
+        seen_uris: Set[str] = set()
+
+        def uris_to_copy() -> Iterator[str]:
+            # The URIs yielded are counted by copy_uris.
+            for info in objects:
+                # Copying an object listed twice would copy it concurrently to the same path.
+                if info.uri in seen_uris:
+                    continue
+                seen_uris.add(info.uri)
+                # A copy of only the head of a log is replaced when copying the complete logs.
+                if manifest.is_current(info, self.get_local_path(info.uri), require_complete=self.head_bytes is None):
+                    result.uri_count += 1
+                    result.up_to_date_count += 1
+                else:
+                    objects_to_copy[info.uri] = info
+                    yield info.uri
+
+        return self.copy_uris(uris_to_copy(), result,
+                              lambda uri, local_size: manifest.record(objects_to_copy.pop(uri), local_size))
+
+    def sync_uris(self, uris: Iterable[str], manifest: CopyManifest) -> CopyResult:
+        """Copy only the objects that are not in the manifest, or have changed since they were copied.
+
+        The size and generation of the objects are found by listing the directory of each log file,
+        concurrently, rather than by one listing of everything under the common prefix of the URIs,
+        which for the logs of a submission is the whole submission folder.
+        """
+        result = CopyResult()
+        uris_by_dir: Dict[str, Set[str]] = dict()
+        for uri in uris:
+            uris_by_dir.setdefault(uri[:uri.rfind("/") + 1], set()).add(uri)
+
+        def list_dir(dir_prefix: str) -> Tuple[str, List[ObjectInfo]]:
+            wanted_uris = uris_by_dir[dir_prefix]
+            return dir_prefix, [info for info in self.backend.list_objects(dir_prefix) if info.uri in wanted_uris]
+
+        def iter_objects() -> Iterator[ObjectInfo]:
+            # The objects are copied as the listings complete.
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for future in as_completed([executor.submit(list_dir, dir_prefix) for dir_prefix in uris_by_dir]):
+                    dir_prefix, object_infos = future.result()
+                    for uri in sorted(uris_by_dir[dir_prefix] - {info.uri for info in object_infos}):
+                        print(f"Failed to copy {uri}: Object not found")
+                        result.uri_count += 1
+                        result.failed_uris.append(uri)
+                    yield from object_infos
+
+        return self.sync_objects(iter_objects(), manifest, result)
+
+
+def read_uri_list(uri_list_filename: str) -> Iterator[str]:
+    with open(uri_list_filename) as fh:
+        for line in fh:
+            uri = line.strip()
+            if uri:
+                yield uri
+
+
+def write_uri_list(objects: Iterable[ObjectInfo], uri_list_filename: str) -> Iterator[ObjectInfo]:
+    """Pass the listed objects through, then write the sorted list of their URIs once the listing is complete."""
+    uris = list()
+    for info in objects:
+        uris.append(info.uri)
+        yield info
+    tmp_filename = f"{uri_list_filename}.partial"
+    with open(tmp_filename, 'w') as fh:
+        for uri in sorted(uris):
+            fh.write(f"{uri}\n")
+    os.replace(tmp_filename, uri_list_filename)
+
+
+def is_copy_complete(uri_list_filename: str, manifest_filename: str) -> bool:
+    """Return whether all the listed URIs have been recorded in the copy manifest."""
+    if not os.path.exists(uri_list_filename) or not os.path.exists(manifest_filename):
+        return False
+    manifest = CopyManifest(manifest_filename)
+    try:
+        return all(uri in manifest.entries for uri in read_uri_list(uri_list_filename))
+    finally:
+        manifest.close()
+
+
+def parse_arg_list(arg_list: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Copy workflow log files from GCS to the local file system.")
+    parser.add_argument('--uri-list', type=str, required=True,
+                        help="File containing the gs:// URIs of the log files to copy, one per line; "
+                             "written by the listing when --submission-uri is given")
+    parser.add_argument('--submission-uri', type=str, required=False, default=None,
+                        help="GCS URI of the submission folder whose task log files are listed and copied")
+    parser.add_argument('--dest-dir', type=str, required=True,
+                        help="Local file system directory to copy the log files to")
+    parser.add_argument('--max-workers', type=int, required=False, default=WorkflowLogCopier.max_workers,
+                        help="Number of concurrent copies")
+    parser.add_argument('--manifest', type=str, required=False, default=None,
+                        help="Copy manifest file; when given, only new or changed objects are copied")
+    parser.add_argument('--head-bytes', type=int, required=False, default=None,
+                        help="Copy only the head of each log, up to the end of the DRS localization block, "
+                             "reading this many bytes at first")
+    parser.add_argument('--local-root-dir', type=str, required=False, default=None,
+                        help="Copy from this local directory tree instead of GCS (for testing and benchmarking)")
+    args = parser.parse_args(arg_list)
+    if args.head_bytes is not None and args.head_bytes < 1:
+        parser.error("--head-bytes must be at least 1")
+    return args
+
+
+def create_backend(args: argparse.Namespace) -> StorageBackend:
+    if args.local_root_dir is not None:
+        return LocalFsStorageBackend(args.local_root_dir)
+    return GcsStorageBackend(max_connections=args.max_workers)
+
+
+def main(arg_list: list = None) -> None:
+    args = parse_arg_list(arg_list)
+    os.makedirs(args.dest_dir, exist_ok=True)
+    backend = create_backend(args)
+    copier = WorkflowLogCopier(backend, args.dest_dir, args.max_workers, args.head_bytes)
+    if args.submission_uri is not None:
+        lister = SubmissionLogLister(backend, args.submission_uri, args.max_workers)
+        log_objects = write_uri_list(lister.iter_log_objects(), args.uri_list)
+        if args.manifest is None:
+            result = copier.copy_uris(info.uri for info in log_objects)
+        else:
+            manifest = CopyManifest(args.manifest)
+            try:
+                result = copier.sync_objects(log_objects, manifest)
+            finally:
+                manifest.close()
+    elif args.manifest is None:
+        result = copier.copy_uris(read_uri_list(args.uri_list))
+    else:
+        manifest = CopyManifest(args.manifest)
+        try:
+            result = copier.sync_uris(read_uri_list(args.uri_list), manifest)
+        finally:
+            manifest.close()
+    print(result.summary())
+    if not result.is_complete():
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
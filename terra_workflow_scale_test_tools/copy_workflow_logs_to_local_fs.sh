@@ -13,11 +13,15 @@ function parse_options {
 
   function usage {
     cmd_basename=$(basename "$0")
-    echo "Usage: "${cmd_basename}" -s <GCS URI of submison folder> -d <local file system directory path>" 1>&2; exit 1;
+    echo "Usage: "${cmd_basename}" -s <GCS URI of submison folder> -d <local file system directory path> [-b <head bytes>]" 1>&2
+    echo "  -b  Copy only the head of each log, up to the end of the DRS localization block," 1>&2
+    echo "      reading this many bytes at first" 1>&2
+    exit 1;
   }
 
+  HEAD_BYTES=""
   local OPTIND
-  while getopts "s:d:" o; do
+  while getopts "s:d:b:" o; do
       case "${o}" in
           s)
               GCS_SUBMISSION_FOLDER="${OPTARG}"
@@ -25,6 +29,9 @@ function parse_options {
           d)
               WORKFLOW_LOG_DIR="${OPTARG}"
               ;;
+          b)
+              HEAD_BYTES="${OPTARG}"
+              ;;
           *)
               usage
               ;;
@@ -37,76 +44,41 @@ function parse_options {
   fi
 }
 
-function configure_for_wf_shape1 {
-  WF_NAME="ga4ghMd5"
-  WF_TASK_NAME='call-md5'
-  WF_DRS_LOG_FILENAME='md5.log'
-  # shellcheck disable=SC2034
-  GSUTIL_DRS_LOG_PATH="${GCS_SUBMISSION_FOLDER}/${WF_NAME}/**/${WF_TASK_NAME}/${WF_DRS_LOG_FILENAME}"
-}
-
-function configure_for_wf_shape2 {
-  WF_NAME="md5_n_by_m_scatter"
-  WF_TASK_NAME='call-md5s'
-  WF_DRS_LOG_FILENAME='*.log'
-  # shellcheck disable=SC2034
-  GSUTIL_DRS_LOG_PATH="${GCS_SUBMISSION_FOLDER}/${WF_NAME}/**/${WF_TASK_NAME}/**/${WF_DRS_LOG_FILENAME}"
-}
-
-function configure_for_workflow_shape {
-  if gsutil ls "${GCS_SUBMISSION_FOLDER}/ga4ghMd5" > /dev/null 2>&1; then
-    configure_for_wf_shape1
-  elif gsutil ls "${GCS_SUBMISSION_FOLDER}/md5_n_by_m_scatter" > /dev/null 2>&1; then
-    configure_for_wf_shape2
-  else
-    echo "Unrecognized workflow name, cannot determine workflow \"shape\":"
-    gsutil ls "${GCS_SUBMISSION_FOLDER}/"
-    exit 1
-  fi
-}
-
-function copy_gcs_uris_to_local_fs {
-  gcs_uris_file="$1"
+function copy_submission_logs_to_local_fs {
+  gcs_submission_folder="$1"
   local_fs_dest_dir="$2"
-
-  MAX_CONCURRENT_GSUTIL_PROCS=20
-
-  # Create a file containing the source and destination parameters for gsutil copy.
-  GSUTIL_COPY_ARGS_FILE="$WORKFLOW_LOG_DIR/drs_log_gsutil_copy_args.txt"
-  rm -f "$GSUTIL_COPY_ARGS_FILE"
-  while read -r drs_log_gcs_uri; do
-      # Construct the local path based on the GCS URI
-      uri_path="$(echo "$drs_log_gcs_uri" | cut -d / -f 4-)"
-      local_path="$local_fs_dest_dir/$uri_path"
-
-      # Write the gsutil copy source URI and destination file
-      echo "$drs_log_gcs_uri \"$local_path\"" >> "$GSUTIL_COPY_ARGS_FILE"
-  done < "$gcs_uris_file"
-
-  # Verify the line count of the in log list file and the args file is the same.
-  # TODO Programmatically verify this and if not true exit with an error
-  wc -l "$GSUTIL_COPY_ARGS_FILE"
-
-  # Perform concurrent gsutil copies using xargs to provide the process control.
-  xargs -P $MAX_CONCURRENT_GSUTIL_PROCS -a "$GSUTIL_COPY_ARGS_FILE" -n 2 gsutil cp
+  gcs_uris_file="$3"
+
+  MAX_CONCURRENT_COPIES=32
+
+  # The copy manifest records the log files already copied, so that rerunning
+  # this only copies the log files that are new or have changed since.
+  COPY_MANIFEST="$local_fs_dest_dir/copy_manifest.tsv"
+
+  # List the selected log files of the workflow "shape" found in the submission folder,
+  # using concurrent listings of the workflow, call and shard folders, and write their
+  # GCS URIs to the URI list file.
+  # Perform concurrent copies of the listed log files as they are found, using a pool
+  # of threads sharing one storage client.
+  # This exits with an error if any of the listed log files was not copied.
+  python3 -m terra_workflow_scale_test_tools.copy_workflow_logs \
+    --submission-uri "$gcs_submission_folder" \
+    --uri-list "$gcs_uris_file" \
+    --dest-dir "$local_fs_dest_dir" \
+    --manifest "$COPY_MANIFEST" \
+    --max-workers $MAX_CONCURRENT_COPIES \
+    ${HEAD_BYTES:+--head-bytes "$HEAD_BYTES"}
 }
 
 parse_options "$@"
 echo "GCS_SUBMISSION_FOLDER=${GCS_SUBMISSION_FOLDER}"
 echo "WORKFLOW_LOG_DIR=${WORKFLOW_LOG_DIR}"
 
-# Configure for the workflow shape of the provided WF_SUBMISSION_ID
-configure_for_workflow_shape "${GCS_SUBMISSION_FOLDER}"
-
 mkdir -p "$WORKFLOW_LOG_DIR"
 
 DRS_LOG_LIST="${WORKFLOW_LOG_DIR}/drs_log_list.txt"
-# rm -f "$DRS_LOG_LIST"
 
-# Create a list of selected log file GCS URIs
-time (gsutil ls -r "${GSUTIL_DRS_LOG_PATH}" > "$DRS_LOG_LIST")
+time copy_submission_logs_to_local_fs "${GCS_SUBMISSION_FOLDER}" "${WORKFLOW_LOG_DIR}" "${DRS_LOG_LIST}"
 wc -l "$DRS_LOG_LIST"
 
-time copy_gcs_uris_to_local_fs "${DRS_LOG_LIST}" "${WORKFLOW_LOG_DIR}"
-
 echo Done copying workflow log files!
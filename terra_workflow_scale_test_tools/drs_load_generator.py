@@ -0,0 +1,370 @@
+"""DRS Resolution Load Generator
+This script sends DRS resolution requests for the DRS URIs in the `test_drs_uris` manifests
+to Martha or Gen3, at a target request rate that follows a plateau, ramp or step profile,
+without running a Terra workflow submission.
+
+The load is open-loop: each request is sent at its scheduled time, whether or not the
+earlier requests have completed, so slow responses do not lower the offered load.
+The latency and status of every request are recorded in the monitoring CSV format.
+"""
+
+import argparse
+import asyncio
+import itertools
+import logging
+import time
+
+from abc import ABC, abstractmethod
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterator, List
+
+from terra_workflow_scale_test_tools import monitor_response_times
+from terra_workflow_scale_test_tools.drs_uri_manifest import read_drs_uris
+from terra_workflow_scale_test_tools.metrics_writer import OUTPUT_FORMATS
+from terra_workflow_scale_test_tools.monitor_response_times import ConnectionMode, DeploymentInfo, Gen3Methods, \
+    HttpSessions, TerraMethods, configure_logging, create_output_directory, fence_user_token_cache, \
+    set_request_configuration, use_mock_server
+from terra_workflow_scale_test_tools.token_cache import terra_user_token_cache
+
+
+class RateProfile(ABC):
+    """ Target request rate, in requests per second, over the duration of a load test """
+    # The step over which the rate is integrated to schedule the requests
+    integration_step_seconds = 0.1
+
+    @property
+    @abstractmethod
+    def duration_seconds(self) -> float:
+        pass
+
+    @abstractmethod
+    def rate_at(self, elapsed_seconds: float) -> float:
+        pass
+
+    def iter_send_offsets(self) -> Iterator[float]:
+        """Yield the times, in seconds from the start of the profile, at which to send the requests.
+
+        The n-th request is sent when the integral of the rate reaches n, so that the number of
+        requests sent follows the profile even where the rate changes within one send interval,
+        for example at the start of a ramp from zero.
+        """
+        offset = 0.0
+        sent_count = 0
+        # The integral of the rate up to `offset`
+        expected_count = 0.0
+        while offset < self.duration_seconds:
+            step = min(self.integration_step_seconds, self.duration_seconds - offset)
+            rate = self.rate_at(offset + step / 2)
+            step_expected_count = rate * step
+            # The tolerance keeps rounding errors in the integral from adding a request at the end.
+            while rate > 0 and sent_count < expected_count + step_expected_count - 1e-6:
+                yield offset + (sent_count - expected_count) / rate
+                sent_count += 1
+            expected_count += step_expected_count
+            offset += step
+
+
+class PlateauProfile(RateProfile):
+    def __init__(self, rate: float, duration_seconds: float):
+        self.rate = rate
+        self._duration_seconds = duration_seconds
+
+    @property
+    def duration_seconds(self) -> float:
+        return self._duration_seconds
+
+    def rate_at(self, elapsed_seconds: float) -> float:
+        return self.rate
+
+
+class RampProfile(RateProfile):
+    def __init__(self, start_rate: float, end_rate: float, duration_seconds: float):
+        self.start_rate = start_rate
+        self.end_rate = end_rate
+        self._duration_seconds = duration_seconds
+
+    @property
+    def duration_seconds(self) -> float:
+        return self._duration_seconds
+
+    def rate_at(self, elapsed_seconds: float) -> float:
+        fraction = min(elapsed_seconds / self._duration_seconds, 1.0) if self._duration_seconds > 0 else 1.0
+        return self.start_rate + (self.end_rate - self.start_rate) * fraction
+
+
+class StepProfile(RateProfile):
+    def __init__(self, start_rate: float, step_rate: float, step_seconds: float, step_count: int):
+        self.start_rate = start_rate
+        self.step_rate = step_rate
+        self.step_seconds = step_seconds
+        self.step_count = step_count
+
+    @property
+    def duration_seconds(self) -> float:
+        return self.step_seconds * self.step_count
+
+    def rate_at(self, elapsed_seconds: float) -> float:
+        step = min(int(elapsed_seconds // self.step_seconds), self.step_count - 1)
+        return self.start_rate + self.step_rate * step
+
+
+class ProfileSequence(RateProfile):
+    """ Rate profiles run one after another """
+    def __init__(self, profiles: List[RateProfile]):
+        self.profiles = list(profiles)
+
+    @property
+    def duration_seconds(self) -> float:
+        return sum(profile.duration_seconds for profile in self.profiles)
+
+    def rate_at(self, elapsed_seconds: float) -> float:
+        for profile in self.profiles:
+            if elapsed_seconds < profile.duration_seconds:
+                return profile.rate_at(elapsed_seconds)
+            elapsed_seconds -= profile.duration_seconds
+        return 0.0
+
+    def iter_send_offsets(self) -> Iterator[float]:
+        start_offset = 0.0
+        for profile in self.profiles:
+            for offset in profile.iter_send_offsets():
+                yield start_offset + offset
+            start_offset += profile.duration_seconds
+
+
+RATE_PROFILE_FORMATS = {
+    "plateau": (PlateauProfile, "plateau:<rate>:<duration seconds>"),
+    "ramp": (RampProfile, "ramp:<start rate>:<end rate>:<duration seconds>"),
+    "step": (StepProfile, "step:<start rate>:<rate increment>:<step seconds>:<step count>"),
+}
+
+
+def parse_rate_profile(profile_spec: str) -> RateProfile:
+    """Parse a rate profile specification, for example `ramp:1:50:300`, with rates in requests per second."""
+    name, *values = profile_spec.strip().split(":")
+    if name not in RATE_PROFILE_FORMATS:
+        raise ValueError(f"Unsupported rate profile: '{profile_spec}'")
+    profile_class, profile_format = RATE_PROFILE_FORMATS[name]
+    try:
+        if name == "step":
+            profile = StepProfile(float(values[0]), float(values[1]), float(values[2]), int(values[3]))
+        else:
+            profile = profile_class(*[float(value) for value in values])
+    except (IndexError, TypeError, ValueError):
+        raise ValueError(f"Invalid rate profile: '{profile_spec}', expected: {profile_format}")
+    if profile.duration_seconds <= 0 or \
+            min(profile.rate_at(0.0), profile.rate_at(profile.duration_seconds)) < 0:
+        raise ValueError(f"Invalid rate profile: '{profile_spec}', the duration must be positive "
+                         f"and the rates must not be negative")
+    return profile
+
+
+@dataclass
+class LoadGeneratorResult:
+    sent_count: int = 0
+    dropped_count: int = 0
+    late_count: int = 0
+    response_code_counts: Counter = field(default_factory=Counter)
+    elapsed_seconds: float = 0.0
+
+    def summary(self) -> str:
+        rate = self.sent_count / self.elapsed_seconds if self.elapsed_seconds > 0 else 0.0
+        response_codes = ", ".join(f"{code}: {count}" for code, count in sorted(self.response_code_counts.items(),
+                                                                             key=lambda item: str(item[0])))
+        return f"Sent {self.sent_count} requests in {self.elapsed_seconds:.1f} seconds ({rate:.1f} per second), " \
+               f"{self.late_count} sent late, {self.dropped_count} dropped. Responses: {response_codes}"
+
+
+class DrsLoadGenerator(TerraMethods, Gen3Methods):
+    """ Open-loop DRS resolution load generator
+
+    Requests are sent at the times given by the rate profile, cycling through the DRS URIs,
+    as tasks on the event loop. A request is dropped, rather than delayed, if `max_in_flight`
+    requests are already in flight, so that the generator never waits on the server.
+    """
+    operation_names = ['martha', 'indexd_get_metadata', 'fence_get_signed_url']
+    max_in_flight = 10000
+    request_timeout_seconds = 60.0
+    # Requests sent more than this long after their scheduled time are counted as late.
+    late_threshold_seconds = 1.0
+
+    def __init__(self, operation_name: str, drs_uris: List[str], profile: RateProfile,
+                 max_in_flight: int = None, request_timeout_seconds: float = None):
+        super().__init__()
+        if operation_name not in self.operation_names:
+            raise Exception(f"Unsupported operation: '{operation_name}', expected one of: {self.operation_names}")
+        if not drs_uris:
+            raise Exception("No DRS URIs to send requests for.")
+        self.operation_name = operation_name
+        self.drs_uris = drs_uris
+        self.profile = profile
+        if max_in_flight is not None:
+            self.max_in_flight = max_in_flight
+        if request_timeout_seconds is not None:
+            self.request_timeout_seconds = request_timeout_seconds
+        self.output_filename = f"{operation_name}_load_response_times.csv"
+        self._operations: Dict[str, Callable[[str], Awaitable[dict]]] = dict(
+            martha=self._request_martha,
+            indexd_get_metadata=self._request_indexd_metadata,
+            fence_get_signed_url=self._request_fence_signed_url)
+
+    async def _request_martha(self, drs_uri: str) -> dict:
+        terra_user_token = await self.get_terra_user_token()
+        resp_json, mon_info = await self.get_martha_drs_response(terra_user_token, drs_uri)
+        if mon_info['response_code'] == 401:
+            terra_user_token_cache.invalidate()
+        return mon_info
+
+    async def _request_indexd_metadata(self, drs_uri: str) -> dict:
+        resp_json, mon_info = await self.get_gen3_drs_resolution(drs_uri)
+        return mon_info
+
+    async def _request_fence_signed_url(self, drs_uri: str) -> dict:
+        fence_user_token = await fence_user_token_cache.get_token_async()
+        access_url, mon_info = await self.get_gen3_drs_access(fence_user_token, drs_uri,
+                                                              self.gen3_info.cloud_uri_scheme)
+        if mon_info['response_code'] == 401:
+            fence_user_token_cache.invalidate()
+        return mon_info
+
+    async def _get_tokens(self) -> None:
+        # Fetch the tokens before starting, so that the first requests are not delayed by it.
+        # If this fails, the requests fetch the tokens themselves, and are recorded as failed if that fails.
+        try:
+            if self.operation_name == 'martha':
+                await self.get_terra_user_token()
+            elif self.operation_name == 'fence_get_signed_url':
+                await fence_user_token_cache.get_token_async()
+        except Exception as ex:
+            monitor_response_times.logger.warning(f"Failed to get the access token before starting: {ex}")
+
+    async def _send_request(self, drs_uri: str, result: LoadGeneratorResult) -> None:
+        start_time = time.time()
+        try:
+            mon_info = await asyncio.wait_for(self._operations[self.operation_name](drs_uri),
+                                              timeout=self.request_timeout_seconds)
+        except Exception as ex:
+            # Record the failed request, with no response code, rather than leave a gap.
+            mon_info = dict(start_time=start_time, response_duration=round(time.time() - start_time, 3),
+                            response_code=None, response_reason=type(ex).__name__)
+            monitor_response_times.logger.warning(f"Request for {drs_uri} failed: {type(ex).__name__} {ex}")
+        result.response_code_counts[mon_info['response_code']] += 1
+        self.write_monitoring_info_to_csv({self.operation_name: mon_info}, self.output_filename,
+                                          [self.operation_name])
+
+    async def run(self) -> LoadGeneratorResult:
+        result = LoadGeneratorResult()
+        await self._get_tokens()
+        loop = asyncio.get_event_loop()
+        in_flight = set()
+        drs_uris = itertools.cycle(self.drs_uris)
+        start = loop.time()
+        for offset in self.profile.iter_send_offsets():
+            delay = start + offset - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif -delay > self.late_threshold_seconds:
+                result.late_count += 1
+            if len(in_flight) >= self.max_in_flight:
+                result.dropped_count += 1
+                continue
+            task = asyncio.ensure_future(self._send_request(next(drs_uris), result))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+            result.sent_count += 1
+        if in_flight:
+            await asyncio.wait(in_flight)
+        result.elapsed_seconds = loop.time() - start
+        return result
+
+
+def parse_arg_list(arg_list: list = None) -> argparse.Namespace:
+    utc_timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--project-name', type=str, required=True,
+                        help="Project to send requests to. Supported values: BDC, CRDC")
+    parser.add_argument('--terra-deployment-tier', type=str, required=True,
+                        help="Terra deployment tier to send requests to. Supported values: DEV, ALPHA, PROD")
+    parser.add_argument('--manifest', type=str, required=True, action='append',
+                        help="Terra data table TSV file of DRS URIs, or a directory to search for them. "
+                             "May be given more than once.")
+    parser.add_argument('--operation', type=str, required=False, default="martha",
+                        choices=DrsLoadGenerator.operation_names,
+                        help="Request to send for each DRS URI")
+    parser.add_argument('--profile', type=str, required=True, action='append',
+                        help="Request rate profile, in requests per second. One of: " +
+                             ", ".join(profile_format for _, profile_format in RATE_PROFILE_FORMATS.values()) +
+                             ". Profiles given more than once are run one after another.")
+    parser.add_argument('--max-uris', type=int, required=False, default=None,
+                        help="Use at most this many of the DRS URIs")
+    parser.add_argument('--max-in-flight', type=int, required=False, default=DrsLoadGenerator.max_in_flight,
+                        help="Maximum number of requests in flight, beyond which requests are dropped")
+    parser.add_argument('--max-connections', type=int, required=False, default=0,
+                        help="Maximum number of concurrent connections to the host, or 0 for no limit")
+    parser.add_argument('--request-timeout-seconds', type=float, required=False,
+                        default=DrsLoadGenerator.request_timeout_seconds,
+                        help="Time after which a request is recorded as failed")
+    parser.add_argument('--output-dir', type=str, required=False,
+                        default=f"./load_generator_output_{utc_timestamp}",
+                        help="Directory to contain the response time output files")
+    parser.add_argument('--connection-mode', type=str, required=False, default="WARM",
+                        help="WARM to reuse pooled keep-alive connections (server latency), "
+                             "COLD to open a new connection per request (includes handshake latency)")
+    parser.add_argument('--mock-server-url', type=str, required=False, default=None,
+                        help="Send all requests to this mock server, e.g. one run by mock_terra_services, "
+                             "using a static Terra user token")
+    parser.add_argument('--output-format', type=str, required=False, default="csv", choices=OUTPUT_FORMATS,
+                        help="Format of the response time file: csv, or parquet for a typed columnar file")
+    args = parser.parse_args(arg_list)
+    try:
+        args.rate_profile = ProfileSequence([parse_rate_profile(spec) for spec in args.profile])
+    except ValueError as ex:
+        parser.error(str(ex))
+    return args
+
+
+async def generate_load(load_generator: DrsLoadGenerator) -> LoadGeneratorResult:
+    try:
+        return await load_generator.run()
+    finally:
+        await monitor_response_times.http_sessions.close()
+
+
+def main(arg_list: list = None) -> None:
+    args = parse_arg_list(arg_list)
+    DeploymentInfo.set_project(args.project_name)
+    DeploymentInfo.set_terra_deployment_tier(args.terra_deployment_tier)
+    if args.mock_server_url is not None:
+        use_mock_server(args.mock_server_url)
+    drs_uris = read_drs_uris(args.manifest)
+    if args.max_uris is not None:
+        drs_uris = drs_uris[:args.max_uris]
+
+    create_output_directory(args.output_dir)
+    set_request_configuration(args.output_dir,
+                              HttpSessions(ConnectionMode.from_name(args.connection_mode), args.max_connections),
+                              configure_logging(args.output_dir, "drs_load_generator.log"), args.output_format)
+    logger: logging.Logger = monitor_response_times.logger
+    logger.info("Load Generator Configuration:")
+    logger.info(f"Project: {args.project_name}")
+    logger.info(f"Terra Deployment Tier: {args.terra_deployment_tier}")
+    logger.info(f"Operation: {args.operation}")
+    logger.info(f"DRS URIs: {len(drs_uris)}")
+    logger.info(f"Rate Profiles: {args.profile}")
+
+    load_generator = DrsLoadGenerator(args.operation, drs_uris, args.rate_profile,
+                                      args.max_in_flight, args.request_timeout_seconds)
+    print(f"Sending {args.operation} requests for {len(drs_uris)} DRS URIs "
+          f"over {args.rate_profile.duration_seconds:.0f} seconds ...")
+    try:
+        result = asyncio.run(generate_load(load_generator))
+    finally:
+        monitor_response_times.metrics_writers.close_all()
+    logger.info(result.summary())
+    print(result.summary())
+
+
+if __name__ == "__main__":
+    main()
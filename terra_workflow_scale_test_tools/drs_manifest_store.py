@@ -0,0 +1,321 @@
+"""DRS Manifest Store
+This module builds an indexed store of the DRS objects listed in a complete ("all")
+Terra data table file in `test_drs_uris`, and generates the fixed size subsets of it
+(00010, 00100, ..., 30000) used as workflow inputs, replacing the manual spreadsheet workflow.
+
+The store is a SQLite database containing each distinct DRS URI once, with its size and MD5
+checksum, and all the other columns of its row in the source file, so that subsets can be
+exported as Terra entity TSV files with the same columns as the source file.
+
+A subset is either the first N objects in the source file order, as in the existing size
+tier files, or a random sample of them for a given seed, optionally balanced by size so that
+its object size distribution matches that of the whole store.
+Existing size tier files can be validated against the store, to find files that are out of sync.
+
+Reading `.xlsx` files requires `openpyxl`.
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import random
+import re
+import sqlite3
+
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+
+from terra_workflow_scale_test_tools.drs_uri_manifest import detect_manifest_columns, normalize_md5, parse_size
+
+# Matches the subset size in the name of a size tier file, e.g. crdc_small_public_files_00100_20220421.txt
+TIER_SIZE_PATTERN = re.compile(r"_(\d{5})(?=[_.])")
+ENTITY_ID_COLUMN_PREFIX = "entity:"
+
+
+class DrsManifestStoreException(Exception):
+    pass
+
+
+def read_manifest_rows(manifest_filename: str) -> Tuple[List[str], Iterator[List[str]]]:
+    """Return the header and an iterator over the rows of a TSV or `.xlsx` Terra data table file."""
+    if manifest_filename.endswith(".xlsx"):
+        import pandas as pd
+        df = pd.read_excel(manifest_filename, dtype=str, keep_default_na=False)
+        return [str(column) for column in df.columns], iter(df.values.tolist())
+    manifest_file = open(manifest_filename, newline='')
+    reader = csv.reader(manifest_file, delimiter="\t")
+    header = next(reader, [])
+
+    def iter_rows() -> Iterator[List[str]]:
+        with manifest_file:
+            yield from reader
+
+    return header, iter_rows()
+
+
+def get_tier_size(manifest_filename: str) -> Optional[int]:
+    """Return the number of objects in a size tier file, according to its name, or None for an "all" file."""
+    match = TIER_SIZE_PATTERN.search(os.path.basename(manifest_filename))
+    return int(match.group(1)) if match else None
+
+
+@dataclass
+class ManifestValidationResult:
+    manifest_filename: str
+    expected_count: Optional[int]
+    row_count: int = 0
+    blank_row_count: int = 0
+    drs_uri_count: int = 0
+    duplicate_count: int = 0
+    # Subsets larger than the store repeat its objects
+    expected_duplicate_count: int = 0
+    unknown_count: int = 0
+    mismatched_count: int = 0
+
+    @property
+    def is_valid(self) -> bool:
+        return self.row_count == self.drs_uri_count and self.blank_row_count == 0 and \
+            (self.expected_count is None or self.expected_count == self.drs_uri_count) and \
+            self.duplicate_count == self.expected_duplicate_count and \
+            self.unknown_count == 0 and self.mismatched_count == 0
+
+    def summary(self) -> str:
+        status = "OK" if self.is_valid else "INVALID"
+        return (f"{status} {self.manifest_filename}: "
+                f"{self.drs_uri_count} DRS URIs (expected {self.expected_count}) in {self.row_count} rows, "
+                f"{self.blank_row_count} blank rows, "
+                f"{self.duplicate_count} duplicates (expected {self.expected_duplicate_count}), "
+                f"{self.unknown_count} not in store, "
+                f"{self.mismatched_count} with a different size or MD5")
+
+
+class DrsManifestStore:
+    """ SQLite store of the distinct DRS objects of a Terra data table, in the source file order """
+
+    def __init__(self, store_filename: str):
+        self.store_filename = store_filename
+        self._connection = sqlite3.connect(store_filename)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS store_info (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS drs_objects (
+                id INTEGER PRIMARY KEY,
+                drs_uri TEXT NOT NULL UNIQUE,
+                size INTEGER,
+                md5 BLOB,
+                row_values TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS drs_objects_size ON drs_objects (size, id);
+        """)
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def __enter__(self) -> 'DrsManifestStore':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def _get_info(self, key: str) -> Optional[str]:
+        row = self._connection.execute("SELECT value FROM store_info WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    @property
+    def columns(self) -> List[str]:
+        """The columns of the source file, other than the entity ID column."""
+        return json.loads(self._get_info('columns') or "[]")
+
+    @property
+    def source_filename(self) -> Optional[str]:
+        return self._get_info('source_filename')
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM drs_objects").fetchone()[0]
+
+    def load(self, manifest_filename: str) -> Tuple[int, int]:
+        """Replace the contents of the store with the DRS objects in the manifest file.
+        Return the number of DRS objects stored and the number of duplicate rows skipped.
+        """
+        header, rows = read_manifest_rows(manifest_filename)
+        first_row = next(rows, None)
+        if first_row is None:
+            raise DrsManifestStoreException(f"The manifest file is empty: {manifest_filename}")
+        manifest_columns = detect_manifest_columns(header, first_row)
+        # The entity ID column is not stored, as the subsets are numbered when exported.
+        value_indexes = [index for index, column in enumerate(header)
+                         if not (index == 0 and column.startswith(ENTITY_ID_COLUMN_PREFIX))]
+        drs_uri_index = header.index(manifest_columns.drs_uri)
+        size_index = header.index(manifest_columns.size) if manifest_columns.size is not None else None
+        md5_index = header.index(manifest_columns.md5) if manifest_columns.md5 is not None else None
+
+        drs_uri_row_count = 0
+        with self._connection:
+            self._connection.execute("DELETE FROM drs_objects")
+            self._connection.execute("DELETE FROM store_info")
+            self._connection.executemany("INSERT INTO store_info (key, value) VALUES (?, ?)",
+                                         [('source_filename', os.path.basename(manifest_filename)),
+                                          ('columns', json.dumps([header[index] for index in value_indexes]))])
+            for row in itertools.chain([first_row], rows):
+                if len(row) <= drs_uri_index or not row[drs_uri_index].startswith("drs://"):
+                    continue
+                drs_uri_row_count += 1
+                size = parse_size(row[size_index]) if size_index is not None and size_index < len(row) else None
+                md5 = normalize_md5(row[md5_index]) if md5_index is not None and md5_index < len(row) else None
+                self._connection.execute(
+                    "INSERT OR IGNORE INTO drs_objects (drs_uri, size, md5, row_values) VALUES (?, ?, ?, ?)",
+                    (row[drs_uri_index], size, bytes.fromhex(md5) if md5 else None,
+                     json.dumps([row[index] if index < len(row) else "" for index in value_indexes])))
+        stored_count = len(self)
+        return stored_count, drs_uri_row_count - stored_count
+
+    def select_subset(self, count: int, seed: Optional[int] = None, size_balanced: bool = False) -> List[int]:
+        """Return the IDs of a subset of `count` DRS objects, in the source file order.
+
+        Without a `seed`, the subset is the first `count` objects, as in the existing size tier files.
+        With a `seed`, it is a random sample, which is the same for the same seed and store.
+        If `size_balanced`, the objects ordered by size are divided into `count` equal strata and
+        one object is sampled from each, so the subset has the size distribution of the whole store.
+        As in the existing size tier files, a subset larger than the store repeats all the objects
+        as many times as they fit, followed by a subset of the remainder.
+        """
+        ids = [object_id for object_id, in self._connection.execute("SELECT id FROM drs_objects ORDER BY id")]
+        if not ids:
+            raise DrsManifestStoreException(f"The store is empty: {self.store_filename}")
+        full_pass_count, remainder_count = divmod(count, len(ids))
+        rng = random.Random(seed if seed is not None else 0)
+        if size_balanced:
+            ids_by_size = [object_id for object_id, in
+                           self._connection.execute("SELECT id FROM drs_objects ORDER BY size, id")]
+            remainder_ids = [ids_by_size[rng.randrange(index * len(ids) // remainder_count,
+                                                       (index + 1) * len(ids) // remainder_count)]
+                             for index in range(remainder_count)]
+        elif seed is None:
+            remainder_ids = ids[:remainder_count]
+        else:
+            remainder_ids = rng.sample(ids, remainder_count)
+        return ids * full_pass_count + sorted(remainder_ids)
+
+    def iter_row_values(self, object_ids: List[int]) -> Iterator[List[str]]:
+        """Return the source file column values of the DRS objects, in the order of the IDs."""
+        batch_size = 500
+        for start in range(0, len(object_ids), batch_size):
+            batch_ids = object_ids[start:start + batch_size]
+            rows = dict(self._connection.execute(
+                f"SELECT id, row_values FROM drs_objects WHERE id IN ({','.join('?' * len(batch_ids))})",
+                batch_ids))
+            for object_id in batch_ids:
+                yield json.loads(rows[object_id])
+
+    def export_entity_tsv(self, object_ids: List[int], output_filename: str, entity_type: str) -> None:
+        """Write the DRS objects as a Terra entity TSV file, numbering the entities from 1."""
+        id_width = max(5, len(str(len(object_ids))))
+        with open(output_filename, 'w', newline='') as output_file:
+            writer = csv.writer(output_file, delimiter="\t", lineterminator="\n")
+            writer.writerow([f"{ENTITY_ID_COLUMN_PREFIX}{entity_type}_id"] + self.columns)
+            for number, row_values in enumerate(self.iter_row_values(object_ids), start=1):
+                writer.writerow([str(number).zfill(id_width)] + row_values)
+
+    def validate_manifest(self, manifest_filename: str) -> ManifestValidationResult:
+        """Check that a size tier file lists the expected number of DRS objects of the store, without
+        blank rows, duplicated only if there are more than in the store, and with the same sizes and MD5 checksums.
+        """
+        result = ManifestValidationResult(manifest_filename, get_tier_size(manifest_filename))
+        header, rows = read_manifest_rows(manifest_filename)
+        first_row = next(rows, None)
+        if first_row is None:
+            return result
+        manifest_columns = detect_manifest_columns(header, first_row)
+        drs_uri_index = header.index(manifest_columns.drs_uri)
+        size_index = header.index(manifest_columns.size) if manifest_columns.size is not None else None
+        md5_index = header.index(manifest_columns.md5) if manifest_columns.md5 is not None else None
+        seen_uris = set()
+        for row in itertools.chain([first_row], rows):
+            if not any(value.strip() for value in row):
+                # For example, the empty rows left at the end of a file exported from a spreadsheet
+                result.blank_row_count += 1
+                continue
+            result.row_count += 1
+            if len(row) <= drs_uri_index or not row[drs_uri_index].startswith("drs://"):
+                continue
+            drs_uri = row[drs_uri_index]
+            result.drs_uri_count += 1
+            if drs_uri in seen_uris:
+                result.duplicate_count += 1
+                continue
+            seen_uris.add(drs_uri)
+            stored = self._connection.execute("SELECT size, md5 FROM drs_objects WHERE drs_uri = ?",
+                                              (drs_uri,)).fetchone()
+            if stored is None:
+                result.unknown_count += 1
+                continue
+            size = parse_size(row[size_index]) if size_index is not None and size_index < len(row) else None
+            md5 = normalize_md5(row[md5_index]) if md5_index is not None and md5_index < len(row) else None
+            stored_size, stored_md5 = stored
+            if (size is not None and stored_size is not None and size != stored_size) or \
+                    (md5 is not None and stored_md5 is not None and md5 != stored_md5.hex()):
+                result.mismatched_count += 1
+        result.expected_duplicate_count = max(0, (result.expected_count or result.drs_uri_count) - len(self))
+        return result
+
+
+def parse_arg_list(arg_list: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build a DRS manifest store, and generate and validate subsets of it.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="Build the store from a complete Terra data table file")
+    build_parser.add_argument('--manifest', type=str, required=True,
+                              help="Terra data table TSV or .xlsx file listing all the DRS objects")
+    build_parser.add_argument('--store', type=str, required=True, help="SQLite store file to create or replace")
+
+    subset_parser = subparsers.add_parser('subset', help="Export a subset of the store as a Terra entity TSV file")
+    subset_parser.add_argument('--store', type=str, required=True, help="SQLite store file")
+    subset_parser.add_argument('--count', type=int, required=True, action='append',
+                               help="Number of DRS objects in the subset. May be given more than once.")
+    subset_parser.add_argument('--seed', type=int, required=False, default=None,
+                               help="Random seed for sampling the subset, rather than taking the first objects")
+    subset_parser.add_argument('--size-balanced', action='store_true',
+                               help="Sample the subset to have the object size distribution of the store")
+    subset_parser.add_argument('--entity-type-prefix', type=str, required=True,
+                               help="Terra entity type prefix, e.g. crdc_small_public_files, "
+                                    "to which the zero-padded count is appended")
+    subset_parser.add_argument('--output-dir', type=str, required=False, default=".",
+                               help="Directory to contain the exported TSV files")
+    subset_parser.add_argument('--filename-suffix', type=str, required=False, default="",
+                               help="Suffix for the exported file names, e.g. _20220421")
+
+    validate_parser = subparsers.add_parser('validate', help="Validate size tier files against the store")
+    validate_parser.add_argument('--store', type=str, required=True, help="SQLite store file")
+    validate_parser.add_argument('manifests', type=str, nargs='+', help="Size tier TSV or .xlsx files")
+
+    args = parser.parse_args(arg_list)
+    if args.command == 'subset' and any(count < 1 for count in args.count):
+        parser.error("--count must be at least 1")
+    return args
+
+
+def main(arg_list: list = None) -> None:
+    args = parse_arg_list(arg_list)
+    with DrsManifestStore(args.store) as store:
+        if args.command == 'build':
+            stored_count, duplicate_count = store.load(args.manifest)
+            print(f"Stored {stored_count} DRS objects from {args.manifest} in {args.store}, "
+                  f"skipping {duplicate_count} duplicates.")
+        elif args.command == 'subset':
+            os.makedirs(args.output_dir, exist_ok=True)
+            for count in args.count:
+                entity_type = f"{args.entity_type_prefix}_{count:05d}"
+                output_filename = os.path.join(args.output_dir, f"{entity_type}{args.filename_suffix}.txt")
+                store.export_entity_tsv(store.select_subset(count, args.seed, args.size_balanced),
+                                        output_filename, entity_type)
+                print(f"Exported {count} DRS objects to {output_filename}")
+        else:
+            results = [store.validate_manifest(manifest_filename) for manifest_filename in args.manifests]
+            for result in results:
+                print(result.summary())
+            if not all(result.is_valid for result in results):
+                raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
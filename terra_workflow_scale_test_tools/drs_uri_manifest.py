@@ -0,0 +1,136 @@
+"""DRS URI Manifest Reader
+This module reads the DRS URIs, and the sizes and MD5 checksums of the objects they refer to,
+from the Terra data table TSV files in `test_drs_uris`.
+The files for the different projects use different column names, which are detected from the header.
+"""
+
+import ast
+import base64
+import binascii
+import csv
+import itertools
+import os
+import re
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
+# Candidate column names, in order of preference
+DRS_URI_COLUMNS = ("pfb:ga4gh_drs_uri", "ga4gh_drs_uri", "pfb:drs_uri", "drs_uri", "file_ref", "pfb:object_id")
+SIZE_COLUMNS = ("pfb:file_size", "pfb:size", "size_in_bytes", "size")
+MD5_COLUMNS = ("pfb:md5sum", "pfb:file_md5sum", "md5", "md5_hash", "hashes")
+
+MANIFEST_FILENAME_PATTERN = "*.txt"
+MD5_HEX_PATTERN = re.compile(r"[0-9a-fA-F]{32}")
+
+
+class DrsUriManifestException(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class DrsObjectInfo:
+    drs_uri: str
+    size: Optional[int] = None
+    md5: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class ManifestColumns:
+    drs_uri: str
+    size: Optional[str] = None
+    md5: Optional[str] = None
+
+
+def _find_column(header: List[str], candidates: Iterable[str]) -> Optional[str]:
+    for column in candidates:
+        if column in header:
+            return column
+    return None
+
+
+def detect_manifest_columns(header: List[str], first_row: List[str] = None) -> ManifestColumns:
+    """Return the names of the columns containing the DRS URI, size and MD5 checksum.
+    If none of the known DRS URI columns is present, the first column with a DRS URI value
+    in `first_row` is used.
+    """
+    drs_uri_column = _find_column(header, DRS_URI_COLUMNS)
+    if drs_uri_column is None and first_row is not None:
+        drs_uri_column = next((column for column, value in zip(header, first_row)
+                               if value.startswith("drs://")), None)
+    if drs_uri_column is None:
+        raise DrsUriManifestException(f"No DRS URI column found in manifest header: {header}")
+    return ManifestColumns(drs_uri_column, _find_column(header, SIZE_COLUMNS), _find_column(header, MD5_COLUMNS))
+
+
+def normalize_md5(value: str) -> Optional[str]:
+    """Return the MD5 checksum as lower case hex, given it as hex, base64 or a dict of hashes."""
+    value = value.strip()
+    if not value:
+        return None
+    if value.startswith("{"):
+        # For example: {'md5': '1bd85c4862bc51911ab4b75828ae10eb'}
+        hashes = ast.literal_eval(value)
+        value = hashes.get('md5', "") if isinstance(hashes, dict) else ""
+        return normalize_md5(value)
+    if MD5_HEX_PATTERN.fullmatch(value):
+        return value.lower()
+    try:
+        digest = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return digest.hex() if len(digest) == 16 else None
+
+
+def parse_size(value: str) -> Optional[int]:
+    value = value.strip()
+    return int(value) if value.isdigit() else None
+
+
+def read_drs_manifest(manifest_filename: str) -> Iterator[DrsObjectInfo]:
+    """Read the DRS objects listed in a Terra data table TSV file."""
+    with open(manifest_filename, newline='') as manifest_file:
+        reader = csv.reader(manifest_file, delimiter="\t")
+        header = next(reader, None)
+        first_row = next(reader, None)
+        if header is None or first_row is None:
+            return
+        columns = detect_manifest_columns(header, first_row)
+        drs_uri_index = header.index(columns.drs_uri)
+        size_index = header.index(columns.size) if columns.size is not None else None
+        md5_index = header.index(columns.md5) if columns.md5 is not None else None
+        for row in itertools.chain([first_row], reader):
+            if len(row) <= drs_uri_index or not row[drs_uri_index].startswith("drs://"):
+                continue
+            size = parse_size(row[size_index]) if size_index is not None and size_index < len(row) else None
+            md5 = normalize_md5(row[md5_index]) if md5_index is not None and md5_index < len(row) else None
+            yield DrsObjectInfo(row[drs_uri_index], size, md5)
+
+
+def find_manifest_files(path: str) -> List[str]:
+    """Return the manifest file, or the manifest files found recursively in the directory, in sorted order."""
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(p.as_posix() for p in Path(path).rglob(MANIFEST_FILENAME_PATTERN))
+
+
+def read_drs_objects(paths: Iterable[str], deduplicate: bool = True) -> List[DrsObjectInfo]:
+    """Read the DRS objects from the manifest files or directories, in order.
+    Objects listed more than once are only included the first time, unless `deduplicate` is False.
+    """
+    objects = list()
+    seen_uris = set()
+    for path in paths:
+        for manifest_filename in find_manifest_files(path):
+            for info in read_drs_manifest(manifest_filename):
+                if deduplicate:
+                    if info.drs_uri in seen_uris:
+                        continue
+                    seen_uris.add(info.drs_uri)
+                objects.append(info)
+    return objects
+
+
+def read_drs_uris(paths: Iterable[str], deduplicate: bool = True) -> List[str]:
+    return [info.drs_uri for info in read_drs_objects(paths, deduplicate)]
@@ -0,0 +1,82 @@
+"""DRS URI Pool
+This module provides a pool of DRS URIs, loaded from the `test_drs_uris` manifests,
+from which the response time probes draw the DRS objects to resolve, so that the probes
+measure the latency of objects that are not already in the service caches.
+
+The URIs are stored in a single bytes buffer with an array of offsets, rather than as a
+list of str objects, so that a pool of hundreds of thousands of URIs takes only a few MB.
+"""
+
+import random
+import threading
+
+from array import array
+from typing import Iterable, List, Optional
+
+from terra_workflow_scale_test_tools.drs_uri_manifest import read_drs_uris
+
+
+class DrsUriPoolException(Exception):
+    pass
+
+
+class DrsUriPool:
+    """ Compact, sampleable pool of DRS URIs
+
+    `sample` draws URIs uniformly at random, with or without replacement.
+    Without replacement, every URI is drawn once, in random order, before any is drawn
+    again; the order is then reshuffled for the next pass through the pool.
+    """
+
+    def __init__(self, drs_uris: Iterable[str], with_replacement: bool = False, seed: Optional[int] = None):
+        buffer = bytearray()
+        self._offsets = array('Q', [0])
+        for drs_uri in drs_uris:
+            buffer += drs_uri.encode()
+            self._offsets.append(len(buffer))
+        self._buffer = bytes(buffer)
+        if len(self) == 0:
+            raise DrsUriPoolException("The DRS URI pool is empty.")
+        self.with_replacement = with_replacement
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # The permutation of the pool indexes, and the position of the next to draw, when sampling without replacement
+        self._permutation = array('I', range(len(self))) if not with_replacement else None
+        self._next_position = 0
+        # The number of complete passes through the pool when sampling without replacement
+        self.pass_count = 0
+
+    @classmethod
+    def from_manifests(cls, manifest_paths: Iterable[str], with_replacement: bool = False,
+                       seed: Optional[int] = None) -> 'DrsUriPool':
+        """Create the pool from the DRS URIs in the manifest files or directories, without duplicates."""
+        return cls(read_drs_uris(manifest_paths), with_replacement, seed)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        return self._buffer[self._offsets[index]:self._offsets[index + 1]].decode()
+
+    @property
+    def size_in_bytes(self) -> int:
+        return len(self._buffer) + self._offsets.itemsize * len(self._offsets) + \
+            (self._permutation.itemsize * len(self._permutation) if self._permutation is not None else 0)
+
+    def sample(self) -> str:
+        with self._lock:
+            if self.with_replacement:
+                return self[self._random.randrange(len(self))]
+            if self._next_position == len(self):
+                self.pass_count += 1
+                self._next_position = 0
+            # Shuffle incrementally (Fisher-Yates), so no reshuffle of the whole pool is needed to start a pass.
+            position = self._next_position
+            swap_position = self._random.randrange(position, len(self))
+            permutation = self._permutation
+            permutation[position], permutation[swap_position] = permutation[swap_position], permutation[position]
+            self._next_position += 1
+            return self[permutation[position]]
+
+    def sample_many(self, count: int) -> List[str]:
+        return [self.sample() for _ in range(count)]
@@ -0,0 +1,521 @@
+"""Extract DRS Localization Events
+Extract the DRS localization timestamps, and the DRS localization "fallback" timestamps,
+from workflow logs under a directory on the local file system to create time series data
+for graphing the DRS data access rate.
+
+DRS localization fallback occurs when the Terra workflow DRS localizer did not receive
+a signed URL within the allotted time and therefore fell back to using a cloud-native
+URI and service account key.
+
+This replaces `extract_drs_localization_timestamps.sh` and
+`extract_drs_localization_fallback_timestamps.sh`, producing the same output files
+from a single parallel scan of the workflow logs directory.
+By default the time series files contain the event count per second, with a row for
+every second between the first and last event, rather than a `Count` of 1 per event.
+
+In incremental mode, the size, modification time and extraction offsets of every log
+file are kept in a state file, and a rerun only parses the new log files and the bytes
+appended to the previously parsed ones. The new events are appended to the log lines
+files and merged into the timestamps and time series files. This allows the time series
+to be refreshed repeatedly while the workflows are running. If a log file has shrunk,
+been rewritten or removed, the output files are rebuilt from scratch.
+
+With the "parquet" output format, each time series is also written as a Parquet file,
+with the timestamps stored as UTC nanosecond timestamps and the counts as int64, which
+loads much faster for graphing than the TSV file. Writing Parquet requires `pyarrow`.
+"""
+
+import argparse
+import calendar
+import heapq
+import json
+import mmap
+import os
+import re
+import time
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, asdict
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Matches the log lines extracted by extract_drs_localization_timestamps.sh
+LOCALIZATION_LINE_MARKER = b"Localizing input drs://"
+
+# Matches the multi-line log entries extracted by extract_drs_localization_fallback_timestamps.sh
+FALLBACK_CANDIDATE_MARKER = b"Localizing input drs:"
+FALLBACK_PATTERN = re.compile(rb"\d\d\d\d/\d\d/\d\d.*Localizing input drs:.*\n"
+                              rb"Requester Pays project ID is.*\n"
+                              rb"Attempting to download.*\n"
+                              rb"Successfully activated service account.*")
+DATE_PATTERN = re.compile(rb"\d\d\d\d/\d\d/\d\d")
+
+# Log lines following the DRS localization log entries, which are all in the localization block
+LOCALIZATION_BLOCK_END_MARKERS = (b"Localization script execution complete", b"Done localization.")
+
+# The log line timestamp, as extracted by `cut -c 1-20`
+TIMESTAMP_LENGTH = 20
+TIMESTAMP_FORMAT = "%Y/%m/%d %H:%M:%S"
+
+FILES_PER_TASK = 256
+
+EXTRACTION_STATE_FILENAME = "drs_localization_extraction_state.json"
+
+
+@dataclass
+class DrsLocalizationEvents:
+    localization_log_lines: List[bytes] = field(default_factory=list)
+    fallback_log_lines: List[bytes] = field(default_factory=list)
+
+    def extend(self, other: 'DrsLocalizationEvents') -> None:
+        self.localization_log_lines.extend(other.localization_log_lines)
+        self.fallback_log_lines.extend(other.fallback_log_lines)
+
+
+@dataclass
+class LogFileState:
+    size: int
+    mtime_ns: int
+    # The localization lines have been extracted up to here.
+    localization_offset: int
+    # The fallback entries have been extracted up to here, which is before the localization offset
+    # when one of the last lines may start a fallback entry that is not yet complete.
+    fallback_offset: int
+
+
+def extract_events_from_buffer(buffer, start: int = 0, end: int = None,
+                               localization_start: int = None) -> DrsLocalizationEvents:
+    """Extract the DRS localization and fallback log entries from a bytes-like buffer (e.g. an mmap).
+
+    Localization lines starting before `localization_start`, if given, are skipped.
+    """
+    events = DrsLocalizationEvents()
+    end = len(buffer) if end is None else end
+    localization_start = start if localization_start is None else localization_start
+    pos = buffer.find(FALLBACK_CANDIDATE_MARKER, start, end)
+    while pos != -1:
+        line_start = buffer.rfind(b"\n", 0, pos) + 1
+        line_end = buffer.find(b"\n", pos, end)
+        if line_end == -1:
+            line_end = end
+
+        if line_start >= localization_start and buffer.find(LOCALIZATION_LINE_MARKER, line_start, line_end) != -1:
+            events.localization_log_lines.append(buffer[line_start:line_end])
+
+        # The fallback entry starts at the first date on the line from which the whole entry matches.
+        for date_match in DATE_PATTERN.finditer(buffer, line_start, line_end):
+            fallback_match = FALLBACK_PATTERN.match(buffer, date_match.start(), end)
+            if fallback_match:
+                events.fallback_log_lines.append(fallback_match.group().replace(b"\n", b"  "))
+                break
+
+        pos = buffer.find(FALLBACK_CANDIDATE_MARKER, line_end, end)
+    return events
+
+
+def find_localization_block_end(buffer) -> int:
+    """Return the offset just after the line ending the localization block, or -1 if it is not in the buffer."""
+    block_end = -1
+    for marker in LOCALIZATION_BLOCK_END_MARKERS:
+        pos = buffer.find(marker)
+        if pos != -1:
+            line_end = buffer.find(b"\n", pos)
+            if line_end != -1 and (block_end == -1 or line_end + 1 < block_end):
+                block_end = line_end + 1
+    return block_end
+
+
+def find_pending_fallback_start(buffer, start: int, end: int) -> int:
+    """Return the start of the first of the last lines that may begin a fallback entry not yet complete.
+
+    A fallback entry spans four lines, so one starting in the last three lines before `end`
+    may still be completed by lines appended to the log later. Returns `end` if there is none.
+    """
+    tail_start = end
+    for _ in range(3):
+        if tail_start <= start:
+            break
+        tail_start = buffer.rfind(b"\n", start, tail_start - 1) + 1
+    tail_start = max(tail_start, start)
+    pos = buffer.find(FALLBACK_CANDIDATE_MARKER, tail_start, end)
+    return end if pos == -1 else buffer.rfind(b"\n", 0, pos) + 1
+
+
+def extract_events_from_file(path: str, localization_offset: int = 0,
+                             fallback_offset: int = 0) -> Tuple[DrsLocalizationEvents, LogFileState]:
+    """Extract the events from the complete lines of the log file after the given offsets.
+
+    A last line without a trailing newline may still be being written, so it is left for the next extraction.
+    """
+    with open(path, 'rb') as fh:
+        stat = os.fstat(fh.fileno())
+        if stat.st_size == 0:
+            return DrsLocalizationEvents(), LogFileState(0, stat.st_mtime_ns, 0, 0)
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            end = buffer.rfind(b"\n") + 1
+            start = min(localization_offset, fallback_offset)
+            events = extract_events_from_buffer(buffer, start, end, localization_start=localization_offset)
+            file_state = LogFileState(len(buffer), stat.st_mtime_ns, end,
+                                      find_pending_fallback_start(buffer, start, end))
+            return events, file_state
+
+
+def extract_events_from_files(work_items: List[Tuple[str, int, int]]) \
+        -> Tuple[DrsLocalizationEvents, List[Tuple[str, LogFileState]]]:
+    events = DrsLocalizationEvents()
+    file_states = list()
+    for path, localization_offset, fallback_offset in work_items:
+        file_events, file_state = extract_events_from_file(path, localization_offset, fallback_offset)
+        events.extend(file_events)
+        file_states.append((path, file_state))
+    return events, file_states
+
+
+def iter_log_file_paths(workflow_log_dir: str) -> Iterator[str]:
+    for dirpath, dirnames, filenames in os.walk(workflow_log_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            # Skip the log list, copy manifest and partially copied files next to the task log files.
+            if filename.endswith(".log"):
+                yield os.path.join(dirpath, filename)
+
+
+def chunked(iterable: Iterable, chunk_size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def extract_events(work_items: Iterable[Tuple[str, int, int]], max_workers: int = None) \
+        -> Tuple[DrsLocalizationEvents, List[Tuple[str, LogFileState]]]:
+    """Extract the events from each (path, localization offset, fallback offset) using a pool of processes."""
+    events = DrsLocalizationEvents()
+    file_states = list()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for chunk_events, chunk_file_states in executor.map(extract_events_from_files,
+                                                            chunked(work_items, FILES_PER_TASK)):
+            events.extend(chunk_events)
+            file_states.extend(chunk_file_states)
+    return events, file_states
+
+
+def extract_events_from_directory(workflow_log_dir: str, max_workers: int = None) -> DrsLocalizationEvents:
+    events, _ = extract_events(((path, 0, 0) for path in iter_log_file_paths(workflow_log_dir)), max_workers)
+    return events
+
+
+def write_lines(path: str, lines: Iterable[bytes]) -> None:
+    with open(path, 'wb') as fh:
+        for line in lines:
+            fh.write(line)
+            fh.write(b"\n")
+
+
+def parse_timestamp(timestamp: str) -> int:
+    """Return the log timestamp in seconds since the epoch."""
+    return calendar.timegm(time.strptime(timestamp, TIMESTAMP_FORMAT))
+
+
+def format_timestamp(seconds_since_epoch: int) -> str:
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(seconds_since_epoch))
+
+
+def count_timestamps_by_bucket(timestamps: Iterable[bytes], bucket_seconds: int) -> Counter:
+    """Count the timestamps per bucket of `bucket_seconds`, keyed by the bucket start in seconds since the epoch."""
+    # Parse each distinct second only once, rather than every event timestamp.
+    second_counts = Counter(timestamp[:len("YYYY/MM/DD HH:MM:SS")] for timestamp in timestamps)
+    bucket_counts = Counter()
+    unparsable_count = 0
+    for second, count in second_counts.items():
+        try:
+            seconds_since_epoch = parse_timestamp(second.decode())
+        except ValueError:
+            unparsable_count += count
+            continue
+        bucket_counts[seconds_since_epoch - seconds_since_epoch % bucket_seconds] += count
+    if unparsable_count:
+        print(f"Warning: Skipped {unparsable_count} log entries without a leading timestamp.")
+    return bucket_counts
+
+
+def zero_fill_bucket_counts(bucket_counts: Counter, bucket_seconds: int) -> List[Tuple[int, int]]:
+    """Return the counts of every bucket between the first and the last, with a zero count if empty."""
+    if not bucket_counts:
+        return list()
+    return [(bucket, bucket_counts.get(bucket, 0))
+            for bucket in range(min(bucket_counts), max(bucket_counts) + 1, bucket_seconds)]
+
+
+def count_timestamps_per_bucket(timestamps: Iterable[bytes], bucket_seconds: int) -> List[Tuple[int, int]]:
+    """Count the timestamps per bucket of `bucket_seconds`, keyed by the bucket start in seconds since the epoch.
+
+    Every bucket between the first and the last timestamp is included, with a zero count if empty.
+    """
+    return zero_fill_bucket_counts(count_timestamps_by_bucket(timestamps, bucket_seconds), bucket_seconds)
+
+
+def write_bucket_counts(timeseries_path: str, bucket_counts: Iterable[Tuple[int, int]]) -> None:
+    write_lines(timeseries_path,
+                [b"Timestamp\tCount"] +
+                [f"{format_timestamp(bucket)}\t{count}".encode() for bucket, count in bucket_counts])
+
+
+def write_timeseries_parquet(timeseries_path: str) -> str:
+    """Write the time series TSV file as a Parquet file alongside it, and return its path."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    timestamps = list()
+    counts = list()
+    with open(timeseries_path) as fh:
+        next(fh, None)
+        for line in fh:
+            timestamp, count = line.rstrip("\n").split("\t")
+            timestamps.append(parse_timestamp(timestamp) * 1_000_000_000)
+            counts.append(int(count))
+    parquet_path = f"{os.path.splitext(timeseries_path)[0]}.parquet"
+    table = pa.table({'Timestamp': pa.array(timestamps, type=pa.timestamp('ns', tz='UTC')),
+                      'Count': pa.array(counts, type=pa.int64())})
+    pq.write_table(table, parquet_path)
+    return parquet_path
+
+
+def remove_timeseries_parquet(timeseries_path: str) -> None:
+    """Remove the Parquet file of the time series left by an earlier extraction, which would be read instead."""
+    parquet_path = f"{os.path.splitext(timeseries_path)[0]}.parquet"
+    if os.path.exists(parquet_path):
+        os.remove(parquet_path)
+
+
+def read_bucket_counts(timeseries_path: str) -> Counter:
+    bucket_counts = Counter()
+    with open(timeseries_path) as fh:
+        next(fh, None)
+        for line in fh:
+            timestamp, count = line.rstrip("\n").split("\t")
+            bucket_counts[parse_timestamp(timestamp)] += int(count)
+    return bucket_counts
+
+
+def write_event_files(log_lines: List[bytes], log_lines_path: str, timestamps_path: str, timeseries_path: str,
+                      bucket_seconds: Optional[int] = 1) -> None:
+    write_lines(log_lines_path, log_lines)
+
+    # Extract the timestamps from the log entries.
+    timestamps = sorted(line[:TIMESTAMP_LENGTH] for line in log_lines)
+    write_lines(timestamps_path, timestamps)
+
+    # Convert the timestamps to time series data.
+    if bucket_seconds is None:
+        write_lines(timeseries_path, [b"Timestamp\tCount"] + [timestamp + b"\t1" for timestamp in timestamps])
+    else:
+        write_bucket_counts(timeseries_path, count_timestamps_per_bucket(timestamps, bucket_seconds))
+
+
+def read_lines(path: str) -> Iterator[bytes]:
+    with open(path, 'rb') as fh:
+        for line in fh:
+            yield line.rstrip(b"\n")
+
+
+def merge_event_files(new_log_lines: List[bytes], log_lines_path: str, timestamps_path: str, timeseries_path: str,
+                      bucket_seconds: Optional[int] = 1) -> None:
+    """Add new log lines to the event files previously written by `write_event_files`."""
+    if not os.path.exists(log_lines_path):
+        write_event_files(new_log_lines, log_lines_path, timestamps_path, timeseries_path, bucket_seconds)
+        return
+    if not new_log_lines:
+        return
+
+    with open(log_lines_path, 'ab') as fh:
+        for line in new_log_lines:
+            fh.write(line)
+            fh.write(b"\n")
+
+    # Merge the new timestamps into the sorted timestamps.
+    new_timestamps = sorted(line[:TIMESTAMP_LENGTH] for line in new_log_lines)
+    tmp_path = f"{timestamps_path}.tmp"
+    write_lines(tmp_path, heapq.merge(read_lines(timestamps_path), new_timestamps))
+    os.replace(tmp_path, timestamps_path)
+
+    # Add the new event counts to the time series data.
+    if bucket_seconds is None:
+        write_lines(timeseries_path,
+                    [b"Timestamp\tCount"] + [timestamp + b"\t1" for timestamp in read_lines(timestamps_path)])
+    else:
+        bucket_counts = read_bucket_counts(timeseries_path)
+        bucket_counts.update(count_timestamps_by_bucket(new_timestamps, bucket_seconds))
+        write_bucket_counts(timeseries_path, zero_fill_bucket_counts(bucket_counts, bucket_seconds))
+
+
+@dataclass
+class ExtractionState:
+    """ The log files extracted so far, and the options and outputs of the extraction """
+    bucket_seconds: Optional[int]
+    # The size of each log lines output file, to detect an extraction that was interrupted
+    output_sizes: Dict[str, int] = field(default_factory=dict)
+    # The state of each log file, keyed by its path relative to the workflow logs directory
+    log_files: Dict[str, LogFileState] = field(default_factory=dict)
+
+    @staticmethod
+    def load(path: str) -> Optional['ExtractionState']:
+        if not os.path.exists(path):
+            return None
+        with open(path) as fh:
+            state = json.load(fh)
+        return ExtractionState(state["bucket_seconds"], state["output_sizes"],
+                               {log_file: LogFileState(*file_state)
+                                for log_file, file_state in state["log_files"].items()})
+
+    def save(self, path: str) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as fh:
+            json.dump(dict(bucket_seconds=self.bucket_seconds,
+                           output_sizes=self.output_sizes,
+                           log_files={log_file: list(asdict(file_state).values())
+                                      for log_file, file_state in self.log_files.items()}),
+                      fh)
+        os.replace(tmp_path, path)
+
+
+def get_output_sizes(output_paths: List[str]) -> Dict[str, int]:
+    return {os.path.basename(path): os.path.getsize(path) for path in output_paths if os.path.exists(path)}
+
+
+def plan_incremental_extraction(workflow_log_dir: str, state: ExtractionState) \
+        -> Optional[List[Tuple[str, int, int]]]:
+    """Return the (path, localization offset, fallback offset) of the log files with new content to extract.
+
+    Returns None if the output files must be rebuilt, because a log file shrank, was rewritten or was removed.
+    """
+    work_items = list()
+    remaining_log_files = set(state.log_files)
+    for path in iter_log_file_paths(workflow_log_dir):
+        log_file = os.path.relpath(path, workflow_log_dir)
+        remaining_log_files.discard(log_file)
+        file_state = state.log_files.get(log_file)
+        if file_state is None:
+            work_items.append((path, 0, 0))
+            continue
+        stat = os.stat(path)
+        if stat.st_size < file_state.size or \
+                (stat.st_size == file_state.size and stat.st_mtime_ns != file_state.mtime_ns):
+            print(f"The log file has shrunk or been rewritten: {path}")
+            return None
+        if stat.st_size > file_state.size:
+            work_items.append((path, file_state.localization_offset, file_state.fallback_offset))
+    if remaining_log_files:
+        print(f"{len(remaining_log_files)} previously extracted log files have been removed.")
+        return None
+    return work_items
+
+
+def extract_drs_localization_events(wf_test_results_dir: str, max_workers: int = None,
+                                    bucket_seconds: Optional[int] = 1,
+                                    incremental: bool = False,
+                                    output_format: str = "tsv") -> DrsLocalizationEvents:
+    """Extract the DRS localization events from the workflow logs and write the time series files.
+
+    The time series contain the event count per `bucket_seconds`, or if it is None,
+    a row with a `Count` of 1 for each event.
+    When the `output_format` is "parquet", the time series are also written as Parquet files.
+    When `incremental`, only the log file content added since the previous extraction is
+    parsed, and the events returned are only the new ones.
+    """
+    workflow_log_dir = os.path.join(wf_test_results_dir, "workflow-logs")
+    state_path = os.path.join(wf_test_results_dir, EXTRACTION_STATE_FILENAME)
+    log_lines_path = os.path.join(wf_test_results_dir, "drs_localization_log_lines.txt")
+    fallback_log_lines_path = os.path.join(wf_test_results_dir, "drs_localization_fallback_log_lines.txt")
+
+    state = ExtractionState.load(state_path) if incremental else None
+    work_items = None
+    if state is not None:
+        if state.bucket_seconds != bucket_seconds:
+            print("The time series bucket size has changed.")
+        elif state.output_sizes != get_output_sizes([log_lines_path, fallback_log_lines_path]):
+            print("The output files have changed since the previous extraction.")
+        else:
+            work_items = plan_incremental_extraction(workflow_log_dir, state)
+    merge = work_items is not None
+    if merge:
+        print(f"Extracting from {len(work_items)} new or updated log files.")
+    else:
+        if incremental:
+            print("Extracting from all log files.")
+        state = ExtractionState(bucket_seconds)
+        work_items = [(path, 0, 0) for path in iter_log_file_paths(workflow_log_dir)]
+
+    events, file_states = extract_events(work_items, max_workers)
+    write_or_merge_event_files = merge_event_files if merge else write_event_files
+
+    print(f"DRS URI localization log lines found: {len(events.localization_log_lines)}")
+    timeseries_path = os.path.join(wf_test_results_dir, "drs_localization_timeseries.tsv")
+    write_or_merge_event_files(events.localization_log_lines, log_lines_path,
+                               os.path.join(wf_test_results_dir, "drs_localization_timestamps.txt"),
+                               timeseries_path, bucket_seconds)
+    if output_format == "parquet":
+        timeseries_path = write_timeseries_parquet(timeseries_path)
+    else:
+        remove_timeseries_parquet(timeseries_path)
+    print(f"Done extracting DRS localization time series data to: {timeseries_path}")
+
+    print(f"DRS URI fallback localization log lines found: {len(events.fallback_log_lines)}")
+    # As with the shell scripts, the fallback files are only created when fallbacks occurred.
+    if events.fallback_log_lines:
+        fallback_timeseries_path = os.path.join(wf_test_results_dir, "drs_localization_fallback_timeseries.tsv")
+        write_or_merge_event_files(events.fallback_log_lines, fallback_log_lines_path,
+                                   os.path.join(wf_test_results_dir, "drs_localization_fallback_timestamps.txt"),
+                                   fallback_timeseries_path, bucket_seconds)
+        if output_format == "parquet":
+            fallback_timeseries_path = write_timeseries_parquet(fallback_timeseries_path)
+        else:
+            remove_timeseries_parquet(fallback_timeseries_path)
+        print(f"Done extracting DRS localization fallback time series data to: {fallback_timeseries_path}")
+    elif not merge:
+        # Remove any fallback files left behind by an earlier extraction.
+        for filename in ["drs_localization_fallback_log_lines.txt", "drs_localization_fallback_timestamps.txt",
+                         "drs_localization_fallback_timeseries.tsv",
+                         "drs_localization_fallback_timeseries.parquet"]:
+            if os.path.exists(os.path.join(wf_test_results_dir, filename)):
+                os.remove(os.path.join(wf_test_results_dir, filename))
+
+    for path, file_state in file_states:
+        state.log_files[os.path.relpath(path, workflow_log_dir)] = file_state
+    state.output_sizes = get_output_sizes([log_lines_path, fallback_log_lines_path])
+    state.save(state_path)
+    return events
+
+
+def parse_arg_list(arg_list: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Extract DRS localization time series data from workflow logs.")
+    parser.add_argument('-d', '--wf-test-results-dir', type=str, required=True,
+                        help="Workflow test results directory path, containing the workflow-logs directory")
+    parser.add_argument('--max-workers', type=int, required=False, default=None,
+                        help="Number of worker processes (defaults to the number of CPUs)")
+    parser.add_argument('--bucket-seconds', type=int, required=False, default=1,
+                        help="Width of the time series buckets in seconds")
+    parser.add_argument('--per-event', action='store_true',
+                        help="Write a time series row for each event, as the shell scripts did, "
+                             "rather than counts per bucket")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only extract from the log file content added since the previous extraction")
+    parser.add_argument('--output-format', type=str, required=False, default="tsv", choices=["tsv", "parquet"],
+                        help="Format of the time series files: tsv, or parquet to also write typed columnar files")
+    args = parser.parse_args(arg_list)
+    if args.bucket_seconds < 1:
+        parser.error("--bucket-seconds must be at least 1")
+    return args
+
+
+def main(arg_list: list = None) -> None:
+    args = parse_arg_list(arg_list)
+    extract_drs_localization_events(args.wf_test_results_dir, args.max_workers,
+                                    None if args.per_event else args.bucket_seconds, args.incremental,
+                                    args.output_format)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Extract MD5 File Metrics
+Extract the per-file metrics records written by the `md5s` task of the `md5_n_by_m_scatter`
+workflows when run with `use_hashlib`, from workflow logs under a directory on the local
+file system, to create time series data of the hashing throughput for graphing next to
+the DRS data access rate.
+
+Each record gives the size of a file and the times at which hashing it started and ended,
+so the time spent hashing each file can be separated from the time spent localizing it.
+The throughput time series contains the bytes hashed and the files completed per second,
+with the bytes of each file spread evenly over the time it took to hash it.
+"""
+
+import argparse
+import json
+import mmap
+import os
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, List
+
+from terra_workflow_scale_test_tools.extract_drs_localization_events import FILES_PER_TASK, chunked, \
+    format_timestamp, iter_log_file_paths, write_lines
+
+# Matches the records printed by the md5s task
+FILE_METRICS_MARKER = b" md5_file_metrics {"
+
+FILE_METRICS_FILENAME = "md5_file_metrics.tsv"
+THROUGHPUT_TIMESERIES_FILENAME = "md5_hash_throughput_timeseries.tsv"
+
+
+@dataclass
+class FileMetrics:
+    file: str
+    size: int
+    start_time: float
+    end_time: float
+
+    @property
+    def hash_seconds(self) -> float:
+        return self.end_time - self.start_time
+
+
+def extract_file_metrics_from_file(path: str) -> List[FileMetrics]:
+    with open(path, 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return list()
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            file_metrics = list()
+            pos = buffer.find(FILE_METRICS_MARKER)
+            while pos != -1:
+                record_start = pos + len(FILE_METRICS_MARKER) - 1
+                line_end = buffer.find(b"\n", record_start)
+                if line_end == -1:
+                    # The last line may still be being written.
+                    break
+                try:
+                    record = json.loads(buffer[record_start:line_end])
+                    file_metrics.append(FileMetrics(record['file'], record['size'],
+                                                    record['start_time'], record['end_time']))
+                except (ValueError, KeyError):
+                    print(f"Warning: Skipped an unparsable file metrics record in: {path}")
+                pos = buffer.find(FILE_METRICS_MARKER, line_end)
+            return file_metrics
+
+
+def extract_file_metrics_from_files(paths: List[str]) -> List[FileMetrics]:
+    file_metrics = list()
+    for path in paths:
+        file_metrics.extend(extract_file_metrics_from_file(path))
+    return file_metrics
+
+
+def extract_file_metrics(paths: Iterable[str], max_workers: int = None) -> List[FileMetrics]:
+    """Extract the file metrics records from the log files using a pool of processes."""
+    file_metrics = list()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for chunk_file_metrics in executor.map(extract_file_metrics_from_files, chunked(paths, FILES_PER_TASK)):
+            file_metrics.extend(chunk_file_metrics)
+    return sorted(file_metrics, key=lambda metrics: metrics.end_time)
+
+
+def write_file_metrics(file_metrics_path: str, file_metrics: List[FileMetrics]) -> None:
+    write_lines(file_metrics_path,
+                [b"EndTimestamp\tStartTimestamp\tSize\tHashSeconds\tBytesPerSecond\tFile"] +
+                [(f"{format_timestamp(int(metrics.end_time))}\t{format_timestamp(int(metrics.start_time))}\t"
+                  f"{metrics.size}\t{metrics.hash_seconds:.6f}\t"
+                  f"{metrics.size / metrics.hash_seconds if metrics.hash_seconds > 0 else 0:.1f}\t"
+                  f"{metrics.file}").encode()
+                 for metrics in file_metrics])
+
+
+def count_throughput_per_bucket(file_metrics: List[FileMetrics], bucket_seconds: int) -> List[tuple]:
+    """Return the bytes hashed and the files completed per bucket of `bucket_seconds`,
+    for every bucket between the first and the last, keyed by the bucket start in seconds since the epoch.
+    """
+    bucket_bytes = Counter()
+    bucket_files = Counter()
+    for metrics in file_metrics:
+        bucket_files[int(metrics.end_time) // bucket_seconds * bucket_seconds] += 1
+        first_bucket = int(metrics.start_time) // bucket_seconds * bucket_seconds
+        last_bucket = int(metrics.end_time) // bucket_seconds * bucket_seconds
+        if metrics.hash_seconds <= 0 or first_bucket == last_bucket:
+            bucket_bytes[last_bucket] += metrics.size
+            continue
+        # Spread the bytes over the buckets in proportion to the hashing time in each.
+        for bucket in range(first_bucket, last_bucket + 1, bucket_seconds):
+            overlap_seconds = min(metrics.end_time, bucket + bucket_seconds) - max(metrics.start_time, bucket)
+            bucket_bytes[bucket] += metrics.size * max(overlap_seconds, 0) / metrics.hash_seconds
+    if not bucket_files:
+        return list()
+    buckets = set(bucket_bytes) | set(bucket_files)
+    return [(bucket, bucket_bytes.get(bucket, 0), bucket_files.get(bucket, 0))
+            for bucket in range(min(buckets), max(buckets) + 1, bucket_seconds)]
+
+
+def write_throughput_timeseries(timeseries_path: str, bucket_throughputs: List[tuple], bucket_seconds: int) -> None:
+    # The rates are per second, whatever the bucket width.
+    write_lines(timeseries_path,
+                [b"Timestamp\tBytesPerSecond\tFilesPerSecond"] +
+                [f"{format_timestamp(bucket)}\t{round(byte_count / bucket_seconds)}\t"
+                 f"{file_count / bucket_seconds:g}".encode()
+                 for bucket, byte_count, file_count in bucket_throughputs])
+
+
+def extract_md5_file_metrics(wf_test_results_dir: str, max_workers: int = None,
+                             bucket_seconds: int = 1) -> List[FileMetrics]:
+    """Extract the MD5 file metrics from the workflow logs and write the file metrics and throughput files."""
+    workflow_log_dir = os.path.join(wf_test_results_dir, "workflow-logs")
+    file_metrics = extract_file_metrics(iter_log_file_paths(workflow_log_dir), max_workers)
+    print(f"MD5 file metrics records found: {len(file_metrics)}")
+    if not file_metrics:
+        # The records are only written by the md5s task when run with use_hashlib, after the DRS localization block.
+        print("The MD5 file metrics records are only present in the complete logs of workflows run with use_hashlib, "
+              "not in logs copied with --head-bytes.")
+        return file_metrics
+
+    file_metrics_path = os.path.join(wf_test_results_dir, FILE_METRICS_FILENAME)
+    write_file_metrics(file_metrics_path, file_metrics)
+    print(f"Done extracting MD5 file metrics to: {file_metrics_path}")
+
+    timeseries_path = os.path.join(wf_test_results_dir, THROUGHPUT_TIMESERIES_FILENAME)
+    write_throughput_timeseries(timeseries_path, count_throughput_per_bucket(file_metrics, bucket_seconds),
+                                bucket_seconds)
+    print(f"Done extracting MD5 hash throughput time series data to: {timeseries_path}")
+    return file_metrics
+
+
+def parse_arg_list(arg_list: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Extract MD5 hash throughput time series data from workflow logs.")
+    parser.add_argument('-d', '--wf-test-results-dir', type=str, required=True,
+                        help="Workflow test results directory path, containing the workflow-logs directory")
+    parser.add_argument('--max-workers', type=int, required=False, default=None,
+                        help="Number of worker processes (defaults to the number of CPUs)")
+    parser.add_argument('--bucket-seconds', type=int, required=False, default=1,
+                        help="Width of the time series buckets in seconds")
+    args = parser.parse_args(arg_list)
+    if args.bucket_seconds < 1:
+        parser.error("--bucket-seconds must be at least 1")
+    return args
+
+
+def main(arg_list: list = None) -> None:
+    args = parse_arg_list(arg_list)
+    extract_md5_file_metrics(args.wf_test_results_dir, args.max_workers, args.bucket_seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""HTTP Request Phase Timing
+This module measures the duration of each phase of an aiohttp request, using aiohttp
+request tracing and a monotonic high-resolution clock, so that a change in response time
+can be attributed to the layer that caused it:
+
+* `pool_wait`: waiting for a free connection in the connection pool
+* `dns`: resolving the host name (not done when the DNS cache or a pooled connection is used)
+* `connect`: the TCP connection handshake
+* `tls`: the TLS handshake
+* `ttfb`: from sending the request headers to receiving the response headers (server time)
+* `body`: reading the response body
+
+A phase that did not occur for a request, e.g. connecting on a reused connection, has no duration.
+The durations of a phase repeated for redirects are summed.
+"""
+
+import contextvars
+import ssl
+import time
+
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+import aiohttp
+
+PHASE_NAMES = ['pool_wait', 'dns', 'connect', 'tls', 'ttfb', 'body']
+
+# The timer of the request being made in the current task, for the TLS handshake timing
+_current_timer: contextvars.ContextVar = contextvars.ContextVar("http_phase_timer", default=None)
+
+
+class RequestPhaseTimer:
+    """ Durations of the phases of a single request, in seconds """
+
+    def __init__(self):
+        self.durations: Dict[str, float] = dict()
+        self._phase_starts: Dict[str, float] = dict()
+        self._token = None
+
+    def __enter__(self) -> 'RequestPhaseTimer':
+        self._token = _current_timer.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        _current_timer.reset(self._token)
+
+    def start(self, phase_name: str, now: float = None) -> None:
+        self._phase_starts[phase_name] = time.perf_counter() if now is None else now
+
+    def end(self, phase_name: str, now: float = None) -> None:
+        start = self._phase_starts.pop(phase_name, None)
+        if start is not None:
+            now = time.perf_counter() if now is None else now
+            self.durations[phase_name] = self.durations.get(phase_name, 0.0) + now - start
+
+    def get_phase_durations(self) -> Dict[str, Optional[float]]:
+        """Return the duration of each phase, or None if it did not occur, rounded to microseconds.
+        The connect phase is measured including the DNS and TLS phases, which are excluded here.
+        """
+        durations = dict(self.durations)
+        if 'connect' in durations:
+            durations['connect'] = max(0.0, durations['connect'] - durations.get('dns', 0.0) -
+                                       durations.get('tls', 0.0))
+        return {phase_name: round(durations[phase_name], 6) if phase_name in durations else None
+                for phase_name in PHASE_NAMES}
+
+
+class _TimedSSLObject(ssl.SSLObject):
+    """ Records the TLS handshake time of the current request timer """
+
+    def do_handshake(self) -> None:
+        timer = _current_timer.get()
+        if timer is not None and 'tls' not in timer._phase_starts:
+            timer.start('tls')
+        # Raises SSLWantReadError until the handshake is complete.
+        super().do_handshake()
+        if timer is not None:
+            timer.end('tls')
+
+
+def create_timed_ssl_context() -> ssl.SSLContext:
+    """Return a default SSL context that records the TLS handshake time of each request."""
+    context = ssl.create_default_context()
+    context.sslobject_class = _TimedSSLObject
+    return context
+
+
+def _get_timer(trace_config_ctx: SimpleNamespace) -> Optional[RequestPhaseTimer]:
+    timer = trace_config_ctx.trace_request_ctx
+    return timer if isinstance(timer, RequestPhaseTimer) else None
+
+
+def _phase_callback(phase_name: str, is_start: bool):
+    async def callback(session: aiohttp.ClientSession, trace_config_ctx: SimpleNamespace, params) -> None:
+        timer = _get_timer(trace_config_ctx)
+        if timer is not None:
+            if is_start:
+                timer.start(phase_name)
+            else:
+                timer.end(phase_name)
+    return callback
+
+
+def create_phase_trace_config() -> aiohttp.TraceConfig:
+    """Return a trace config that records the phase durations of requests made with a
+    `RequestPhaseTimer` as the `trace_request_ctx`.
+    """
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_queued_start.append(_phase_callback('pool_wait', True))
+    trace_config.on_connection_queued_end.append(_phase_callback('pool_wait', False))
+    trace_config.on_dns_resolvehost_start.append(_phase_callback('dns', True))
+    trace_config.on_dns_resolvehost_end.append(_phase_callback('dns', False))
+    trace_config.on_connection_create_start.append(_phase_callback('connect', True))
+    trace_config.on_connection_create_end.append(_phase_callback('connect', False))
+    trace_config.on_request_headers_sent.append(_phase_callback('ttfb', True))
+    trace_config.on_request_end.append(_phase_callback('ttfb', False))
+    trace_config.on_request_redirect.append(_phase_callback('ttfb', False))
+    return trace_config
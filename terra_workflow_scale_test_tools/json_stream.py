@@ -0,0 +1,190 @@
+"""Streaming JSON Parser
+This module parses a JSON document incrementally, from chunks of bytes as they are received,
+into a stream of parse events, so that only the values that are needed are materialized.
+This keeps the memory and time used to poll large JSON documents, such as the status of
+a submission with tens of thousands of workflows, small.
+
+As with `ijson`, each event is a `(prefix, event, value)` tuple, where the prefix is the
+dot-separated path to the current value, with `item` for the elements of an array.
+For example, `{"status": "Done", "workflows": [{"status": "Succeeded"}]}` produces:
+
+    ('', 'start_map', None)
+    ('', 'map_key', 'status')
+    ('status', 'string', 'Done')
+    ('', 'map_key', 'workflows')
+    ('workflows', 'start_array', None)
+    ('workflows.item', 'start_map', None)
+    ('workflows.item', 'map_key', 'status')
+    ('workflows.item.status', 'string', 'Succeeded')
+    ('workflows.item', 'end_map', None)
+    ('workflows', 'end_array', None)
+    ('', 'end_map', None)
+"""
+
+import codecs
+import json
+import re
+
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+JsonEvent = Tuple[str, str, Any]
+
+TOKEN_PATTERN = re.compile(r'[ \t\n\r]*(?:'
+                           r'([{}\[\],:])|'
+                           r'"([^"\\]*(?:\\.[^"\\]*)*)"|'
+                           r'(-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?)|'
+                           r'(true|false|null))')
+WHITESPACE_PATTERN = re.compile(r'[ \t\n\r]*')
+VALUE_DELIMITERS = " \t\n\r,]}"
+
+LITERAL_VALUES = {"true": ("boolean", True), "false": ("boolean", False), "null": ("null", None)}
+
+
+def _join_prefix(prefix: str, name: str) -> str:
+    return f"{prefix}.{name}" if prefix else name
+
+
+class _Container:
+    def __init__(self, prefix: str, is_map: bool):
+        self.prefix = prefix
+        self.is_map = is_map
+        self.expecting_key = is_map
+        # The prefix of the values in the container
+        self.value_prefix = prefix if is_map else _join_prefix(prefix, "item")
+
+
+class JsonEventParser:
+    """ Incremental JSON parser producing parse events
+
+    Data is passed to `feed` as it is received, and `close` is called at the end of the document.
+    Both return the events for the tokens completed so far.
+    The parser does not fully validate the document structure.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._containers: List[_Container] = list()
+
+    def _parse(self, final: bool) -> Iterator[JsonEvent]:
+        buffer = self._buffer
+        buffer_length = len(buffer)
+        containers = self._containers
+        pos = 0
+        for match in TOKEN_PATTERN.finditer(buffer):
+            if match.start() != pos:
+                # An incomplete or invalid token
+                break
+            token_type = match.lastindex
+            if not final and token_type >= 3 and \
+                    (match.end() == buffer_length or buffer[match.end()] not in VALUE_DELIMITERS):
+                # The number or literal may continue in the next chunk.
+                break
+            pos = match.end()
+            prefix = containers[-1].value_prefix if containers else ""
+            if token_type == 1:
+                punctuation = match.group(1)
+                if punctuation == "{":
+                    yield prefix, "start_map", None
+                    containers.append(_Container(prefix, True))
+                elif punctuation == "[":
+                    yield prefix, "start_array", None
+                    containers.append(_Container(prefix, False))
+                elif punctuation == "}":
+                    yield containers.pop().prefix, "end_map", None
+                elif punctuation == "]":
+                    yield containers.pop().prefix, "end_array", None
+                elif punctuation == "," and containers[-1].is_map:
+                    containers[-1].expecting_key = True
+            elif token_type == 2:
+                value = match.group(2)
+                if "\\" in value:
+                    value = json.loads(f'"{value}"')
+                if containers and containers[-1].expecting_key:
+                    container = containers[-1]
+                    container.expecting_key = False
+                    container.value_prefix = _join_prefix(container.prefix, value)
+                    yield container.prefix, "map_key", value
+                else:
+                    yield prefix, "string", value
+            elif token_type == 3:
+                number = match.group(3)
+                is_float = "." in number or "e" in number or "E" in number
+                yield prefix, "number", float(number) if is_float else int(number)
+            else:
+                yield (prefix,) + LITERAL_VALUES[match.group(4)]
+        self._buffer = buffer[pos:]
+        if final and WHITESPACE_PATTERN.fullmatch(self._buffer) is None:
+            raise ValueError(f"Invalid JSON at: '{self._buffer[:40]}'")
+
+    def feed(self, data: bytes) -> Iterator[JsonEvent]:
+        self._buffer += self._decoder.decode(data)
+        return self._parse(final=False)
+
+    def close(self) -> Iterator[JsonEvent]:
+        self._buffer += self._decoder.decode(b"", final=True)
+        return self._parse(final=True)
+
+
+def parse_json_events(chunks: Iterable[bytes]) -> Iterator[JsonEvent]:
+    """Parse a JSON document, received in chunks of bytes, into parse events."""
+    parser = JsonEventParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+class _ValueBuilder:
+    def __init__(self):
+        self.containers: List[Any] = list()
+        self.keys: List[Optional[str]] = list()
+        self.value: Any = None
+
+    def _add(self, value: Any) -> None:
+        if not self.containers:
+            self.value = value
+        elif isinstance(self.containers[-1], list):
+            self.containers[-1].append(value)
+        else:
+            self.containers[-1][self.keys[-1]] = value
+
+    def event(self, event: str, value: Any) -> bool:
+        """Add the event to the value being built, and return whether the value is complete."""
+        if event == "map_key":
+            self.keys[-1] = value
+        elif event in ("start_map", "start_array"):
+            container = dict() if event == "start_map" else list()
+            self._add(container)
+            self.containers.append(container)
+            self.keys.append(None)
+        elif event in ("end_map", "end_array"):
+            self.containers.pop()
+            self.keys.pop()
+        else:
+            self._add(value)
+        return not self.containers
+
+
+def materialize(events: Iterable[JsonEvent], prefixes: Set[str],
+                on_event: Callable[[str, str, Any], None] = None) -> Dict[str, Any]:
+    """Return the values at the given prefixes, building only those values from the parse events.
+
+    Every event is also passed to `on_event`, if given, for example to aggregate values
+    that are not materialized. If a prefix matches more than one value, the last one is returned.
+    """
+    values = dict()
+    builder: Optional[_ValueBuilder] = None
+    builder_prefix = None
+    for prefix, event, value in events:
+        if on_event is not None:
+            on_event(prefix, event, value)
+        if builder is None:
+            if prefix in prefixes and event not in ("map_key", "end_map", "end_array"):
+                builder = _ValueBuilder()
+                builder_prefix = prefix
+            else:
+                continue
+        if builder.event(event, value):
+            values[builder_prefix] = builder.value
+            builder = None
+    return values
@@ -0,0 +1,276 @@
+"""Latency Histograms
+This module provides fixed-memory, mergeable latency histograms, with the log-linear
+bucket layout of HdrHistogram, and rolling windows of them, so that latency percentiles
+can be reported while monitoring runs, in constant memory however long it runs.
+
+Snapshots of the histograms are written as JSON lines. Each snapshot contains the
+sparse bucket counts of the interval it covers, so that snapshots can be merged later
+to compute the percentiles over any time range, and the rolling window percentiles.
+"""
+
+import json
+import os
+import threading
+import time
+
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# The percentiles reported for each window
+REPORTED_PERCENTILES = [50.0, 95.0, 99.0, 99.9]
+
+
+class LatencyHistogram:
+    """ Log-linear histogram of latencies, in seconds
+
+    Latencies are counted in integer units of `unit_seconds` (microseconds by default).
+    Values below 2 * 2^`sub_bucket_bits` units are counted exactly; above that, each power of
+    two range is divided into 2^`sub_bucket_bits` buckets, so the relative error of a
+    reported value is at most 1 / 2^`sub_bucket_bits` (under 1% by default).
+    Values above `max_seconds` are counted in the highest bucket.
+    The counts are a numpy array, so that merging histograms and finding percentiles are vectorized.
+    """
+    unit_seconds = 1e-6
+    sub_bucket_bits = 7
+    max_seconds = 3600.0
+
+    def __init__(self):
+        self._sub_bucket_half_count = 1 << self.sub_bucket_bits
+        self._sub_bucket_count = 2 * self._sub_bucket_half_count
+        self._max_value = int(self.max_seconds / self.unit_seconds)
+        self.counts = np.zeros(self._get_index(self._max_value) + 1, dtype=np.int64)
+        self.total_count = 0
+        self.min_seconds: Optional[float] = None
+        self.max_recorded_seconds: Optional[float] = None
+
+    def _get_index(self, value: int) -> int:
+        if value < self._sub_bucket_count:
+            return value
+        shift = value.bit_length() - (self.sub_bucket_bits + 1)
+        return self._sub_bucket_count + (shift - 1) * self._sub_bucket_half_count + \
+            (value >> shift) - self._sub_bucket_half_count
+
+    def _get_value_range(self, index: int) -> Tuple[int, int]:
+        """Return the lowest value and the width of the range of values counted in the bucket."""
+        if index < self._sub_bucket_count:
+            return index, 1
+        offset = index - self._sub_bucket_count
+        shift = offset // self._sub_bucket_half_count + 1
+        sub_bucket = offset % self._sub_bucket_half_count + self._sub_bucket_half_count
+        return sub_bucket << shift, 1 << shift
+
+    def record(self, seconds: float, count: int = 1) -> None:
+        value = min(max(int(round(seconds / self.unit_seconds)), 0), self._max_value)
+        self.counts[self._get_index(value)] += count
+        self.total_count += count
+        if self.min_seconds is None or seconds < self.min_seconds:
+            self.min_seconds = seconds
+        if self.max_recorded_seconds is None or seconds > self.max_recorded_seconds:
+            self.max_recorded_seconds = seconds
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        if len(other.counts) != len(self.counts):
+            raise Exception("Cannot merge latency histograms with different bucket layouts.")
+        self.counts += other.counts
+        self.total_count += other.total_count
+        if other.min_seconds is not None and (self.min_seconds is None or other.min_seconds < self.min_seconds):
+            self.min_seconds = other.min_seconds
+        if other.max_recorded_seconds is not None and \
+                (self.max_recorded_seconds is None or other.max_recorded_seconds > self.max_recorded_seconds):
+            self.max_recorded_seconds = other.max_recorded_seconds
+
+    def _get_percentile(self, cumulative_counts: np.ndarray, percent: float) -> Optional[float]:
+        if self.total_count == 0:
+            return None
+        rank = max(1, int(percent / 100.0 * self.total_count + 0.5))
+        # The first bucket at which the cumulative count reaches the rank
+        index = int(np.searchsorted(cumulative_counts, rank))
+        if index == len(cumulative_counts):
+            return self.max_recorded_seconds
+        lowest_value, width = self._get_value_range(index)
+        seconds = (lowest_value + (width - 1) / 2) * self.unit_seconds
+        # The midpoint may lie outside the range of the values recorded.
+        return min(max(seconds, self.min_seconds), self.max_recorded_seconds)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """Return the latency at the given percentile, as the midpoint of its bucket, or None if empty."""
+        return self._get_percentile(np.cumsum(self.counts), percent)
+
+    def percentiles(self, percents: Iterable[float] = None) -> Dict[str, Optional[float]]:
+        percents = REPORTED_PERCENTILES if percents is None else percents
+        cumulative_counts = np.cumsum(self.counts)
+        return {f"p{percent:g}": self._get_percentile(cumulative_counts, percent) for percent in percents}
+
+    def reset(self) -> None:
+        self.counts.fill(0)
+        self.total_count = 0
+        self.min_seconds = None
+        self.max_recorded_seconds = None
+
+    def to_dict(self) -> dict:
+        """Return a compact representation of the histogram, with only the non-zero bucket counts."""
+        return dict(unit_seconds=self.unit_seconds, sub_bucket_bits=self.sub_bucket_bits,
+                    min=self.min_seconds, max=self.max_recorded_seconds,
+                    counts=[[int(index), int(self.counts[index])] for index in np.flatnonzero(self.counts)])
+
+    @classmethod
+    def from_dict(cls, histogram_dict: dict) -> 'LatencyHistogram':
+        histogram = cls()
+        if histogram_dict['unit_seconds'] != histogram.unit_seconds or \
+                histogram_dict['sub_bucket_bits'] != histogram.sub_bucket_bits:
+            raise Exception("The latency histogram has a different bucket layout.")
+        for index, count in histogram_dict['counts']:
+            histogram.counts[index] += count
+            histogram.total_count += count
+        histogram.min_seconds = histogram_dict['min']
+        histogram.max_recorded_seconds = histogram_dict['max']
+        return histogram
+
+
+class RollingLatencyHistogram:
+    """ Latency histograms over rolling time windows
+
+    Latencies are recorded in the histogram of the current slot of `slot_seconds`, and the
+    slots covering the longest window are kept, so the memory used is fixed.
+    The histogram of a window is the merge of the slots it covers.
+    """
+    slot_seconds = 15
+    window_seconds = {"1m": 60, "5m": 300}
+
+    def __init__(self):
+        self._slot_count = max(self.window_seconds.values()) // self.slot_seconds
+        self._slots: Deque[Tuple[int, LatencyHistogram]] = deque()
+        # Everything recorded since the last snapshot
+        self.interval_histogram = LatencyHistogram()
+        # Everything recorded
+        self.total_histogram = LatencyHistogram()
+
+    def _get_slot_histogram(self, slot_number: int) -> LatencyHistogram:
+        if self._slots and self._slots[-1][0] == slot_number:
+            return self._slots[-1][1]
+        if len(self._slots) == self._slot_count:
+            # Reuse the histogram of the oldest slot, rather than allocating a new one.
+            histogram = self._slots.popleft()[1]
+            histogram.reset()
+        else:
+            histogram = LatencyHistogram()
+        self._slots.append((slot_number, histogram))
+        return histogram
+
+    def record(self, seconds: float, timestamp: float = None) -> None:
+        timestamp = time.time() if timestamp is None else timestamp
+        self._get_slot_histogram(int(timestamp // self.slot_seconds)).record(seconds)
+        self.interval_histogram.record(seconds)
+        self.total_histogram.record(seconds)
+
+    def get_window_histogram(self, window_name: str, now: float = None) -> LatencyHistogram:
+        now = time.time() if now is None else now
+        first_slot_number = int(now // self.slot_seconds) - self.window_seconds[window_name] // self.slot_seconds + 1
+        window_histogram = LatencyHistogram()
+        for slot_number, histogram in self._slots:
+            if slot_number >= first_slot_number and histogram.total_count:
+                window_histogram.merge(histogram)
+        return window_histogram
+
+    def get_window_percentiles(self, now: float = None) -> Dict[str, dict]:
+        percentiles = dict()
+        for window_name in self.window_seconds:
+            histogram = self.get_window_histogram(window_name, now)
+            percentiles[window_name] = dict(count=histogram.total_count, **histogram.percentiles())
+        return percentiles
+
+
+class LatencyHistograms:
+    """ Thread-safe registry of the rolling latency histograms, one per operation
+
+    `write_snapshot` appends a line per operation to `snapshot_filename`, with the
+    rolling window percentiles and the histogram of the latencies recorded since the
+    previous snapshot. `write_summary` writes the percentiles over the whole run.
+    """
+    snapshot_filename = "latency_histograms.jsonl"
+    summary_filename = "latency_summary.json"
+    snapshot_interval_seconds = 60
+
+    def __init__(self, output_directory: str, snapshot_interval_seconds: float = None):
+        self.output_directory = output_directory
+        if snapshot_interval_seconds is not None:
+            self.snapshot_interval_seconds = snapshot_interval_seconds
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, RollingLatencyHistogram] = dict()
+
+    def record(self, operation_name: str, seconds: float, timestamp: float = None) -> None:
+        with self._lock:
+            histogram = self._histograms.get(operation_name)
+            if histogram is None:
+                histogram = RollingLatencyHistogram()
+                self._histograms[operation_name] = histogram
+            histogram.record(seconds, timestamp)
+
+    def _get_sorted_histograms(self) -> List[Tuple[str, RollingLatencyHistogram]]:
+        with self._lock:
+            return sorted(self._histograms.items())
+
+    def get_window_percentiles(self, now: float = None) -> Dict[str, Dict[str, dict]]:
+        # The lock is held for one operation at a time, so that recording is never blocked for long.
+        window_percentiles = dict()
+        for operation_name, histogram in self._get_sorted_histograms():
+            with self._lock:
+                window_percentiles[operation_name] = histogram.get_window_percentiles(now)
+        return window_percentiles
+
+    def write_snapshot(self, now: float = None) -> Dict[str, Dict[str, dict]]:
+        """Write a snapshot of the histograms, and return the rolling window percentiles of each operation."""
+        now = time.time() if now is None else now
+        lines = list()
+        window_percentiles = dict()
+        for operation_name, histogram in self._get_sorted_histograms():
+            with self._lock:
+                window_percentiles[operation_name] = histogram.get_window_percentiles(now)
+                lines.append(json.dumps(dict(timestamp=round(now, 3),
+                                             operation=operation_name,
+                                             windows=window_percentiles[operation_name],
+                                             interval_histogram=histogram.interval_histogram.to_dict())))
+                histogram.interval_histogram.reset()
+        if lines:
+            with open(os.path.join(self.output_directory, self.snapshot_filename), 'a') as snapshot_file:
+                snapshot_file.write("\n".join(lines) + "\n")
+        return window_percentiles
+
+    def write_summary(self) -> None:
+        with self._lock:
+            summary = {operation_name: dict(count=histogram.total_histogram.total_count,
+                                            min=histogram.total_histogram.min_seconds,
+                                            max=histogram.total_histogram.max_recorded_seconds,
+                                            **histogram.total_histogram.percentiles())
+                       for operation_name, histogram in sorted(self._histograms.items())}
+        with open(os.path.join(self.output_directory, self.summary_filename), 'w') as summary_file:
+            json.dump(summary, summary_file, indent=2)
+
+
+def format_window_percentiles(windows: Dict[str, dict]) -> str:
+    """Format the rolling window percentiles of an operation for display, in seconds."""
+    return "; ".join(f"{window_name} (n={percentiles['count']}): " +
+                     ", ".join(f"{name}={value:.3f}" for name, value in percentiles.items()
+                               if name != 'count' and value is not None)
+                     for window_name, percentiles in windows.items())
+
+
+def read_snapshots(snapshot_filename: str) -> List[dict]:
+    with open(snapshot_filename) as snapshot_file:
+        return [json.loads(line) for line in snapshot_file if line.strip()]
+
+
+def merge_snapshot_histograms(snapshots: Iterable[dict], operation_name: str,
+                              start_time: float = None, end_time: float = None) -> LatencyHistogram:
+    """Merge the interval histograms of the snapshots of an operation taken within the time range."""
+    histogram = LatencyHistogram()
+    for snapshot in snapshots:
+        if snapshot['operation'] != operation_name:
+            continue
+        if (start_time is not None and snapshot['timestamp'] < start_time) or \
+                (end_time is not None and snapshot['timestamp'] > end_time):
+            continue
+        histogram.merge(LatencyHistogram.from_dict(snapshot['interval_histogram']))
+    return histogram
@@ -0,0 +1,284 @@
+"""Latency Versus Load Analysis
+This script/module relates the response times collected by `monitor_response_times.py`
+to the load on the services, measured as the workflow DRS data access rate extracted by
+`extract_drs_localization_events.py`, to estimate the access rate at which latency bends upward.
+
+The access rate time series and the response time samples are aligned on common time buckets,
+and the mean access rate of its bucket is taken as the load of each sample. The samples of each
+endpoint are grouped into load bands of equal width, and the response time percentiles and the
+error rate of each band give a latency-versus-throughput curve for the endpoint.
+The knee of each curve is estimated as the band furthest below the straight line from its lowest
+to its highest latency, with both axes normalized, i.e. where the latency departs from its
+low load level (the Kneedle method for an increasing convex curve).
+
+The analysis is vectorized using numpy and pandas, so it takes seconds even when the access
+rate time series has a row per event for millions of events.
+"""
+
+import argparse
+import os
+
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from terra_workflow_scale_test_tools.metrics_writer import get_current_parquet_filename
+
+DATA_ACCESS_RATE_FILENAME = "drs_localization_timeseries.tsv"
+LATENCY_VS_LOAD_FILENAME = "latency_vs_load.tsv"
+LATENCY_VS_LOAD_KNEES_FILENAME = "latency_vs_load_knees.tsv"
+
+# The response time files written by the monitor, of which the "cold" series are only present
+# if the monitor was given a DRS URI manifest.
+RESPONSE_TIME_FILENAMES = ["drs_flow_response_times.csv",
+                           "drs_flow_cold_response_times.csv",
+                           "martha_response_time.csv",
+                           "martha_cold_response_time.csv",
+                           "bond_external_idenity_response_times.csv",
+                           "fence_user_info_response_time.csv"]
+
+TIMESTAMP_FORMAT = "%Y/%m/%d %H:%M:%S"
+PERCENTILES = [50, 95, 99]
+
+
+class LatencyLoadAnalysisException(Exception):
+    pass
+
+
+@dataclass
+class EndpointSamples:
+    # Seconds since the epoch
+    start_times: np.ndarray
+    response_durations: np.ndarray
+    is_error: np.ndarray
+
+
+@dataclass
+class LatencyLoadAnalysis:
+    # A row per endpoint and load band with samples: the band's load range and the mean load of its
+    # samples (accesses per second), the sample count, the error rate and the response time percentiles
+    curves: pd.DataFrame
+    # A row per endpoint: the load and latency at the estimated knee, which are NaN if no knee was found,
+    # and the latency in the lowest and highest load bands
+    knees: pd.DataFrame
+    knee_percentile: int
+
+
+def get_existing_filepath(filepath: str) -> Optional[str]:
+    """Return the Parquet file alongside the file, if present and not older than it, else the file, if present."""
+    parquet_filepath = get_current_parquet_filename(filepath)
+    if parquet_filepath is not None:
+        return parquet_filepath
+    return filepath if os.path.exists(filepath) else None
+
+
+def read_table_file(filepath: str, columnnames: list = None, sep: str = '\t') -> pd.DataFrame:
+    if filepath.endswith(".parquet"):
+        return pd.read_parquet(filepath, columns=columnnames)
+    return pd.read_csv(filepath, sep=sep, usecols=columnnames)
+
+
+def to_epoch_seconds(timestamps: pd.Series) -> np.ndarray:
+    """Return the UTC timestamps, as read from a CSV/TSV or Parquet file, in seconds since the epoch, or NaN."""
+    if not pd.api.types.is_datetime64_any_dtype(timestamps):
+        timestamps = pd.to_datetime(timestamps, format=TIMESTAMP_FORMAT, utc=True)
+    elif timestamps.dt.tz is None:
+        timestamps = timestamps.dt.tz_localize("UTC")
+    return ((timestamps - pd.Timestamp(0, tz="UTC")) / pd.Timedelta(seconds=1)).to_numpy(dtype=np.float64,
+                                                                                        na_value=np.nan)
+
+
+def read_data_access_rate(filepath: str) -> pd.DataFrame:
+    """Read the access counts per time series bucket, or per event, in seconds since the epoch."""
+    df = read_table_file(filepath, ['Timestamp', 'Count'])
+    return pd.DataFrame(dict(start_time=to_epoch_seconds(df['Timestamp']),
+                             count=df['Count'].to_numpy(dtype=np.float64)))
+
+
+def read_endpoint_samples(filepath: str) -> Dict[str, EndpointSamples]:
+    """Read the response time samples of each endpoint (operation) in a response time file.
+    A response without a 2xx status code, or with none, is counted as an error.
+    """
+    df = read_table_file(filepath, sep=',')
+    endpoint_samples = dict()
+    for columnname in df.columns:
+        if not columnname.endswith(".response_duration"):
+            continue
+        endpoint = columnname[:-len(".response_duration")]
+        start_times = to_epoch_seconds(df[f"{endpoint}.start_time"])
+        response_durations = pd.to_numeric(df[columnname], errors='coerce').to_numpy(dtype=np.float64)
+        response_codes = pd.to_numeric(df[f"{endpoint}.response_code"], errors='coerce') \
+            .to_numpy(dtype=np.float64, na_value=np.nan)
+        # Only the operations that were attempted and timed are samples.
+        is_sample = ~np.isnan(start_times) & ~np.isnan(response_durations)
+        is_error = np.isnan(response_codes) | (response_codes < 200) | (response_codes >= 300)
+        endpoint_samples[endpoint] = EndpointSamples(start_times[is_sample], response_durations[is_sample],
+                                                     is_error[is_sample])
+    return endpoint_samples
+
+
+class BucketLoads:
+    """ Mean access rate (accesses per second) of each time bucket of `bucket_seconds` """
+
+    def __init__(self, data_access_rate: pd.DataFrame, bucket_seconds: int):
+        self.bucket_seconds = bucket_seconds
+        start_times = data_access_rate['start_time'].to_numpy()
+        self.first_bucket_start = np.floor(np.nanmin(start_times) / bucket_seconds) * bucket_seconds
+        buckets = ((start_times - self.first_bucket_start) // bucket_seconds).astype(np.int64)
+        self.loads = np.bincount(buckets, weights=data_access_rate['count'].to_numpy()) / bucket_seconds
+
+    def get_loads(self, start_times: np.ndarray) -> np.ndarray:
+        """Return the load of the bucket of each time, which is zero outside the access rate time series."""
+        buckets = ((start_times - self.first_bucket_start) // self.bucket_seconds).astype(np.int64)
+        in_range = (buckets >= 0) & (buckets < len(self.loads))
+        loads = np.zeros(len(start_times))
+        loads[in_range] = self.loads[buckets[in_range]]
+        return loads
+
+    @property
+    def max_load(self) -> float:
+        return float(self.loads.max()) if len(self.loads) else 0.0
+
+
+def compute_latency_vs_load(loads: np.ndarray, response_durations: np.ndarray, is_error: np.ndarray,
+                            band_edges: np.ndarray) -> pd.DataFrame:
+    """Return the sample count, mean load, error rate and response time percentiles of each load band with samples."""
+    band_count = len(band_edges) - 1
+    bands = np.clip(np.searchsorted(band_edges, loads, side='right') - 1, 0, band_count - 1)
+    grouped = pd.DataFrame(dict(band=bands, load=loads, response_duration=response_durations,
+                                is_error=is_error)).groupby('band')
+    curve = pd.DataFrame(dict(sample_count=grouped.size(),
+                              mean_load=grouped['load'].mean(),
+                              error_rate=grouped['is_error'].mean()))
+    percentiles = grouped['response_duration'].quantile([percentile / 100 for percentile in PERCENTILES]).unstack()
+    percentiles.columns = [f"p{percentile}" for percentile in PERCENTILES]
+    curve = curve.join(percentiles)
+    curve.insert(0, 'load_high', band_edges[curve.index + 1])
+    curve.insert(0, 'load_low', band_edges[curve.index])
+    return curve.reset_index(drop=True)
+
+
+def estimate_knee(loads: np.ndarray, latencies: np.ndarray, min_latency_increase: float = 0.5,
+                  min_knee_distance: float = 0.1) -> Optional[int]:
+    """Return the index of the knee of the latency-versus-load curve, or None if it does not bend upward.
+
+    The curve must rise by at least `min_latency_increase` (a fraction of its lowest latency) from the
+    lowest to the highest load, and the knee must be at least `min_knee_distance` below the diagonal
+    of the normalized curve.
+    """
+    if len(loads) < 3 or np.ptp(loads) == 0 or np.ptp(latencies) == 0:
+        return None
+    if latencies[-1] < latencies.min() * (1 + min_latency_increase):
+        return None
+    normalized_loads = (loads - loads.min()) / np.ptp(loads)
+    normalized_latencies = (latencies - latencies.min()) / np.ptp(latencies)
+    distances = normalized_loads - normalized_latencies
+    knee = int(np.argmax(distances))
+    return knee if distances[knee] >= min_knee_distance else None
+
+
+def analyze_latency_vs_load(wf_test_results_dir: str, monitoring_output_dir: str, bucket_seconds: int = 60,
+                            band_count: int = 20, min_band_samples: int = 10,
+                            knee_percentile: int = 95) -> LatencyLoadAnalysis:
+    """Compute the latency-versus-load curve and knee of each endpoint, and write them to TSV files
+    in the workflow test results directory.
+
+    The `bucket_seconds` should be no less than the bucket size of the access rate time series.
+    Only the load bands with at least `min_band_samples` samples are used to estimate the knee.
+    """
+    if knee_percentile not in PERCENTILES:
+        raise LatencyLoadAnalysisException(f"The knee percentile must be one of: {PERCENTILES}")
+    data_access_rate_filepath = get_existing_filepath(os.path.join(wf_test_results_dir, DATA_ACCESS_RATE_FILENAME))
+    if data_access_rate_filepath is None:
+        raise LatencyLoadAnalysisException(f"No DRS data access rate time series found in: {wf_test_results_dir}")
+    data_access_rate = read_data_access_rate(data_access_rate_filepath)
+    if len(data_access_rate) == 0:
+        raise LatencyLoadAnalysisException(f"The DRS data access rate time series is empty: "
+                                           f"{data_access_rate_filepath}")
+    bucket_loads = BucketLoads(data_access_rate, bucket_seconds)
+    # The same load bands for every endpoint, so that their curves can be compared.
+    band_edges = np.linspace(0, max(bucket_loads.max_load, 1.0), band_count + 1)
+
+    curves = list()
+    knees = list()
+    for filename in RESPONSE_TIME_FILENAMES:
+        filepath = get_existing_filepath(os.path.join(monitoring_output_dir, filename))
+        if filepath is None:
+            continue
+        for endpoint, samples in read_endpoint_samples(filepath).items():
+            if len(samples.start_times) == 0:
+                continue
+            curve = compute_latency_vs_load(bucket_loads.get_loads(samples.start_times), samples.response_durations,
+                                            samples.is_error, band_edges)
+            curve.insert(0, 'endpoint', endpoint)
+            curves.append(curve)
+
+            percentile_columnname = f"p{knee_percentile}"
+            knee_curve = curve[curve['sample_count'] >= min_band_samples]
+            knee_loads = knee_curve['mean_load'].to_numpy()
+            knee_latencies = knee_curve[percentile_columnname].to_numpy()
+            knee = estimate_knee(knee_loads, knee_latencies)
+            knees.append(dict(endpoint=endpoint,
+                              knee_load=knee_loads[knee] if knee is not None else np.nan,
+                              knee_latency=knee_latencies[knee] if knee is not None else np.nan,
+                              lowest_load_latency=knee_latencies[0] if len(knee_latencies) else np.nan,
+                              highest_load_latency=knee_latencies[-1] if len(knee_latencies) else np.nan,
+                              band_count=len(knee_latencies)))
+    if not curves:
+        raise LatencyLoadAnalysisException(f"No response time data found in: {monitoring_output_dir}")
+
+    analysis = LatencyLoadAnalysis(pd.concat(curves, ignore_index=True), pd.DataFrame(knees), knee_percentile)
+    curves_filepath = os.path.join(wf_test_results_dir, LATENCY_VS_LOAD_FILENAME)
+    analysis.curves.to_csv(curves_filepath, sep='\t', index=False, float_format="%.6g")
+    knees_filepath = os.path.join(wf_test_results_dir, LATENCY_VS_LOAD_KNEES_FILENAME)
+    analysis.knees.to_csv(knees_filepath, sep='\t', index=False, float_format="%.6g", na_rep="NA")
+    print(f"Done writing the latency-versus-load curves to: {curves_filepath}")
+    print(f"Done writing the latency-versus-load knees to: {knees_filepath}")
+    return analysis
+
+
+def format_knees(analysis: LatencyLoadAnalysis) -> str:
+    lines = list()
+    for knee in analysis.knees.itertuples():
+        if np.isnan(knee.knee_load):
+            lines.append(f"{knee.endpoint}: no knee found")
+        else:
+            lines.append(f"{knee.endpoint}: knee at {knee.knee_load:.1f} accesses/s, "
+                         f"p{analysis.knee_percentile} {knee.knee_latency:.3f}s "
+                         f"(from {knee.lowest_load_latency:.3f}s to {knee.highest_load_latency:.3f}s)")
+    return "\n".join(lines)
+
+
+def parse_arg_list(arg_list: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Relate the response times to the DRS data access rate.")
+    parser.add_argument('-d', '--wf-test-results-dir', type=str, required=True,
+                        help="Workflow test results directory path, containing the DRS localization time series")
+    parser.add_argument('-m', '--monitoring-output-dir', type=str, required=True,
+                        help="Response time monitoring output directory path")
+    parser.add_argument('--bucket-seconds', type=int, required=False, default=60,
+                        help="Width of the time buckets on which the access rate and response times are aligned")
+    parser.add_argument('--band-count', type=int, required=False, default=20,
+                        help="Number of load bands")
+    parser.add_argument('--min-band-samples', type=int, required=False, default=10,
+                        help="Minimum number of samples in a load band for it to be used to estimate the knee")
+    parser.add_argument('--knee-percentile', type=int, required=False, default=95, choices=PERCENTILES,
+                        help="Response time percentile of which the knee is estimated")
+    args = parser.parse_args(arg_list)
+    if args.bucket_seconds < 1:
+        parser.error("--bucket-seconds must be at least 1")
+    if args.band_count < 1:
+        parser.error("--band-count must be at least 1")
+    return args
+
+
+def main(arg_list: list = None) -> None:
+    args = parse_arg_list(arg_list)
+    analysis = analyze_latency_vs_load(args.wf_test_results_dir, args.monitoring_output_dir, args.bucket_seconds,
+                                       args.band_count, args.min_band_samples, args.knee_percentile)
+    print(format_knees(analysis))
+
+
+if __name__ == "__main__":
+    main()
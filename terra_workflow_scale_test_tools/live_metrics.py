@@ -0,0 +1,296 @@
+"""Live Metrics
+This module publishes the latest response time samples, and the rolling window latency
+percentiles of each operation, from the response time monitor to a memory-mapped file,
+so that a notebook can graph them while the monitor runs in a background process,
+without reading the output files or slowing the probes.
+
+The file `live_metrics.bin` contains a header, a ring buffer of the latest samples,
+and a table of the rolling aggregates with a row per operation. Its layout, and the
+operation names, are described by the JSON sidecar file `live_metrics.json`, so the
+reader can view the samples and aggregates in place as numpy structured arrays.
+
+The writer increments the sample count in the header after writing each sample, and the
+aggregates sequence number before and after updating the aggregates, so the reader can
+detect samples overwritten and aggregates updated while it was reading them.
+"""
+
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+from typing import Dict, List, Optional, Tuple
+
+from terra_workflow_scale_test_tools.http_phase_timing import PHASE_NAMES
+from terra_workflow_scale_test_tools.latency_histogram import REPORTED_PERCENTILES, RollingLatencyHistogram
+
+LIVE_METRICS_FILENAME = "live_metrics.bin"
+LIVE_METRICS_SIDECAR_FILENAME = "live_metrics.json"
+
+_MAGIC = b"TWSLIVE1"
+# The magic, the sample count and the aggregates sequence number, padded to a cache line
+_HEADER_FORMAT = "<8sQQ40x"
+_SAMPLE_COUNT_OFFSET = 8
+_AGGREGATES_SEQUENCE_OFFSET = 16
+
+# The fields of a sample and of the aggregates of an operation, as (name, struct format, numpy format)
+SAMPLE_FIELDS = [('start_time', "d", "<f8"),
+                 ('response_duration', "d", "<f8"),
+                 ('operation', "H", "<u2"),
+                 ('response_code', "h", "<i2")] + \
+                [(phase_name, "f", "<f4") for phase_name in PHASE_NAMES]
+AGGREGATE_FIELDS = [('timestamp', "d", "<f8")] + \
+                   [field for window_name in RollingLatencyHistogram.window_seconds
+                    for field in [(f"{window_name}.count", "Q", "<u8")] +
+                    [(f"{window_name}.p{percent:g}", "d", "<f8") for percent in REPORTED_PERCENTILES]]
+
+
+class LiveMetricsException(Exception):
+    pass
+
+
+def _get_layout(fields: List[Tuple[str, str, str]]) -> Tuple[str, dict]:
+    """Return the struct format of the fields, padded to a multiple of 8 bytes,
+    and the equivalent numpy dtype description.
+    """
+    struct_format = "<" + "".join(field_format for _, field_format, _ in fields)
+    item_size = (struct.calcsize(struct_format) + 7) // 8 * 8
+    offsets = [struct.calcsize("<" + "".join(field_format for _, field_format, _ in fields[:index]))
+               for index in range(len(fields))]
+    struct_format += f"{item_size - struct.calcsize(struct_format)}x"
+    dtype_description = dict(names=[name for name, _, _ in fields],
+                             formats=[numpy_format for _, _, numpy_format in fields],
+                             offsets=offsets,
+                             itemsize=item_size)
+    return struct_format, dtype_description
+
+
+def _to_float(value: Optional[float]) -> float:
+    return math.nan if value is None else value
+
+
+class LiveMetricsWriter:
+    """ Writes the samples and aggregates to the memory-mapped file
+
+    The file is created, replacing any existing one, when the writer is created.
+    When more than `max_operations` operations have been written, the samples
+    and aggregates of the further operations are not published.
+    """
+    capacity = 65536
+    max_operations = 256
+
+    def __init__(self, output_directory: str, capacity: int = None, max_operations: int = None):
+        if capacity is not None:
+            self.capacity = capacity
+        if max_operations is not None:
+            self.max_operations = max_operations
+        self.filepath = os.path.join(output_directory, LIVE_METRICS_FILENAME)
+        self.sidecar_filepath = os.path.join(output_directory, LIVE_METRICS_SIDECAR_FILENAME)
+        self._sample_format, self._sample_dtype = _get_layout(SAMPLE_FIELDS)
+        self._aggregate_format, self._aggregate_dtype = _get_layout(AGGREGATE_FIELDS)
+        self._header_size = struct.calcsize(_HEADER_FORMAT)
+        self._samples_offset = self._header_size
+        self._aggregates_offset = self._samples_offset + self.capacity * self._sample_dtype['itemsize']
+        file_size = self._aggregates_offset + self.max_operations * self._aggregate_dtype['itemsize']
+
+        self._lock = threading.Lock()
+        self._operation_indexes: Dict[str, int] = dict()
+        self._sample_count = 0
+        self._aggregates_sequence = 0
+        with open(self.filepath, 'wb') as live_metrics_file:
+            live_metrics_file.truncate(file_size)
+        self._file = open(self.filepath, 'r+b')
+        self._buffer = mmap.mmap(self._file.fileno(), file_size)
+        struct.pack_into(_HEADER_FORMAT, self._buffer, 0, _MAGIC, 0, 0)
+        self._write_sidecar()
+
+    def _write_sidecar(self) -> None:
+        # Replace the sidecar atomically, so that a reader never sees a partially written one.
+        sidecar = dict(pid=os.getpid(),
+                       capacity=self.capacity,
+                       max_operations=self.max_operations,
+                       samples_offset=self._samples_offset,
+                       sample_dtype=self._sample_dtype,
+                       aggregates_offset=self._aggregates_offset,
+                       aggregate_dtype=self._aggregate_dtype,
+                       operations=sorted(self._operation_indexes, key=self._operation_indexes.get))
+        temp_filepath = f"{self.sidecar_filepath}.tmp"
+        with open(temp_filepath, 'w') as sidecar_file:
+            json.dump(sidecar, sidecar_file, indent=2)
+        os.replace(temp_filepath, self.sidecar_filepath)
+
+    def _get_operation_index(self, operation_name: str) -> Optional[int]:
+        index = self._operation_indexes.get(operation_name)
+        if index is None and len(self._operation_indexes) < self.max_operations:
+            index = len(self._operation_indexes)
+            self._operation_indexes[operation_name] = index
+            self._write_sidecar()
+        return index
+
+    def write_samples(self, monitoring_info_dict: dict) -> None:
+        """Write a sample for each operation in the monitoring info, as written to the output files."""
+        with self._lock:
+            if self._buffer is None:
+                return
+            for operation_name, mon_info in monitoring_info_dict.items():
+                if mon_info.get('start_time') is None:
+                    continue
+                operation_index = self._get_operation_index(operation_name)
+                if operation_index is None:
+                    continue
+                response_code = mon_info.get('response_code')
+                struct.pack_into(self._sample_format, self._buffer,
+                                 self._samples_offset + (self._sample_count % self.capacity) *
+                                 self._sample_dtype['itemsize'],
+                                 mon_info['start_time'],
+                                 _to_float(mon_info.get('response_duration')),
+                                 operation_index,
+                                 -1 if response_code is None else response_code,
+                                 *[_to_float(mon_info.get(phase_name)) for phase_name in PHASE_NAMES])
+                self._sample_count += 1
+                struct.pack_into("<Q", self._buffer, _SAMPLE_COUNT_OFFSET, self._sample_count)
+
+    def write_aggregates(self, window_percentiles: Dict[str, Dict[str, dict]], now: float = None) -> None:
+        """Write the rolling window percentiles of each operation, as returned by
+        `LatencyHistograms.get_window_percentiles`.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            if self._buffer is None:
+                return
+            # An odd sequence number tells the reader that an update is in progress.
+            self._aggregates_sequence += 1
+            struct.pack_into("<Q", self._buffer, _AGGREGATES_SEQUENCE_OFFSET, self._aggregates_sequence)
+            for operation_name, windows in window_percentiles.items():
+                operation_index = self._get_operation_index(operation_name)
+                if operation_index is None:
+                    continue
+                values = [now]
+                for window_name in RollingLatencyHistogram.window_seconds:
+                    percentiles = windows.get(window_name, dict())
+                    values.append(percentiles.get('count', 0))
+                    values.extend(_to_float(percentiles.get(f"p{percent:g}")) for percent in REPORTED_PERCENTILES)
+                struct.pack_into(self._aggregate_format, self._buffer,
+                                 self._aggregates_offset + operation_index * self._aggregate_dtype['itemsize'],
+                                 *values)
+            self._aggregates_sequence += 1
+            struct.pack_into("<Q", self._buffer, _AGGREGATES_SEQUENCE_OFFSET, self._aggregates_sequence)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._buffer is not None:
+                self._buffer.flush()
+                self._buffer.close()
+                self._buffer = None
+                self._file.close()
+
+
+class LiveMetricsReader:
+    """ Reads the samples and aggregates from the memory-mapped file, e.g. in a notebook
+
+    The samples are returned as a numpy structured array viewing the file in place where possible,
+    so they change when the writer wraps around the ring buffer. Copy them to keep them
+    for longer than the ring buffer takes to fill.
+    """
+    aggregates_read_attempts = 100
+
+    def __init__(self, output_directory: str, wait_seconds: float = 30):
+        """Wait up to `wait_seconds` for the monitor to create the file."""
+        import numpy as np
+        self._np = np
+        self.sidecar_filepath = os.path.join(output_directory, LIVE_METRICS_SIDECAR_FILENAME)
+        deadline = time.time() + wait_seconds
+        while not os.path.exists(self.sidecar_filepath):
+            if time.time() >= deadline:
+                raise LiveMetricsException(f"The live metrics file was not found: {self.sidecar_filepath}")
+            time.sleep(0.5)
+        sidecar = self._read_sidecar()
+        self.capacity = sidecar['capacity']
+        self.operations: List[str] = sidecar['operations']
+        with open(os.path.join(output_directory, LIVE_METRICS_FILENAME), 'rb') as live_metrics_file:
+            self._buffer = mmap.mmap(live_metrics_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._buffer[:len(_MAGIC)] != _MAGIC:
+            raise LiveMetricsException("The live metrics file is not valid.")
+        self._header = np.frombuffer(self._buffer, dtype="<u8", count=3)
+        self._samples = np.frombuffer(self._buffer, dtype=np.dtype(sidecar['sample_dtype']),
+                                      count=self.capacity, offset=sidecar['samples_offset'])
+        self._aggregates = np.frombuffer(self._buffer, dtype=np.dtype(sidecar['aggregate_dtype']),
+                                         count=sidecar['max_operations'], offset=sidecar['aggregates_offset'])
+
+    def _read_sidecar(self) -> dict:
+        with open(self.sidecar_filepath) as sidecar_file:
+            return json.load(sidecar_file)
+
+    def _update_operations(self, operation_count: int) -> None:
+        if operation_count > len(self.operations):
+            self.operations = self._read_sidecar()['operations']
+
+    @property
+    def sample_count(self) -> int:
+        """The number of samples written since the monitor started."""
+        return int(self._header[_SAMPLE_COUNT_OFFSET // 8])
+
+    def read_samples(self, since_sample_count: int = 0):
+        """Return the samples written after the first `since_sample_count`, oldest first, that are still
+        in the ring buffer, and the sample count to pass to read only the samples written after these.
+        """
+        np = self._np
+        sample_count = self.sample_count
+        first_sample = max(since_sample_count, sample_count - self.capacity)
+        first_index, end_index = first_sample % self.capacity, sample_count % self.capacity
+        if sample_count == first_sample:
+            samples = self._samples[:0]
+        elif first_index < end_index:
+            samples = self._samples[first_index:end_index]
+        else:
+            samples = np.concatenate([self._samples[first_index:], self._samples[:end_index]])
+        # Drop the samples that may have been overwritten while reading them.
+        overwritten_count = self.sample_count - self.capacity - first_sample
+        if overwritten_count > 0:
+            samples = samples[overwritten_count:]
+        return samples, sample_count
+
+    def read_samples_dataframe(self, since_sample_count: int = 0):
+        """Return the samples as a pandas DataFrame, with the operation names and UTC start times,
+        and the sample count to pass to read only the samples written after these.
+        """
+        import pandas as pd
+        samples, sample_count = self.read_samples(since_sample_count)
+        df = pd.DataFrame(samples)
+        if len(df):
+            self._update_operations(int(df['operation'].max()) + 1)
+        df['operation'] = pd.Categorical.from_codes(df['operation'], categories=self.operations) \
+            if len(df) else pd.Categorical([], categories=self.operations)
+        df['start_time'] = pd.to_datetime(df['start_time'], unit='s')
+        df['response_code'] = df['response_code'].replace(-1, pd.NA)
+        return df, sample_count
+
+    def read_aggregates(self):
+        """Return a copy of the latest rolling window percentiles of each operation, as a pandas DataFrame
+        indexed by the operation name.
+        """
+        import pandas as pd
+        for _ in range(self.aggregates_read_attempts):
+            sequence = int(self._header[_AGGREGATES_SEQUENCE_OFFSET // 8])
+            if sequence % 2 == 0:
+                aggregates = self._aggregates.copy()
+                if int(self._header[_AGGREGATES_SEQUENCE_OFFSET // 8]) == sequence:
+                    break
+            time.sleep(0.01)
+        else:
+            raise LiveMetricsException("The aggregates were being updated for too long to read them.")
+        self.operations = self._read_sidecar()['operations']
+        df = pd.DataFrame(aggregates[:len(self.operations)], index=pd.Index(self.operations, name='operation'))
+        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s')
+        return df[df['timestamp'] > pd.Timestamp(0)]
+
+    def close(self) -> None:
+        self._header = self._samples = self._aggregates = None
+        try:
+            self._buffer.close()
+        except BufferError:
+            # The caller still has samples viewing the buffer, which is closed once they are released.
+            pass
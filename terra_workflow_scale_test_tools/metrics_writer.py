@@ -0,0 +1,444 @@
+"""Buffered Metrics Writers
+This module provides long-lived, thread-safe writers for the monitoring data files.
+Rows are buffered in memory and written in batches, on an interval and when the
+writer is closed, rather than opening and closing the output file for every row.
+
+The files are written as CSV by default, or as Parquet, with typed columns, when the
+output format is "parquet". Writing Parquet requires `pyarrow`. Each Parquet "file" is a
+directory of part files, so that it can be read while it is being written.
+"""
+
+import calendar
+import csv
+import io
+import logging
+import os
+import re
+import threading
+import time
+
+from typing import Dict, List, Optional, Union
+
+OUTPUT_FORMATS = ("csv", "parquet")
+
+# The text format of timestamps written to the CSV files
+TIMESTAMP_FORMAT = "%Y/%m/%d %H:%M:%S"
+
+
+class MetricsWriterException(Exception):
+    pass
+
+
+class BufferedCsvWriter:
+    """ Thread-safe CSV writer with a fixed schema
+
+    Every row is written with the same columns, in the order given by `fieldnames`.
+    Values that are missing from a row, for example when an operation failed before
+    it could be measured, are written explicitly as `missing_value`.
+    """
+    missing_value = "NA"
+    max_buffered_rows = 1000
+    # Timestamps are written as formatted text, rather than as seconds since the epoch.
+    typed_timestamps = False
+
+    def __init__(self, filepath: str, fieldnames: List[str], max_buffered_rows: int = None):
+        self.filepath = filepath
+        self.fieldnames = list(fieldnames)
+        if max_buffered_rows is not None:
+            self.max_buffered_rows = max_buffered_rows
+        self._buffer_lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._buffer: List[dict] = list()
+        self._file = None
+        self._writer: Optional[csv.DictWriter] = None
+        self._open()
+
+    def _read_existing_header(self) -> Optional[List[str]]:
+        if not os.path.exists(self.filepath) or os.path.getsize(self.filepath) == 0:
+            return None
+        with open(self.filepath, newline='') as csvfile:
+            return next(csv.reader(csvfile), None)
+
+    def _open(self) -> None:
+        existing_header = self._read_existing_header()
+        if existing_header is not None and existing_header != self.fieldnames:
+            raise MetricsWriterException(
+                f"The existing file '{self.filepath}' has different columns than expected: "
+                f"{existing_header} != {self.fieldnames}")
+        self._file = open(self.filepath, 'a', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=self.fieldnames,
+                                      restval=self.missing_value, extrasaction='raise')
+        if existing_header is None:
+            self._writer.writeheader()
+            self._file.flush()
+
+    def write_row(self, row: dict) -> None:
+        unknown_fieldnames = set(row) - set(self.fieldnames)
+        if unknown_fieldnames:
+            raise MetricsWriterException(f"Unknown columns for '{self.filepath}': {sorted(unknown_fieldnames)}")
+        row = {key: self.missing_value if value is None else value for key, value in row.items()}
+        with self._buffer_lock:
+            self._buffer.append(row)
+            flush_now = len(self._buffer) >= self.max_buffered_rows
+        if flush_now:
+            self.flush()
+
+    def _format_rows(self, rows: List[dict]) -> str:
+        text = io.StringIO()
+        csv.DictWriter(text, fieldnames=self.fieldnames, restval=self.missing_value,
+                       extrasaction='raise').writerows(rows)
+        return text.getvalue()
+
+    def _drop_unformattable_rows(self, rows: List[dict]) -> List[dict]:
+        """Log and remove from the buffer the rows that cannot be formatted, which would otherwise
+        fail every later flush, and return the other rows.
+        """
+        formattable_rows = list()
+        for row in rows:
+            try:
+                self._format_rows([row])
+                formattable_rows.append(row)
+            except Exception as ex:
+                logging.getLogger(__name__).error(f"Dropped a row that cannot be written to '{self.filepath}': "
+                                                  f"{row}: {ex!r}")
+        with self._buffer_lock:
+            self._buffer[:len(rows)] = formattable_rows
+        return formattable_rows
+
+    def flush(self) -> None:
+        """Write the buffered rows. The rows are only removed from the buffer once written,
+        so that if writing fails they are written by a later flush instead.
+        Rows that cannot be formatted are logged and dropped.
+        """
+        with self._io_lock:
+            if self._file is None:
+                with self._buffer_lock:
+                    rows, self._buffer = self._buffer, list()
+                if rows:
+                    raise MetricsWriterException(f"Writer for '{self.filepath}' is closed, {len(rows)} rows lost.")
+                return
+            with self._buffer_lock:
+                rows = list(self._buffer)
+            if rows:
+                # Format the rows first, so that a row that cannot be written does not leave part of them written.
+                try:
+                    text = self._format_rows(rows)
+                except Exception:
+                    rows = self._drop_unformattable_rows(rows)
+                    text = self._format_rows(rows)
+                self._file.write(text)
+                self._file.flush()
+                # Rows may have been added since the flush started, after the rows written.
+                with self._buffer_lock:
+                    del self._buffer[:len(rows)]
+
+    def close(self) -> None:
+        self.flush()
+        with self._io_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class BufferedParquetWriter:
+    """ Thread-safe Parquet writer with a fixed schema
+
+    The type of each column is given by the last part of its name, for example
+    `martha.response_code`, so that timestamps are stored as UTC nanosecond timestamps
+    (int64) and response codes as int16, rather than text. Missing values are stored as nulls.
+    Timestamps may be given as seconds since the epoch, or as text in `TIMESTAMP_FORMAT`.
+
+    The output is a directory of part files (a Parquet dataset), which pandas and pyarrow read
+    as a single table, e.g. `pd.read_parquet(filepath)`. Each flush writes a row group to the
+    current part, and the part is closed, making it readable, every `part_seconds`, so that the
+    data can be read while the writer is running, and a writer that is killed loses at most the
+    rows of its current part. Until it is closed, the current part is named with a leading
+    underscore, so that readers ignore it.
+    If the directory already exists, the new parts are added to it.
+    """
+    max_buffered_rows = 10000
+    part_seconds = 60.0
+    part_filename_format = "part-{:05d}.parquet"
+    # A leading underscore hides a file from Parquet dataset readers.
+    in_progress_part_filename_format = "_part-{:05d}.parquet.in_progress"
+    typed_timestamps = True
+    timestamp_metric_names = ('start_time', 'arrival_time', 'intended_start_time', 'actual_start_time', 'Timestamp')
+    column_type_names = {'response_code': "int16",
+                         'response_duration': "float64",
+                         'pool_wait': "float64",
+                         'dns': "float64",
+                         'connect': "float64",
+                         'tls': "float64",
+                         'ttfb': "float64",
+                         'body': "float64",
+                         'injected_latency': "float64",
+                         'start_lag': "float64",
+                         'run_duration': "float64",
+                         'Count': "int64"}
+
+    def __init__(self, filepath: str, fieldnames: List[str], max_buffered_rows: int = None,
+                 part_seconds: float = None):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self._pa = pa
+        self._pq = pq
+        self.filepath = filepath
+        self.fieldnames = list(fieldnames)
+        if max_buffered_rows is not None:
+            self.max_buffered_rows = max_buffered_rows
+        if part_seconds is not None:
+            self.part_seconds = part_seconds
+        self.schema = pa.schema([(fieldname, self._get_column_type(fieldname)) for fieldname in self.fieldnames])
+        self._buffer_lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._buffer: List[dict] = list()
+        self._closed = False
+        self._part_writer = None
+        self._part_index = 0
+        self._part_start_time = 0.0
+        self._open()
+
+    def _get_column_type(self, fieldname: str):
+        metric = fieldname.rsplit(".", 1)[-1]
+        if metric in self.timestamp_metric_names:
+            return self._pa.timestamp('ns', tz='UTC')
+        return getattr(self._pa, self.column_type_names.get(metric, "string"))()
+
+    def _get_part_filepath(self, part_index: int, in_progress: bool = False) -> str:
+        filename_format = self.in_progress_part_filename_format if in_progress else self.part_filename_format
+        return os.path.join(self.filepath, filename_format.format(part_index))
+
+    def _get_part_indexes(self) -> List[int]:
+        """Return the indexes of the existing parts, including any left in progress by a writer that was killed."""
+        part_indexes = list()
+        for filename in os.listdir(self.filepath):
+            match = re.fullmatch(r"_?part-(\d+)\.parquet(\.in_progress)?", filename)
+            if match is not None:
+                part_indexes.append(int(match.group(1)))
+        return part_indexes
+
+    def _move_file_into_directory(self) -> None:
+        """Move a file written as a single Parquet file, rather than as a directory of parts, into a new directory
+        at the same path as its first part, or if it is unreadable, e.g. because its writer was killed,
+        as a part that readers ignore.
+        """
+        temporary_filepath = f"{self.filepath}.moving"
+        os.replace(self.filepath, temporary_filepath)
+        os.makedirs(self.filepath)
+        try:
+            self._pq.read_schema(temporary_filepath)
+            os.replace(temporary_filepath, self._get_part_filepath(0))
+        except self._pa.ArrowException:
+            logging.getLogger(__name__).warning(f"The existing file '{self.filepath}' is unreadable, "
+                                                f"so it has been kept as a part that is ignored.")
+            os.replace(temporary_filepath, self._get_part_filepath(0, in_progress=True))
+
+    def _open(self) -> None:
+        if os.path.isfile(self.filepath):
+            self._move_file_into_directory()
+        os.makedirs(self.filepath, exist_ok=True)
+        part_indexes = self._get_part_indexes()
+        closed_part_indexes = [part_index for part_index in sorted(part_indexes)
+                               if os.path.exists(self._get_part_filepath(part_index))]
+        self._part_index = max(part_indexes, default=-1) + 1
+        if closed_part_indexes:
+            existing_schema = self._pq.read_schema(self._get_part_filepath(closed_part_indexes[0]))
+            if existing_schema.names != self.fieldnames:
+                raise MetricsWriterException(
+                    f"The existing file '{self.filepath}' has different columns than expected: "
+                    f"{existing_schema.names} != {self.fieldnames}")
+        else:
+            # An empty part, so that the columns can be read before any rows have been written.
+            self._pq.write_table(self.schema.empty_table(), self._get_part_filepath(self._part_index))
+            self._part_index += 1
+
+    def _start_part(self) -> None:
+        self._part_writer = self._pq.ParquetWriter(self._get_part_filepath(self._part_index, in_progress=True),
+                                                   self.schema)
+        self._part_start_time = time.monotonic()
+
+    def _finish_part(self) -> None:
+        self._part_writer.close()
+        self._part_writer = None
+        os.replace(self._get_part_filepath(self._part_index, in_progress=True),
+                   self._get_part_filepath(self._part_index))
+        self._part_index += 1
+
+    @staticmethod
+    def _to_nanoseconds(value) -> Optional[int]:
+        if value is None:
+            return None
+        if isinstance(value, str):
+            return calendar.timegm(time.strptime(value, TIMESTAMP_FORMAT)) * 1_000_000_000
+        return int(round(value * 1_000_000_000))
+
+    def _to_table(self, rows: List[dict]):
+        columns = list()
+        for field in self.schema:
+            values = [row.get(field.name) for row in rows]
+            if self._pa.types.is_timestamp(field.type):
+                values = [self._to_nanoseconds(value) for value in values]
+            elif self._pa.types.is_string(field.type):
+                values = [None if value is None else str(value) for value in values]
+            columns.append(self._pa.array(values, type=field.type))
+        return self._pa.Table.from_arrays(columns, schema=self.schema)
+
+    def _drop_unconvertible_rows(self, rows: List[dict]) -> List[dict]:
+        """Log and remove from the buffer the rows whose values cannot be converted to the column types,
+        which would otherwise fail every later flush, and return the other rows.
+        """
+        convertible_rows = list()
+        for row in rows:
+            try:
+                self._to_table([row])
+                convertible_rows.append(row)
+            except Exception as ex:
+                logging.getLogger(__name__).error(f"Dropped a row that cannot be written to '{self.filepath}': "
+                                                  f"{row}: {ex!r}")
+        with self._buffer_lock:
+            self._buffer[:len(rows)] = convertible_rows
+        return convertible_rows
+
+    def write_row(self, row: dict) -> None:
+        unknown_fieldnames = set(row) - set(self.fieldnames)
+        if unknown_fieldnames:
+            raise MetricsWriterException(f"Unknown columns for '{self.filepath}': {sorted(unknown_fieldnames)}")
+        with self._buffer_lock:
+            self._buffer.append(row)
+            flush_now = len(self._buffer) >= self.max_buffered_rows
+        if flush_now:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the buffered rows as a row group of the current part, and close the part if it is due.
+        The rows are only removed from the buffer once written, so that if writing fails they are written
+        by a later flush instead. Rows that cannot be converted to the column types are logged and dropped.
+        """
+        with self._io_lock:
+            if self._closed:
+                with self._buffer_lock:
+                    rows, self._buffer = self._buffer, list()
+                if rows:
+                    raise MetricsWriterException(f"Writer for '{self.filepath}' is closed, {len(rows)} rows lost.")
+                return
+            with self._buffer_lock:
+                rows = list(self._buffer)
+            if rows:
+                try:
+                    table = self._to_table(rows)
+                except Exception:
+                    rows = self._drop_unconvertible_rows(rows)
+                    table = self._to_table(rows)
+            if rows:
+                if self._part_writer is None:
+                    self._start_part()
+                self._part_writer.write_table(table)
+                # Rows may have been added since the flush started, after the rows written.
+                with self._buffer_lock:
+                    del self._buffer[:len(rows)]
+            if self._part_writer is not None and time.monotonic() - self._part_start_time >= self.part_seconds:
+                self._finish_part()
+
+    def close(self) -> None:
+        self.flush()
+        with self._io_lock:
+            if self._part_writer is not None:
+                self._finish_part()
+            self._closed = True
+
+
+MetricsWriter = Union[BufferedCsvWriter, BufferedParquetWriter]
+
+
+def get_output_filename(output_filename: str, output_format: str) -> str:
+    """Return the output filename with the extension of the output format."""
+    root, extension = os.path.splitext(output_filename)
+    return f"{root}.{output_format}" if extension in (".csv", ".tsv", ".parquet") else output_filename
+
+
+def get_modification_time(path: str) -> float:
+    """Return the modification time of the file, or for a Parquet directory, of its most recently written part."""
+    if not os.path.isdir(path):
+        return os.path.getmtime(path)
+    return max([os.path.getmtime(path)] + [entry.stat().st_mtime for entry in os.scandir(path)])
+
+
+def get_current_parquet_filename(filename: str) -> Optional[str]:
+    """Return the Parquet file alongside the CSV or TSV file, if present and written no earlier than it.
+
+    A Parquet file older than the file is left over from an earlier run with the "parquet" output format.
+    """
+    parquet_filename = f"{os.path.splitext(filename)[0]}.parquet"
+    if not os.path.exists(parquet_filename):
+        return None
+    if os.path.exists(filename) and get_modification_time(parquet_filename) < get_modification_time(filename):
+        return None
+    return parquet_filename
+
+
+class MetricsWriters:
+    """ Registry of the metrics writers, one per output file
+
+    A single background thread flushes all the writers every `flush_interval_seconds`.
+    When the `output_format` is "parquet", the files are written as Parquet, with
+    the extension of the output filenames replaced by `.parquet`.
+    """
+    flush_interval_seconds = 5.0
+    output_format = "csv"
+
+    def __init__(self, output_directory: str, flush_interval_seconds: float = None, output_format: str = None):
+        self.output_directory = output_directory
+        if flush_interval_seconds is not None:
+            self.flush_interval_seconds = flush_interval_seconds
+        if output_format is not None:
+            if output_format not in OUTPUT_FORMATS:
+                raise MetricsWriterException(f"Unsupported output format: {output_format}")
+            self.output_format = output_format
+        self._lock = threading.Lock()
+        self._writers: Dict[str, MetricsWriter] = dict()
+        self._stop_flushing = threading.Event()
+        self._flush_thread: Optional[threading.Thread] = None
+
+    def get_writer(self, output_filename: str, fieldnames: List[str]) -> MetricsWriter:
+        with self._lock:
+            writer = self._writers.get(output_filename)
+            if writer is None:
+                filepath = os.path.join(self.output_directory, get_output_filename(output_filename, self.output_format))
+                if self.output_format == "parquet":
+                    writer = BufferedParquetWriter(filepath, fieldnames)
+                else:
+                    writer = BufferedCsvWriter(filepath, fieldnames)
+                self._writers[output_filename] = writer
+                self._start_flushing()
+            elif writer.fieldnames != list(fieldnames):
+                raise MetricsWriterException(
+                    f"Conflicting columns for '{output_filename}': {writer.fieldnames} != {list(fieldnames)}")
+            return writer
+
+    def _start_flushing(self) -> None:
+        if self._flush_thread is None:
+            self._flush_thread = threading.Thread(target=self._flush_periodically, name="MetricsFlush", daemon=True)
+            self._flush_thread.start()
+
+    def _flush_periodically(self) -> None:
+        while not self._stop_flushing.wait(self.flush_interval_seconds):
+            try:
+                self.flush_all()
+            except Exception:
+                logging.getLogger(__name__).exception("Failed to flush the metrics writers.")
+
+    def flush_all(self) -> None:
+        with self._lock:
+            writers = list(self._writers.values())
+        for writer in writers:
+            writer.flush()
+
+    def close_all(self) -> None:
+        self._stop_flushing.set()
+        if self._flush_thread is not None:
+            self._flush_thread.join()
+        with self._lock:
+            writers = list(self._writers.values())
+            self._writers.clear()
+        for writer in writers:
+            writer.close()
@@ -0,0 +1,400 @@
+"""Mock Terra Services
+This script/module runs a local stand-in for the Bond, Martha, Gen3 Fence and IndexD endpoints
+used by the response time monitor, and for the Terra orchestration submission status endpoint
+used by the workflow status polling, so that they can be benchmarked and tested offline.
+
+Each response is delayed by a latency drawn from a configurable distribution, and error
+responses (e.g. 401, 500, 502) and rate limiting (429) can be injected, so that the accuracy
+and the overhead of the monitor can be measured against known server behavior.
+Every request can be recorded in `mock_server_requests.csv`, with the latency added to it.
+
+To monitor the mock server, start it and pass its URL to the monitor, e.g.:
+
+    python3 -m terra_workflow_scale_test_tools.mock_terra_services --port 8080 --latency lognormal:0.2:0.5
+    python3 -m terra_workflow_scale_test_tools.monitor_response_times --project-name BDC \\
+        --terra-deployment-tier DEV --mock-server-url http://127.0.0.1:8080
+"""
+
+import argparse
+import asyncio
+import math
+import random
+import threading
+import time
+
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional
+
+from aiohttp import web
+
+from terra_workflow_scale_test_tools.metrics_writer import MetricsWriters
+
+# The Terra user token to use with the mock server, which accepts any bearer token
+MOCK_TERRA_USER_TOKEN = "mock-terra-user-token"
+
+ENDPOINT_NAMES = ['bond_link_url', 'bond_link_status', 'bond_access_token', 'bond_sa_key', 'martha',
+                  'drs_object', 'drs_access', 'fence_user_info', 'submission']
+
+
+class LatencyDistribution:
+    """ Distribution of the latency added to each response, in seconds """
+    formats = {
+        "constant": "constant:<seconds>",
+        "uniform": "uniform:<min seconds>:<max seconds>",
+        "exponential": "exponential:<mean seconds>",
+        "lognormal": "lognormal:<median seconds>:<sigma>",
+    }
+
+    def __init__(self, kind: str = "constant", *parameters: float):
+        self.kind = kind
+        self.parameters = parameters if parameters else (0.0,)
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "constant":
+            return self.parameters[0]
+        elif self.kind == "uniform":
+            return rng.uniform(self.parameters[0], self.parameters[1])
+        elif self.kind == "exponential":
+            return rng.expovariate(1.0 / self.parameters[0]) if self.parameters[0] > 0 else 0.0
+        else:
+            return rng.lognormvariate(math.log(self.parameters[0]), self.parameters[1])
+
+    @classmethod
+    def parse(cls, spec: str) -> 'LatencyDistribution':
+        kind, *values = spec.strip().split(":")
+        if kind not in cls.formats:
+            raise ValueError(f"Unsupported latency distribution: '{spec}'")
+        expected_count = cls.formats[kind].count(":")
+        try:
+            parameters = [float(value) for value in values]
+        except ValueError:
+            parameters = []
+        if len(parameters) != expected_count or min(parameters) < 0 or \
+                (kind == "lognormal" and parameters[0] == 0):
+            raise ValueError(f"Invalid latency distribution: '{spec}', expected: {cls.formats[kind]}")
+        return cls(kind, *parameters)
+
+
+class RateLimiter:
+    """ Token bucket limiting the rate of requests, allowing bursts of up to `burst` requests """
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return True
+        return False
+
+
+@dataclass
+class MockServiceConfig:
+    latency: LatencyDistribution = field(default_factory=LatencyDistribution)
+    # Latency distributions for specific endpoints, overriding `latency`
+    endpoint_latencies: Dict[str, LatencyDistribution] = field(default_factory=dict)
+    # The probability of responding to a request with each error status code
+    error_probabilities: Dict[int, float] = field(default_factory=dict)
+    # The maximum rate of requests to each endpoint, per second, beyond which 429 is returned
+    rate_limit: Optional[float] = None
+    rate_limit_burst: Optional[float] = None
+    fence_token_ttl_seconds: int = 3600
+    # The mock submission progresses from all workflows running to all succeeded over its duration.
+    submission_workflow_count: int = 1000
+    submission_duration_seconds: float = 600
+    seed: Optional[int] = None
+
+
+class MockTerraServices:
+    """ aiohttp application implementing the mock endpoints """
+    output_filename = "mock_server_requests.csv"
+
+    def __init__(self, config: MockServiceConfig = None, output_dir: str = None):
+        self.config = config if config is not None else MockServiceConfig()
+        self.rng = random.Random(self.config.seed)
+        self.started_at = time.time()
+        self.request_counts = Counter()
+        self.response_code_counts = Counter()
+        self._rate_limiters: Dict[str, RateLimiter] = dict()
+        if output_dir is not None:
+            Path(output_dir).mkdir(parents=True, exist_ok=True)
+        self.metrics_writers = MetricsWriters(output_dir) if output_dir is not None else None
+        self._writer = self.metrics_writers.get_writer(
+            self.output_filename, ["arrival_time", "endpoint", "injected_latency", "response_code"]) \
+            if self.metrics_writers is not None else None
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        link_path = "/api/link/v1/{provider}"
+        app.router.add_route("OPTIONS", f"{link_path}/authorization-url",
+                             self._endpoint('bond_link_url', self.handle_bond_link_url, requires_auth=False))
+        app.router.add_get(link_path, self._endpoint('bond_link_status', self.handle_bond_link_status))
+        app.router.add_get(f"{link_path}/accesstoken", self._endpoint('bond_access_token',
+                                                                      self.handle_bond_access_token))
+        app.router.add_get(f"{link_path}/serviceaccount/key", self._endpoint('bond_sa_key', self.handle_bond_sa_key))
+        app.router.add_post("/martha_v3/", self._endpoint('martha', self.handle_martha))
+        # IndexD object ids may contain a '/', so the access route is matched first.
+        app.router.add_get("/ga4gh/drs/v1/objects/{object_id:.+}/access/{access_id}",
+                           self._endpoint('drs_access', self.handle_drs_access))
+        app.router.add_get("/ga4gh/drs/v1/objects/{object_id:.+}",
+                           self._endpoint('drs_object', self.handle_drs_object, requires_auth=False))
+        app.router.add_get("/user/user/", self._endpoint('fence_user_info', self.handle_fence_user_info))
+        app.router.add_get("/api/workspaces/{namespace}/{name}/submissions/{submission_id}",
+                           self._endpoint('submission', self.handle_submission))
+        app.router.add_get("/mock/stats", self.handle_stats)
+        app.on_cleanup.append(self._close)
+        return app
+
+    async def _close(self, app: web.Application) -> None:
+        if self.metrics_writers is not None:
+            self.metrics_writers.close_all()
+
+    def _is_rate_limited(self, endpoint_name: str) -> bool:
+        if self.config.rate_limit is None:
+            return False
+        rate_limiter = self._rate_limiters.get(endpoint_name)
+        if rate_limiter is None:
+            rate_limiter = RateLimiter(self.config.rate_limit, self.config.rate_limit_burst)
+            self._rate_limiters[endpoint_name] = rate_limiter
+        return not rate_limiter.try_acquire()
+
+    def _injected_error_status(self) -> Optional[int]:
+        value = self.rng.random()
+        for status, probability in sorted(self.config.error_probabilities.items()):
+            if value < probability:
+                return status
+            value -= probability
+        return None
+
+    def _endpoint(self, endpoint_name: str, handler: Callable[[web.Request], Awaitable[web.Response]],
+                  requires_auth: bool = True) -> Callable[[web.Request], Awaitable[web.Response]]:
+        async def handle(request: web.Request) -> web.Response:
+            arrival_time = time.time()
+            self.request_counts[endpoint_name] += 1
+            latency = 0.0
+            if self._is_rate_limited(endpoint_name):
+                response = web.json_response(dict(message="Too Many Requests"), status=429,
+                                             headers={'Retry-After': "1"})
+            else:
+                status = self._injected_error_status()
+                if status is None and requires_auth and \
+                        not request.headers.get('authorization', "").startswith("Bearer "):
+                    status = 401
+                latency = self.config.endpoint_latencies.get(endpoint_name, self.config.latency).sample(self.rng)
+                await asyncio.sleep(latency)
+                if status is None:
+                    response = await handler(request)
+                else:
+                    response = web.json_response(dict(message=f"Mock error {status}"), status=status)
+            self.response_code_counts[response.status] += 1
+            if self._writer is not None:
+                self._writer.write_row(dict(arrival_time=round(arrival_time, 6), endpoint=endpoint_name,
+                                            injected_latency=round(latency, 6), response_code=response.status))
+            return response
+
+        return handle
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(uptime_seconds=round(time.time() - self.started_at, 3),
+                                      request_counts=dict(self.request_counts),
+                                      response_code_counts={str(code): count for code, count
+                                                            in self.response_code_counts.items()}))
+
+    async def handle_bond_link_url(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(url="https://mock-fence/user/oauth2/authorize"))
+
+    async def handle_bond_link_status(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(issued_at=datetime.now(timezone.utc).isoformat(),
+                                      username="mock-user"))
+
+    async def handle_bond_access_token(self, request: web.Request) -> web.Response:
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.config.fence_token_ttl_seconds)
+        return web.json_response(dict(token=f"mock-fence-token-{self.request_counts['bond_access_token']}",
+                                      expires_at=expires_at.strftime("%Y-%m-%dT%H:%M:%S.%fZ")))
+
+    async def handle_bond_sa_key(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(data=dict(type="service_account", project_id="mock-project",
+                                                client_email="mock-sa@mock-project.iam.gserviceaccount.com",
+                                                private_key_id="mock-key-id")))
+
+    async def handle_martha(self, request: web.Request) -> web.Response:
+        drs_uri = (await request.json()).get('url', "")
+        object_id = drs_uri.split(":")[-1]
+        return web.json_response(dict(gsUri=f"gs://mock-bucket/{object_id}",
+                                      googleServiceAccount=None,
+                                      accessUrl=None,
+                                      hashes=dict(md5="0" * 32)))
+
+    async def handle_drs_object(self, request: web.Request) -> web.Response:
+        object_id = request.match_info['object_id']
+        return web.json_response(dict(id=object_id, size=1024,
+                                      checksums=[dict(type="md5", checksum="0" * 32)],
+                                      access_methods=[dict(type="gs", access_id="gs",
+                                                           access_url=dict(url=f"gs://mock-bucket/{object_id}"))]))
+
+    async def handle_drs_access(self, request: web.Request) -> web.Response:
+        object_id = request.match_info['object_id']
+        return web.json_response(dict(url=f"https://storage.googleapis.com/mock-bucket/{object_id}?signature=mock"))
+
+    async def handle_fence_user_info(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(username="mock-user", is_admin=False, authz=dict()))
+
+    async def handle_submission(self, request: web.Request) -> web.Response:
+        workflow_count = self.config.submission_workflow_count
+        elapsed_fraction = (time.time() - self.started_at) / self.config.submission_duration_seconds \
+            if self.config.submission_duration_seconds > 0 else 1.0
+        finished_count = min(workflow_count, int(workflow_count * elapsed_fraction))
+        submission_date = datetime.fromtimestamp(self.started_at, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        workflows = [dict(status="Succeeded" if i < finished_count else "Running",
+                          workflowId=f"00000000-0000-0000-0000-{i:012d}",
+                          workflowEntity=dict(entityType="sample", entityName=f"{i:05d}"))
+                     for i in range(workflow_count)]
+        return web.json_response(dict(status="Done" if finished_count == workflow_count else "Running",
+                                      submissionDate=submission_date,
+                                      methodConfigurationNamespace="mock-namespace",
+                                      methodConfigurationName="mock-method-configuration",
+                                      submitter="mock-user@example.com",
+                                      submissionId=request.match_info['submission_id'],
+                                      submissionEntity=dict(entityType="sample_set", entityName="mock-sample-set"),
+                                      useCallCache=False,
+                                      userComment="Mock submission",
+                                      workflows=workflows))
+
+
+class MockServer:
+    """ Runs the mock services on an event loop in a background thread of the current process """
+    def __init__(self, config: MockServiceConfig = None, host: str = "127.0.0.1", port: int = 0,
+                 output_dir: str = None):
+        self.services = MockTerraServices(config, output_dir)
+        self.host = host
+        self.port = port
+        self.url: Optional[str] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+
+    async def _start_site(self) -> None:
+        self._runner = web.AppRunner(self.services.create_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # The port is assigned by the OS when 0 is given.
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+
+    def start(self) -> str:
+        """Start the server and return its URL."""
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._loop.run_until_complete(self._start_site())
+            finally:
+                started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self._runner.cleanup())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="MockServer", daemon=True)
+        self._thread.start()
+        started.wait()
+        if self.url is None:
+            raise Exception("Failed to start the mock server.")
+        return self.url
+
+    def stop(self) -> None:
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+def parse_error_probability(spec: str) -> Dict[int, float]:
+    try:
+        status, probability = spec.split("=")
+        return {int(status): float(probability)}
+    except ValueError:
+        raise ValueError(f"Invalid error probability: '{spec}', expected: <status code>=<probability>")
+
+
+def parse_endpoint_latency(spec: str) -> Dict[str, LatencyDistribution]:
+    if spec.count("=") != 1:
+        raise ValueError(f"Invalid endpoint latency: '{spec}', expected: <endpoint>=<distribution>")
+    endpoint_name, latency_spec = spec.split("=")
+    if endpoint_name not in ENDPOINT_NAMES:
+        raise ValueError(f"Unknown endpoint: '{endpoint_name}', expected one of: {ENDPOINT_NAMES}")
+    return {endpoint_name: LatencyDistribution.parse(latency_spec)}
+
+
+def parse_arg_list(arg_list: list = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, required=False, default="127.0.0.1",
+                        help="Address to listen on")
+    parser.add_argument('--port', type=int, required=False, default=8080,
+                        help="Port to listen on")
+    parser.add_argument('--latency', type=str, required=False, default="constant:0",
+                        help="Latency distribution of all the endpoints. One of: " +
+                             ", ".join(LatencyDistribution.formats.values()))
+    parser.add_argument('--endpoint-latency', type=str, required=False, action='append', default=[],
+                        help="Latency distribution of one endpoint, as <endpoint>=<distribution>. "
+                             f"Endpoints: {', '.join(ENDPOINT_NAMES)}. May be given more than once.")
+    parser.add_argument('--error-probability', type=str, required=False, action='append', default=[],
+                        help="Probability of an error response, as <status code>=<probability>, "
+                             "e.g. 502=0.01. May be given more than once.")
+    parser.add_argument('--rate-limit', type=float, required=False, default=None,
+                        help="Maximum requests per second to each endpoint, beyond which 429 is returned")
+    parser.add_argument('--rate-limit-burst', type=float, required=False, default=None,
+                        help="Maximum burst of requests to each endpoint allowed by the rate limit")
+    parser.add_argument('--submission-workflow-count', type=int, required=False,
+                        default=MockServiceConfig.submission_workflow_count,
+                        help="Number of workflows in the mock submission")
+    parser.add_argument('--submission-duration-seconds', type=float, required=False,
+                        default=MockServiceConfig.submission_duration_seconds,
+                        help="Time from the server start until all the mock submission workflows have succeeded")
+    parser.add_argument('--seed', type=int, required=False, default=None,
+                        help="Random seed for the latency and error injection")
+    parser.add_argument('--output-dir', type=str, required=False, default=None,
+                        help="Directory to record the requests received in")
+    args = parser.parse_args(arg_list)
+    try:
+        args.config = create_config(args)
+    except ValueError as ex:
+        parser.error(str(ex))
+    return args
+
+
+def create_config(args: argparse.Namespace) -> MockServiceConfig:
+    endpoint_latencies = dict()
+    for spec in args.endpoint_latency:
+        endpoint_latencies.update(parse_endpoint_latency(spec))
+    error_probabilities = dict()
+    for spec in args.error_probability:
+        error_probabilities.update(parse_error_probability(spec))
+    if sum(error_probabilities.values()) > 1:
+        raise ValueError(f"The error probabilities add up to more than 1: {args.error_probability}")
+    return MockServiceConfig(latency=LatencyDistribution.parse(args.latency),
+                             endpoint_latencies=endpoint_latencies,
+                             error_probabilities=error_probabilities,
+                             rate_limit=args.rate_limit,
+                             rate_limit_burst=args.rate_limit_burst,
+                             submission_workflow_count=args.submission_workflow_count,
+                             submission_duration_seconds=args.submission_duration_seconds,
+                             seed=args.seed)
+
+
+def main(arg_list: list = None) -> None:
+    args = parse_arg_list(arg_list)
+    services = MockTerraServices(args.config, args.output_dir)
+    web.run_app(services.create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
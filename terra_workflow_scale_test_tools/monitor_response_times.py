@@ -1,23 +1,31 @@
 import argparse
-import csv
+import asyncio
 import functools
 import json
 import logging
 import os
 import psutil
+import signal
 import threading
 import time
 
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from datetime import datetime, timezone
 from enum import Enum
 from pathlib import Path
-from threading import Thread
-from typing import Tuple, Optional, Any
+from typing import Tuple, Optional, Any, Callable, Awaitable, Dict, List
+from urllib.parse import urlsplit
 
-import requests
-import schedule
+import aiohttp
+
+from terra_workflow_scale_test_tools.drs_uri_pool import DrsUriPool
+from terra_workflow_scale_test_tools.http_phase_timing import PHASE_NAMES, RequestPhaseTimer, \
+    create_phase_trace_config, create_timed_ssl_context
+from terra_workflow_scale_test_tools.latency_histogram import LatencyHistograms, format_window_percentiles
+from terra_workflow_scale_test_tools.live_metrics import LiveMetricsWriter
+from terra_workflow_scale_test_tools.metrics_writer import OUTPUT_FORMATS, MetricsWriters
+from terra_workflow_scale_test_tools.token_cache import FetchedToken, TokenCache, terra_user_token_cache
 
 
 class DeploymentInfo:
@@ -25,6 +33,8 @@ class DeploymentInfo:
     _terra_deployment_tier = None
     _terra_deployment_info = None
     _gen3_deployment_info = None
+    # The server to send all the requests to instead, e.g. a local mock server
+    _server_override = None
 
     class Project(Enum):
         ANVIL = 1
@@ -62,6 +72,7 @@ class DeploymentInfo:
         bond_host: str
         bond_provider: str
         martha_host: str
+        url_scheme: str = "https"
 
     __terra_bdc_dev = TerraDeploymentInfo("broad-bond-dev.appspot.com",
                                           "fence",
@@ -92,6 +103,7 @@ class DeploymentInfo:
         gen3_host: str
         public_drs_uri: str
         cloud_uri_scheme: str = "gs"
+        url_scheme: str = "https"
 
     __gen3_bdc_staging = Gen3DeploymentInfo("staging.gen3.biodatacatalyst.nhlbi.nih.gov",
                                             "drs://dg.712C:dg.712C/fa640b0e-9779-452f-99a6-16d833d15bd0")
@@ -108,6 +120,18 @@ class DeploymentInfo:
     class UnsupportedConfigurationException(Exception):
         pass
 
+    @classmethod
+    def set_server_override(cls, server_url: str) -> None:
+        """Send the Bond, Martha and Gen3 requests to the given server, such as a local
+        mock server, rather than to the hosts of the deployment.
+        """
+        url_parts = urlsplit(server_url)
+        if not url_parts.scheme or not url_parts.netloc:
+            raise Exception(f"Invalid server URL: '{server_url}'")
+        cls._server_override = url_parts
+        cls._terra_deployment_info = None
+        cls._gen3_deployment_info = None
+
     @classmethod
     def terra_factory(cls) -> TerraDeploymentInfo:
         if cls._terra_deployment_info is None:
@@ -129,6 +153,11 @@ class DeploymentInfo:
             if cls._terra_deployment_info is None:
                 raise cls.UnsupportedConfigurationException(
                     f"Response time monitoring for the combination of project \'{cls._project.name}\' and Terra deployment tier \'{cls._terra_deployment_tier.name}\' is currently unsupported.")
+            if cls._server_override is not None:
+                cls._terra_deployment_info = replace(cls._terra_deployment_info,
+                                                     bond_host=cls._server_override.netloc,
+                                                     martha_host=cls._server_override.netloc,
+                                                     url_scheme=cls._server_override.scheme)
         return cls._terra_deployment_info
 
     @classmethod
@@ -148,10 +177,71 @@ class DeploymentInfo:
             if cls._gen3_deployment_info is None:
                 raise cls.UnsupportedConfigurationException(
                     f"Response time monitoring for the combination of project '{cls._project.name}' and Terra deployment tier '{cls._terra_deployment_tier.name}' is currently unsupported.")
+            if cls._server_override is not None:
+                cls._gen3_deployment_info = replace(cls._gen3_deployment_info,
+                                                    gen3_host=cls._server_override.netloc,
+                                                    url_scheme=cls._server_override.scheme)
         return cls._gen3_deployment_info
 
 
+class ConnectionMode(Enum):
+    # Reuse keep-alive connections from the per-host pools, so that the
+    # measured response time is dominated by server latency.
+    WARM = 1
+    # Open a new connection (DNS lookup, TCP and TLS handshakes) for every
+    # request, as a client without connection reuse would experience it.
+    COLD = 2
+
+    @classmethod
+    def from_name(cls, mode_name: str) -> 'ConnectionMode':
+        mode = mode_name.strip().upper()
+        try:
+            return cls[mode]
+        except KeyError as ex:
+            raise Exception(f"Invalid connection mode name: '{mode_name}'", ex)
+
+
+class HttpSessions:
+    """Per-host aiohttp client sessions shared by all the reporters running on the monitoring event loop.
+
+    Sessions are created lazily, on first use from within the event loop, and must be closed
+    from the same event loop using `close`.
+    """
+    # The maximum number of concurrent connections to each host, or 0 for no limit
+    max_connections_per_host = 10
+
+    def __init__(self, connection_mode: ConnectionMode = ConnectionMode.WARM, max_connections_per_host: int = None):
+        self.connection_mode = connection_mode
+        if max_connections_per_host is not None:
+            self.max_connections_per_host = max_connections_per_host
+        self._sessions: Dict[str, aiohttp.ClientSession] = dict()
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        if self.connection_mode == ConnectionMode.COLD:
+            connector = aiohttp.TCPConnector(force_close=True, use_dns_cache=False,
+                                             limit=self.max_connections_per_host, ssl=create_timed_ssl_context())
+        else:
+            connector = aiohttp.TCPConnector(limit=self.max_connections_per_host, ssl=create_timed_ssl_context())
+        # Record the duration of each phase of the requests made with a RequestPhaseTimer.
+        return aiohttp.ClientSession(connector=connector, trace_configs=[create_phase_trace_config()])
+
+    def get_session(self, host: str) -> aiohttp.ClientSession:
+        session = self._sessions.get(host)
+        if session is None or session.closed:
+            session = self._create_session()
+            self._sessions[host] = session
+        return session
+
+    async def close(self) -> None:
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for session in sessions:
+            await session.close()
+
+
 class MonitoringUtilityMethods:
+    monitoring_metric_names = ['start_time', 'response_duration', 'response_code', 'response_reason'] + PHASE_NAMES
+
     def __init__(self):
         super().__init__()
 
@@ -160,19 +250,24 @@ class MonitoringUtilityMethods:
         return datetime.fromtimestamp(seconds_since_epoch, timezone.utc).strftime("%Y/%m/%d %H:%M:%S")
 
     @staticmethod
-    def monitoring_info(start_time: float, response: requests.Response):
-        response_duration = round(time.time() - start_time, 3)
-        response_code = response.status_code
+    def monitoring_info(start_time: float, response: aiohttp.ClientResponse, response_duration: float = None,
+                        phase_durations: Dict[str, Optional[float]] = None):
+        if response_duration is None:
+            response_duration = round(time.time() - start_time, 3)
+        response_code = response.status
         response_reason = response.reason
-        return dict(start_time=start_time, response_duration=response_duration,
-                    response_code=response_code, response_reason=response_reason)
+        mon_info = dict(start_time=start_time, response_duration=response_duration,
+                        response_code=response_code, response_reason=response_reason)
+        if phase_durations is not None:
+            mon_info.update(phase_durations)
+        return mon_info
 
-    def flatten_monitoring_info_dict(self, monitoring_info_dict: dict) -> dict:
+    def flatten_monitoring_info_dict(self, monitoring_info_dict: dict, format_timestamps: bool = True) -> dict:
         flattened = dict()
         for operation_name, mon_info in monitoring_info_dict.items():
             for metric, value in mon_info.items():
-                if metric in ['start_time', 'response_duration', 'response_code', 'response_reason']:
-                    if metric == 'start_time' and type(value) == float:
+                if metric in self.monitoring_metric_names:
+                    if metric == 'start_time' and type(value) == float and format_timestamps:
                         value = self.format_timestamp_as_utc(value)
                     flattened[f"{operation_name}.{metric}"] = value
         return flattened
@@ -182,17 +277,60 @@ class MonitoringUtilityMethods:
         global output_dir
         return os.path.join(output_dir, output_filename)
 
-    def write_monitoring_info_to_csv(self, monitoring_info_dict: dict, output_filename: str) -> None:
-        output_filename = self.get_output_filepath(output_filename)
-        write_header = False if Path(output_filename).exists() else True
+    @classmethod
+    def get_monitoring_fieldnames(cls, operation_names: List[str]) -> List[str]:
+        return sorted(f"{operation_name}.{metric}"
+                      for operation_name in operation_names for metric in cls.monitoring_metric_names)
+
+    def write_monitoring_info_to_csv(self, monitoring_info_dict: dict, output_filename: str,
+                                     operation_names: List[str] = None) -> None:
+        """Buffer a row of monitoring info to be written to the output file.
+
+        The columns of the file are fixed by `operation_names`, which defaults to the
+        operations in the first row written, and any missing values are filled explicitly.
+        """
+        global metrics_writers
+        if operation_names is None:
+            operation_names = list(monitoring_info_dict.keys())
+        writer = metrics_writers.get_writer(output_filename, self.get_monitoring_fieldnames(operation_names))
+        writer.write_row(self.flatten_monitoring_info_dict(monitoring_info_dict, not writer.typed_timestamps))
+
+    @staticmethod
+    def record_latencies(monitoring_info_dict: dict) -> None:
+        """Record the response durations, and the durations of the request phases that occurred,
+        in the rolling latency histograms of the operations, and of their phases, e.g. `martha.ttfb`.
+        """
+        global latency_histograms
+        for operation_name, mon_info in monitoring_info_dict.items():
+            if mon_info.get('response_duration') is not None and mon_info.get('response_code') is not None:
+                latency_histograms.record(operation_name, mon_info['response_duration'])
+                for phase_name in PHASE_NAMES:
+                    if mon_info.get(phase_name) is not None:
+                        latency_histograms.record(f"{operation_name}.{phase_name}", mon_info[phase_name])
+
+    @staticmethod
+    async def timed_request(method: str, url: str, **kwargs) -> Tuple[aiohttp.ClientResponse, bytes, dict]:
+        """Perform an HTTP request using the pooled session for the URL host.
 
-        row_info = self.flatten_monitoring_info_dict(monitoring_info_dict)
-        with open(output_filename, 'a', newline='') as csvfile:
-            fieldnames = sorted(row_info.keys())
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            if write_header:
-                writer.writeheader()
-            writer.writerow(row_info)
+        The response body is read before returning, so that the request is complete
+        and the connection has been released back to its pool.
+        Returns the response, the response body and the monitoring info for the request,
+        including the duration of each phase of the request.
+        """
+        global http_sessions
+        session = http_sessions.get_session(urlsplit(url).netloc)
+        start_time = time.time()
+        start_counter = time.perf_counter()
+        with RequestPhaseTimer() as timer:
+            async with session.request(method, url, trace_request_ctx=timer, **kwargs) as resp:
+                timer.start('body')
+                body = await resp.read()
+                timer.end('body')
+        response_duration = round(time.perf_counter() - start_counter, 6)
+        mon_info = MonitoringUtilityMethods.monitoring_info(start_time, resp, response_duration,
+                                                            timer.get_phase_durations())
+        logger.debug(f"Request URL: {resp.url}")
+        return resp, body, mon_info
 
 
 class TerraMethods(MonitoringUtilityMethods):
@@ -204,63 +342,62 @@ class TerraMethods(MonitoringUtilityMethods):
     # When run in Terra, this returns the Terra user pet SA token
     @staticmethod
     def get_terra_user_pet_sa_token() -> str:
-        import google.auth.transport.requests
-        creds, projects = google.auth.default()
-        creds.refresh(google.auth.transport.requests.Request())
-        token = creds.token
-        return token
+        return terra_user_token_cache.get_token()
+
+    @staticmethod
+    async def get_terra_user_token() -> str:
+        return await terra_user_token_cache.get_token_async()
 
-    def get_external_identity_link_url_from_bond(self) -> Tuple[str, dict]:
+    async def get_external_identity_link_url_from_bond(self) -> Tuple[str, dict]:
         headers = {
             'content-type': "*/*"
         }
-        start_time = time.time()
-        resp = requests.options(
-            f"https://{self._terra_info.bond_host}/api/link/v1/{self._terra_info.bond_provider}/authorization-url?scopes=openid&scopes=google_credentials&scopes=data&scopes=user&redirect_uri=https://app.terra.bio/#fence-callback&state=eyJwcm92aWRlciI6ImZlbmNlIn0=",
+        resp, body, mon_info = await self.timed_request(
+            "OPTIONS",
+            f"{self._terra_info.url_scheme}://{self._terra_info.bond_host}/api/link/v1/{self._terra_info.bond_provider}/authorization-url?scopes=openid&scopes=google_credentials&scopes=data&scopes=user&redirect_uri=https://app.terra.bio/#fence-callback&state=eyJwcm92aWRlciI6ImZlbmNlIn0=",
             headers=headers)
-        logger.debug(f"Request URL: {resp.request.url}")
-        link_url = resp.url if resp.ok else None
-        return link_url, self.monitoring_info(start_time, resp)
+        link_url = str(resp.url) if resp.ok else None
+        return link_url, mon_info
 
-    def get_external_identity_status_from_bond(self, terra_user_token: str) -> Tuple[dict, dict]:
+    async def get_external_identity_status_from_bond(self, terra_user_token: str) -> Tuple[dict, dict]:
         headers = {
             'authorization': f"Bearer {terra_user_token}",
             'content-type': "application/json"
         }
-        start_time = time.time()
-        resp = requests.get(f"https://{self._terra_info.bond_host}/api/link/v1/{self._terra_info.bond_provider}",
-                            headers=headers)
-        logger.debug(f"Request URL: {resp.request.url}")
-        resp_json = resp.json() if resp.ok else None
-        return resp_json, self.monitoring_info(start_time, resp)
+        resp, body, mon_info = await self.timed_request(
+            "GET", f"{self._terra_info.url_scheme}://{self._terra_info.bond_host}/api/link/v1/{self._terra_info.bond_provider}",
+            headers=headers)
+        resp_json = json.loads(body) if resp.ok else None
+        return resp_json, mon_info
+
+    async def get_fence_token_from_bond(self, terra_user_token: str) -> Tuple[str, dict]:
+        resp_json, mon_info = await self.get_fence_token_response_from_bond(terra_user_token)
+        token = resp_json.get('token') if resp_json is not None else None
+        return token, mon_info
 
-    def get_fence_token_from_bond(self, terra_user_token: str) -> Tuple[str, dict]:
+    async def get_fence_token_response_from_bond(self, terra_user_token: str) -> Tuple[dict, dict]:
         headers = {
             'authorization': f"Bearer {terra_user_token}",
             'content-type': "application/json"
         }
-        start_time = time.time()
-        resp = requests.get(
-            f"https://{self._terra_info.bond_host}/api/link/v1/{self._terra_info.bond_provider}/accesstoken",
+        resp, body, mon_info = await self.timed_request(
+            "GET", f"{self._terra_info.url_scheme}://{self._terra_info.bond_host}/api/link/v1/{self._terra_info.bond_provider}/accesstoken",
             headers=headers)
-        logger.debug(f"Request URL: {resp.request.url}")
-        token = resp.json().get('token') if resp.ok else None
-        return token, self.monitoring_info(start_time, resp)
+        resp_json = json.loads(body) if resp.ok else None
+        return resp_json, mon_info
 
-    def get_service_account_key_from_bond(self, terra_user_token: str) -> Tuple[dict, dict]:
+    async def get_service_account_key_from_bond(self, terra_user_token: str) -> Tuple[dict, dict]:
         headers = {
             'authorization': f"Bearer {terra_user_token}",
             'content-type': "application/json"
         }
-        start_time = time.time()
-        resp = requests.get(
-            f"https://{self._terra_info.bond_host}/api/link/v1/{self._terra_info.bond_provider}/serviceaccount/key",
+        resp, body, mon_info = await self.timed_request(
+            "GET", f"{self._terra_info.url_scheme}://{self._terra_info.bond_host}/api/link/v1/{self._terra_info.bond_provider}/serviceaccount/key",
             headers=headers)
-        logger.debug(f"Request URL: {resp.request.url}")
-        sa_key = resp.json().get('data') if resp.ok else None
-        return sa_key, self.monitoring_info(start_time, resp)
+        sa_key = json.loads(body).get('data') if resp.ok else None
+        return sa_key, mon_info
 
-    def get_martha_drs_response(self, terra_user_token: str, drs_uri: str = None) -> Tuple[dict, dict]:
+    async def get_martha_drs_response(self, terra_user_token: str, drs_uri: str = None) -> Tuple[dict, dict]:
         if drs_uri is None:
             drs_uri = self._gen3_info.public_drs_uri
 
@@ -272,12 +409,11 @@ class TerraMethods(MonitoringUtilityMethods):
         # Request the same fields as the Terra workflow DRS Localizer does.
         data = json.dumps(dict(url=drs_uri, fields=['gsUri', 'googleServiceAccount', 'accessUrl', 'hashes']))
 
-        start_time = time.time()
-        resp = requests.post(f"https://{self._terra_info.martha_host}/martha_v3/",
-                             headers=headers, data=data)
-        logger.debug(f"Request URL: {resp.request.url}")
-        resp_json = resp.json() if resp.ok else None
-        return resp_json, self.monitoring_info(start_time, resp)
+        resp, body, mon_info = await self.timed_request(
+            "POST", f"{self._terra_info.url_scheme}://{self._terra_info.martha_host}/martha_v3/",
+            headers=headers, data=data)
+        resp_json = json.loads(body) if resp.ok else None
+        return resp_json, mon_info
 
 
 class Gen3Methods(MonitoringUtilityMethods):
@@ -285,7 +421,7 @@ class Gen3Methods(MonitoringUtilityMethods):
         super().__init__()
         self.gen3_info = DeploymentInfo.gen3_factory()
 
-    def get_gen3_drs_resolution(self, drs_uri: str = None) -> Tuple[dict, dict]:
+    async def get_gen3_drs_resolution(self, drs_uri: str = None) -> Tuple[dict, dict]:
         if drs_uri is None:
             drs_uri = self.gen3_info.public_drs_uri
 
@@ -296,12 +432,11 @@ class Gen3Methods(MonitoringUtilityMethods):
             'content-type': "application/json"
         }
 
-        start_time = time.time()
-        resp = requests.get(f"https://{self.gen3_info.gen3_host}/ga4gh/drs/v1/objects/{object_id}",
-                            headers=headers)
-        logger.debug(f"Request URL: {resp.request.url}")
-        resp_json = resp.json() if resp.ok else None
-        return resp_json, self.monitoring_info(start_time, resp)
+        resp, body, mon_info = await self.timed_request(
+            "GET", f"{self.gen3_info.url_scheme}://{self.gen3_info.gen3_host}/ga4gh/drs/v1/objects/{object_id}",
+            headers=headers)
+        resp_json = json.loads(body) if resp.ok else None
+        return resp_json, mon_info
 
     @staticmethod
     def _get_drs_access_id(drs_response: dict, cloud_uri_scheme: str) -> Optional[Any]:
@@ -310,7 +445,7 @@ class Gen3Methods(MonitoringUtilityMethods):
                 return access_method['access_id']
         return None
 
-    def get_gen3_drs_access(self, fence_user_token: str, drs_uri: str = None,
+    async def get_gen3_drs_access(self, fence_user_token: str, drs_uri: str = None,
                             access_id: str = "gs") -> Tuple[dict, dict]:
 
         if drs_uri is None:
@@ -324,85 +459,261 @@ class Gen3Methods(MonitoringUtilityMethods):
             'content-type': "application/json"
         }
 
-        start_time = time.time()
-        resp = requests.get(f"https://{self.gen3_info.gen3_host}/ga4gh/drs/v1/objects/{object_id}/access/{access_id}",
-                            headers=headers)
-        logger.debug(f"Request URL: {resp.request.url}")
-        access_url = resp.json().get('url') if resp.ok else None
-        return access_url, self.monitoring_info(start_time, resp)
+        resp, body, mon_info = await self.timed_request(
+            "GET", f"{self.gen3_info.url_scheme}://{self.gen3_info.gen3_host}/ga4gh/drs/v1/objects/{object_id}/access/{access_id}",
+            headers=headers)
+        access_url = json.loads(body).get('url') if resp.ok else None
+        return access_url, mon_info
 
-    def get_fence_userinfo(self, fence_user_token: str):
+    async def get_fence_userinfo(self, fence_user_token: str):
         headers = {
             'authorization': f"Bearer {fence_user_token}",
             'content-type': "application/json",
             'accept': '*/*'
         }
 
-        start_time = time.time()
-        resp = requests.get(f"https://{self.gen3_info.gen3_host}/user/user/", headers=headers)
-        logger.debug(f"Request URL: {resp.request.url}")
-        resp_json = resp.json() if resp.ok else None
-        return resp_json, self.monitoring_info(start_time, resp)
+        resp, body, mon_info = await self.timed_request(
+            "GET", f"{self.gen3_info.url_scheme}://{self.gen3_info.gen3_host}/user/user/", headers=headers)
+        resp_json = json.loads(body) if resp.ok else None
+        return resp_json, mon_info
+
+
+async def fetch_fence_user_token() -> FetchedToken:
+    terra_methods = TerraMethods()
+    terra_user_token = await terra_methods.get_terra_user_token()
+    resp_json, mon_info = await terra_methods.get_fence_token_response_from_bond(terra_user_token)
+    if resp_json is None or resp_json.get('token') is None:
+        raise Exception(f"Failed to get Fence user token from Bond: "
+                        f"{mon_info['response_code']} {mon_info['response_reason']}")
+    expires_at = None
+    if resp_json.get('expires_at'):
+        try:
+            # Convert the expires_at format to the specific ISO format supported by `fromisoformat`
+            expires_at = datetime.fromisoformat(resp_json['expires_at'].replace('Z', '+00:00')).timestamp()
+        except ValueError:
+            logger.warning(f"Unrecognized Fence token expires_at value: {resp_json['expires_at']}")
+    return FetchedToken(resp_json['token'], expires_at, mon_info)
+
+
+# Shared by the reporters that only need a valid Fence token, rather than
+# measuring the Bond access token endpoint itself.
+fence_user_token_cache = TokenCache("fence_user_token", fetch_token_async=fetch_fence_user_token)
+
+
+class CancelJob:
+    """Returned by a scheduled job to have it removed from the schedule."""
+    pass
+
+
+class OverlapPolicy(Enum):
+    # Skip the run for a tick while the previous run of the job is still in flight.
+    SKIP = 1
+    # Start the run for a tick as soon as the previous run finishes,
+    # with at most one run waiting; the runs for any further ticks are skipped.
+    QUEUE = 2
+    # Cancel the previous run if it is still in flight at the next tick, and start a new run.
+    CANCEL_LATE = 3
+
+    @classmethod
+    def from_name(cls, policy_name: str) -> 'OverlapPolicy':
+        policy = policy_name.strip().upper().replace("-", "_")
+        try:
+            return cls[policy]
+        except KeyError as ex:
+            raise Exception(f"Invalid overlap policy name: '{policy_name}'", ex)
+
+
+@dataclass
+class ScheduledJob:
+    interval_seconds: float
+    job_func: Callable[[], Awaitable[Any]]
+    overlap_policy: OverlapPolicy
+    # Whether the runs of the job count against the scheduler's limit on concurrent runs
+    concurrency_limited: bool = True
+    cancelled: bool = False
+    # The number of runs created but not yet started
+    waiting_run_count: int = 0
+
+    @property
+    def name(self) -> str:
+        return self.job_func.__name__
 
 
 class Scheduler:
-    def __init__(self):
+    """Runs periodic jobs as tasks on a single asyncio event loop in a background thread.
+
+    Each job is run at fixed-rate ticks, every `interval_seconds` from the start, rather than
+    an interval after the previous run, so the ticks do not drift. The overlap policy of a job
+    determines what happens at a tick when the previous run of the job has not finished, and
+    at most `max_concurrent_runs` runs of the concurrency limited jobs are in flight at once.
+
+    The intended and actual start time of every tick is passed to `record_job_run`,
+    including the ticks that were skipped, cancelled, or missed because the event loop
+    was blocked for longer than the interval, so that they are not silent gaps in the data.
+    """
+    # The maximum number of concurrent runs of the concurrency limited jobs, or None for no limit
+    max_concurrent_runs = None
+    overlap_policy = OverlapPolicy.SKIP
+
+    def __init__(self, max_concurrent_runs: int = None, overlap_policy: OverlapPolicy = None):
         super().__init__()
+        if max_concurrent_runs is not None:
+            self.max_concurrent_runs = max_concurrent_runs
+        if overlap_policy is not None:
+            self.overlap_policy = overlap_policy
         self.stop_run_continuously = None
+        self._jobs: List[ScheduledJob] = list()
+        self._concurrency_limit: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def every(self, interval_seconds: float, job_func: Callable[[], Awaitable[Any]],
+              overlap_policy: OverlapPolicy = None, concurrency_limited: bool = True) -> None:
+        """Schedule the job, with the scheduler's overlap policy unless one is given."""
+        self._jobs.append(ScheduledJob(interval_seconds, job_func,
+                                       overlap_policy if overlap_policy is not None else self.overlap_policy,
+                                       concurrency_limited))
+
+    def record_job_run(self, job_name: str, run_info: dict) -> None:
+        """Called with the schedule info of every tick of every job, once the run for the tick has ended.
+        The run info contains the `intended_start_time` and `actual_start_time` in seconds since the epoch,
+        the `start_lag` and `run_duration` in seconds, and the `outcome` of the tick, which is one of
+        completed, failed, cancelled, skipped (for the overlap policy) or missed (the event loop was blocked).
+        The actual start time, start lag and run duration are None if the run did not start.
+        """
+        pass
 
-    @staticmethod
-    def run_continuously(interval=1):
-        """Continuously run, while executing pending jobs at each
-        elapsed time interval.
-        @return cease_continuous_run: threading. Event which can
-        be set to cease continuous run. Please note that it is
-        *intended behavior that run_continuously() does not run
-        missed jobs*. For example, if you've registered a job that
-        should run every minute, and you set a continuous run
-        interval of one hour then your job won't be run 60 times
-        at each interval but only once.
+    def _record_tick(self, job: ScheduledJob, intended_start_time: float, outcome: str,
+                     actual_start_time: float = None, end_time: float = None) -> None:
+        run_info = dict(intended_start_time=intended_start_time, actual_start_time=actual_start_time,
+                        start_lag=None, run_duration=None, outcome=outcome)
+        if actual_start_time is not None:
+            run_info['start_lag'] = round(actual_start_time - intended_start_time, 6)
+            if end_time is not None:
+                run_info['run_duration'] = round(end_time - actual_start_time, 6)
+        self.record_job_run(job.name, run_info)
+
+    async def _run_job(self, job: ScheduledJob, intended_start_time: float,
+                       previous_run: Optional[asyncio.Future]) -> None:
+        actual_start_time = None
+        outcome = "failed"
+        concurrency_limit = self._concurrency_limit if job.concurrency_limited else None
+        try:
+            if previous_run is not None:
+                # Queued behind the previous run
+                await asyncio.wait([previous_run])
+            if concurrency_limit is not None:
+                await concurrency_limit.acquire()
+            try:
+                job.waiting_run_count -= 1
+                actual_start_time = time.time()
+                if await job.job_func() is CancelJob:
+                    job.cancelled = True
+                outcome = "completed"
+            finally:
+                if concurrency_limit is not None:
+                    concurrency_limit.release()
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            if actual_start_time is None:
+                job.waiting_run_count -= 1
+            self._record_tick(job, intended_start_time, outcome, actual_start_time,
+                              time.time() if actual_start_time is not None else None)
+
+    async def _run_periodically(self, job: ScheduledJob, cease_continuous_run: asyncio.Event,
+                                running_tasks: set) -> None:
+        loop = asyncio.get_running_loop()
+        # The ticks are scheduled on the monotonic loop clock, and reported as wall clock times.
+        wall_clock_offset = time.time() - loop.time()
+        next_tick = loop.time() + job.interval_seconds
+        previous_run: Optional[asyncio.Task] = None
+        while not job.cancelled:
+            try:
+                await asyncio.wait_for(cease_continuous_run.wait(), timeout=max(next_tick - loop.time(), 0))
+                return
+            except asyncio.TimeoutError:
+                pass
+            tick = next_tick
+            missed_tick_count = int((loop.time() - tick) // job.interval_seconds)
+            for missed_tick in range(missed_tick_count):
+                self._record_tick(job, wall_clock_offset + tick + missed_tick * job.interval_seconds, "missed")
+            tick += missed_tick_count * job.interval_seconds
+            next_tick = tick + job.interval_seconds
+            intended_start_time = wall_clock_offset + tick
+
+            queue_behind = None
+            if previous_run is not None and not previous_run.done():
+                if job.overlap_policy == OverlapPolicy.CANCEL_LATE:
+                    previous_run.cancel()
+                elif job.overlap_policy == OverlapPolicy.QUEUE and job.waiting_run_count == 0:
+                    queue_behind = previous_run
+                else:
+                    self._record_tick(job, intended_start_time, "skipped")
+                    continue
+            job.waiting_run_count += 1
+            previous_run = asyncio.ensure_future(self._run_job(job, intended_start_time, queue_behind))
+            running_tasks.add(previous_run)
+            previous_run.add_done_callback(running_tasks.discard)
+
+    async def _run_jobs(self, cease_continuous_run: asyncio.Event) -> None:
+        running_tasks = set()
+        if self.max_concurrent_runs is not None:
+            self._concurrency_limit = asyncio.Semaphore(self.max_concurrent_runs)
+        try:
+            await asyncio.gather(*[self._run_periodically(job, cease_continuous_run, running_tasks)
+                                   for job in self._jobs])
+            # Let the probes that are still in flight complete.
+            if running_tasks:
+                await asyncio.wait(running_tasks)
+        finally:
+            await http_sessions.close()
+
+    def run_continuously(self) -> asyncio.Event:
+        """Start running the scheduled jobs on a new event loop in a background thread.
+        @return cease_continuous_run: asyncio.Event, belonging to the
+        event loop, which can be set to cease continuous run.
         """
-        cease_continuous_run = threading.Event()
+        async def create_event() -> asyncio.Event:
+            return asyncio.Event()
 
-        class ScheduleThread(threading.Thread):
-            def __init__(self):
-                super().__init__()
+        self._loop = asyncio.new_event_loop()
+        cease_continuous_run = self._loop.run_until_complete(create_event())
 
-            def run(self):
-                while not cease_continuous_run.is_set():
-                    schedule.run_pending()
-                    time.sleep(interval)
+        def run():
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._loop.run_until_complete(self._run_jobs(cease_continuous_run))
+            finally:
+                self._loop.close()
 
-        continuous_thread = ScheduleThread()
-        continuous_thread.start()
+        self._thread = threading.Thread(target=run, name="ProbeLoop")
+        self._thread.start()
         return cease_continuous_run
 
-    @staticmethod
-    def run_threaded(job_func):
-        job_thread = Thread(target=job_func)
-        job_thread.start()
-
     def start_monitoring(self):
         logger.info("Starting background response time monitoring")
         self.stop_run_continuously = self.run_continuously()
 
     def stop_monitoring(self):
         logger.info("Stopping background response time monitoring")
-        self.stop_run_continuously.set()
+        self._loop.call_soon_threadsafe(self.stop_run_continuously.set)
+        self._thread.join()
 
 
 def catch_exceptions(cancel_on_failure=False):
     def catch_exceptions_decorator(job_func):
         @functools.wraps(job_func)
-        def wrapper(*args, **kwargs):
+        async def wrapper(*args, **kwargs):
             # noinspection PyBroadException
             try:
-                return job_func(*args, **kwargs)
-            except:
+                return await job_func(*args, **kwargs)
+            except Exception:
                 import traceback
                 logger.error(traceback.format_exc())
                 if cancel_on_failure:
-                    return schedule.CancelJob
+                    return CancelJob
 
         return wrapper
 
@@ -411,43 +722,73 @@ def catch_exceptions(cancel_on_failure=False):
 
 class ResponseTimeMonitor(Scheduler):
     interval_seconds = 30
-
-    def __init__(self):
-        super().__init__()
+    # Limit the load added by the monitor to the services it is measuring when they stall.
+    max_concurrent_runs = 4
+    live_aggregates_interval_seconds = 5
+    probe_schedule_filename = "probe_schedule.csv"
+    probe_schedule_fieldnames = ['job', 'intended_start_time', 'actual_start_time', 'start_lag', 'run_duration',
+                                 'outcome']
+
+    def __init__(self, interval_seconds: float = None, max_concurrent_runs: int = None,
+                 overlap_policy: OverlapPolicy = None):
+        super().__init__(max_concurrent_runs, overlap_policy)
+        if interval_seconds is not None:
+            self.interval_seconds = interval_seconds
 
     class AbstractResponseTimeReporter(ABC):
-        def __init__(self, output_filename):
+        # The operations measured by the reporter, which determine the columns of its output file
+        operation_names: List[str] = []
+
+        def __init__(self, output_filename, drs_uri: str = None, series_name: str = None):
+            """The DRS URI defaults to the project's public DRS URI.
+            If a `series_name` is given, it is appended to the operation names, so that the
+            response times are reported separately from those of the default series.
+            """
             super().__init__()
             self.output_filename = output_filename
+            self.drs_uri = drs_uri
+            self.series_name = series_name
 
         @abstractmethod
-        def measure_and_report(self):
+        async def measure_and_report(self):
             pass
 
+        def get_series_operation_name(self, operation_name: str) -> str:
+            return operation_name if self.series_name is None else f"{operation_name}_{self.series_name}"
+
+        def report(self, monitoring_infos: dict) -> None:
+            monitoring_infos = {self.get_series_operation_name(operation_name): mon_info
+                                for operation_name, mon_info in monitoring_infos.items()}
+            self.write_monitoring_info_to_csv(monitoring_infos, self.output_filename,
+                                              [self.get_series_operation_name(operation_name)
+                                               for operation_name in self.operation_names])
+            self.record_latencies(monitoring_infos)
+            if live_metrics_writer is not None:
+                live_metrics_writer.write_samples(monitoring_infos)
+
     class DrsFlowResponseTimeReporter(AbstractResponseTimeReporter, TerraMethods, Gen3Methods):
-        def __init__(self, output_filename):
-            super().__init__(output_filename)
+        operation_names = ['indexd_get_metadata', 'bond_get_sa_key', 'bond_get_access_token', 'fence_get_signed_url']
 
-        def measure_response_times(self) -> dict:
+        async def measure_response_times(self) -> dict:
             monitoring_infos = dict()
             try:
-                terra_user_token = self.get_terra_user_pet_sa_token()
+                terra_user_token = await self.get_terra_user_token()
 
                 # Get DRS metadata from Gen3 Indexd
-                drs_metadata, mon_info = self.get_gen3_drs_resolution()
+                drs_metadata, mon_info = await self.get_gen3_drs_resolution(self.drs_uri)
                 monitoring_infos['indexd_get_metadata'] = mon_info
 
                 # Get service account key from Bond
-                sa_key, mon_info = self.get_service_account_key_from_bond(terra_user_token)
+                sa_key, mon_info = await self.get_service_account_key_from_bond(terra_user_token)
                 monitoring_infos['bond_get_sa_key'] = mon_info
 
                 # Get Fence user token from Bond
-                fence_user_token, mon_info = self.get_fence_token_from_bond(terra_user_token)
+                fence_user_token, mon_info = await self.get_fence_token_from_bond(terra_user_token)
                 monitoring_infos['bond_get_access_token'] = mon_info
                 assert fence_user_token is not None, "Failed to get Fence user token."
 
                 # Get signed URL from Fence
-                access_url, mon_info = self.get_gen3_drs_access(fence_user_token)
+                access_url, mon_info = await self.get_gen3_drs_access(fence_user_token, self.drs_uri)
                 monitoring_infos['fence_get_signed_url'] = mon_info
 
             except Exception as ex:
@@ -455,104 +796,181 @@ class ResponseTimeMonitor(Scheduler):
 
             return monitoring_infos
 
-        def measure_and_report(self):
-            monitoring_infos = self.measure_response_times()
-            self.write_monitoring_info_to_csv(monitoring_infos, self.output_filename)
+        async def measure_and_report(self):
+            monitoring_infos = await self.measure_response_times()
+            self.report(monitoring_infos)
 
     class MarthaResponseTimeReporter(AbstractResponseTimeReporter, TerraMethods):
-        def __init__(self, output_filename):
-            super().__init__(output_filename)
+        operation_names = ['martha']
 
-        def measure_response_times(self) -> dict:
+        async def measure_response_times(self) -> dict:
             monitoring_infos = dict()
-            terra_user_token = self.get_terra_user_pet_sa_token()
+            terra_user_token = await self.get_terra_user_token()
 
             # Get Martha response time
 
-            resp_json, mon_info = self.get_martha_drs_response(terra_user_token)
+            resp_json, mon_info = await self.get_martha_drs_response(terra_user_token, self.drs_uri)
             monitoring_infos['martha'] = mon_info
             return monitoring_infos
 
-        def measure_and_report(self):
-            monitoring_infos = self.measure_response_times()
-            self.write_monitoring_info_to_csv(monitoring_infos, self.output_filename)
+        async def measure_and_report(self):
+            monitoring_infos = await self.measure_response_times()
+            self.report(monitoring_infos)
 
     class BondExternalIdentityResponseTimeReporter(AbstractResponseTimeReporter, TerraMethods):
-        def __init__(self, output_filename):
-            super().__init__(output_filename)
+        operation_names = ['bond_get_link_url', 'bond_get_link_status']
 
-        def measure_response_times(self) -> dict:
+        async def measure_response_times(self) -> dict:
             monitoring_infos = dict()
-            terra_user_token = self.get_terra_user_pet_sa_token()
+            terra_user_token = await self.get_terra_user_token()
 
             # Get Bond external identity link URL response time
-            link_url, mon_info = self.get_external_identity_link_url_from_bond()
+            link_url, mon_info = await self.get_external_identity_link_url_from_bond()
             monitoring_infos['bond_get_link_url'] = mon_info
 
             # Get Bond external identity status response time
-            resp_json, mon_info = self.get_external_identity_status_from_bond(terra_user_token)
+            resp_json, mon_info = await self.get_external_identity_status_from_bond(terra_user_token)
             monitoring_infos['bond_get_link_status'] = mon_info
 
             return monitoring_infos
 
-        def measure_and_report(self):
-            monitoring_infos = self.measure_response_times()
-            self.write_monitoring_info_to_csv(monitoring_infos, self.output_filename)
+        async def measure_and_report(self):
+            monitoring_infos = await self.measure_response_times()
+            self.report(monitoring_infos)
 
     class FenceUserInfoResponseTimeReporter(AbstractResponseTimeReporter, TerraMethods, Gen3Methods):
-        def __init__(self, output_filename):
-            super().__init__(output_filename)
+        operation_names = ['fence_user_info']
 
-        def measure_response_times(self) -> dict:
+        async def measure_response_times(self) -> dict:
             monitoring_infos = dict()
-            terra_user_token = self.get_terra_user_pet_sa_token()
-            fence_user_token, _ = self.get_fence_token_from_bond(terra_user_token)
+            fence_user_token = await fence_user_token_cache.get_token_async()
 
             # Get Fence user info response time as a response time indicator for the
             # Gen3 Fence k8s portition for auth services, which is separate
             # from the partition for signed URL requests.
-            resp_json, mon_info = self.get_fence_userinfo(fence_user_token)
+            resp_json, mon_info = await self.get_fence_userinfo(fence_user_token)
             monitoring_infos['fence_user_info'] = mon_info
+            if mon_info['response_code'] == 401:
+                # The cached token was rejected, so get a new one next time.
+                fence_user_token_cache.invalidate()
             return monitoring_infos
 
-        def measure_and_report(self):
-            monitoring_infos = self.measure_response_times()
-            self.write_monitoring_info_to_csv(monitoring_infos, self.output_filename)
+        async def measure_and_report(self):
+            monitoring_infos = await self.measure_response_times()
+            self.report(monitoring_infos)
 
     @catch_exceptions()
-    def check_drs_flow_response_times(self):
+    async def check_drs_flow_response_times(self):
         output_filename = "drs_flow_response_times.csv"
         reporter = self.DrsFlowResponseTimeReporter(output_filename)
-        reporter.measure_and_report()
+        await reporter.measure_and_report()
 
     @catch_exceptions()
-    def check_martha_response_time(self):
+    async def check_martha_response_time(self):
         output_filename = "martha_response_time.csv"
         reporter = self.MarthaResponseTimeReporter(output_filename)
-        reporter.measure_and_report()
+        await reporter.measure_and_report()
+
+    @catch_exceptions()
+    async def check_cold_drs_flow_response_times(self):
+        # Probe a DRS object drawn from the pool, which is unlikely to be in the service caches.
+        output_filename = "drs_flow_cold_response_times.csv"
+        reporter = self.DrsFlowResponseTimeReporter(output_filename, drs_uri_pool.sample(), "cold")
+        await reporter.measure_and_report()
+
+    @catch_exceptions()
+    async def check_cold_martha_response_time(self):
+        output_filename = "martha_cold_response_time.csv"
+        reporter = self.MarthaResponseTimeReporter(output_filename, drs_uri_pool.sample(), "cold")
+        await reporter.measure_and_report()
 
     @catch_exceptions()
-    def check_bond_external_identity_response_times(self):
+    async def check_bond_external_identity_response_times(self):
         output_filename = "bond_external_idenity_response_times.csv"
         reporter = self.BondExternalIdentityResponseTimeReporter(output_filename)
-        reporter.measure_and_report()
+        await reporter.measure_and_report()
 
     @catch_exceptions()
-    def check_fence_user_info_response_time(self):
+    async def check_fence_user_info_response_time(self):
         output_filename = "fence_user_info_response_time.csv"
         reporter = self.FenceUserInfoResponseTimeReporter(output_filename)
-        reporter.measure_and_report()
+        await reporter.measure_and_report()
 
-    def configure_monitoring(self):
-        schedule.every(self.interval_seconds).seconds.do(super().run_threaded, self.check_drs_flow_response_times)
-        schedule.every(self.interval_seconds).seconds.do(super().run_threaded, self.check_martha_response_time)
-        schedule.every(self.interval_seconds).seconds.do(super().run_threaded,
-                                                         self.check_bond_external_identity_response_times)
-        schedule.every(self.interval_seconds).seconds.do(super().run_threaded, self.check_fence_user_info_response_time)
+    @catch_exceptions()
+    async def write_latency_histogram_snapshot(self):
+        # Merging the histograms takes milliseconds per operation, so keep it off the probe event loop.
+        window_percentiles = await asyncio.get_running_loop().run_in_executor(None, latency_histograms.write_snapshot)
+        for operation_name, windows in window_percentiles.items():
+            logger.info(f"Latency {operation_name}: {format_window_percentiles(windows)}")
+
+    def record_token_fetch_response_time(self, token_cache_name: str, monitoring_info: dict) -> None:
+        # Token fetches are infrequent, so they are recorded separately from the probe response times.
+        output_filename = f"{token_cache_name}_fetch_response_times.csv"
+        try:
+            MonitoringUtilityMethods().write_monitoring_info_to_csv(dict(token_fetch=monitoring_info), output_filename,
+                                                                    ['token_fetch'])
+        except Exception:
+            import traceback
+            logger.error(traceback.format_exc())
+
+    @staticmethod
+    def write_live_aggregates() -> None:
+        live_metrics_writer.write_aggregates(latency_histograms.get_window_percentiles())
+
+    @catch_exceptions()
+    async def publish_live_aggregates(self):
+        # Merging the histograms takes milliseconds per operation, so keep it off the probe event loop.
+        await asyncio.get_running_loop().run_in_executor(None, self.write_live_aggregates)
+
+    def record_job_run(self, job_name: str, run_info: dict) -> None:
+        global metrics_writers
+        if run_info['outcome'] not in ("completed", "failed"):
+            logger.warning(f"Probe {job_name} {run_info['outcome']}, intended start: "
+                           f"{MonitoringUtilityMethods.format_timestamp_as_utc(run_info['intended_start_time'])}")
+        try:
+            writer = metrics_writers.get_writer(self.probe_schedule_filename, self.probe_schedule_fieldnames)
+            row = dict(run_info, job=job_name)
+            if not writer.typed_timestamps:
+                for metric in ('intended_start_time', 'actual_start_time'):
+                    if row[metric] is not None:
+                        row[metric] = MonitoringUtilityMethods.format_timestamp_as_utc(row[metric])
+            writer.write_row(row)
+        except Exception:
+            import traceback
+            logger.error(traceback.format_exc())
+
+    def start_monitoring(self):
+        terra_user_token_cache.add_fetch_listener(self.record_token_fetch_response_time)
+        fence_user_token_cache.add_fetch_listener(self.record_token_fetch_response_time)
+        super().start_monitoring()
 
+    def stop_monitoring(self):
+        super().stop_monitoring()
+        terra_user_token_cache.remove_fetch_listener(self.record_token_fetch_response_time)
+        fence_user_token_cache.remove_fetch_listener(self.record_token_fetch_response_time)
+        metrics_writers.close_all()
+        latency_histograms.write_snapshot()
+        latency_histograms.write_summary()
+        if live_metrics_writer is not None:
+            self.write_live_aggregates()
+            live_metrics_writer.close()
 
-def configure_logging(output_directory_path: str) -> logging.Logger:
-    log_filename = Path(os.path.join(output_directory_path, "monitor_response_times.log")).resolve().as_posix()
+    def configure_monitoring(self):
+        self.every(self.interval_seconds, self.check_drs_flow_response_times)
+        self.every(self.interval_seconds, self.check_martha_response_time)
+        self.every(self.interval_seconds, self.check_bond_external_identity_response_times)
+        self.every(self.interval_seconds, self.check_fence_user_info_response_time)
+        if drs_uri_pool is not None:
+            self.every(self.interval_seconds, self.check_cold_drs_flow_response_times)
+            self.every(self.interval_seconds, self.check_cold_martha_response_time)
+        self.every(latency_histograms.snapshot_interval_seconds, self.write_latency_histogram_snapshot,
+                   concurrency_limited=False)
+        if live_metrics_writer is not None:
+            self.every(self.live_aggregates_interval_seconds, self.publish_live_aggregates, concurrency_limited=False)
+
+
+def configure_logging(output_directory_path: str, log_basename: str = "monitor_response_times.log") -> logging.Logger:
+    log_filename = Path(os.path.join(output_directory_path, log_basename)).resolve().as_posix()
     logging.basicConfig(
         format='%(asctime)s %(levelname)-8s %(threadName)-12s %(message)s',
         datefmt='%Y/%m/%d %H:%M:%S',
@@ -574,7 +992,41 @@ def parse_arg_list(arg_list: list = None) -> argparse.Namespace:
     parser.add_argument('--output-dir', type=str, required=False,
                         default=f"./monitoring_output_{utc_timestamp}",
                         help="Directory to contain monitoring output files")
+    parser.add_argument('--probe-interval-seconds', type=float, required=False,
+                        default=ResponseTimeMonitor.interval_seconds,
+                        help="Interval between the starts of successive probes of each reporter")
+    parser.add_argument('--overlap-policy', type=str, required=False, default="skip",
+                        choices=["skip", "queue", "cancel-late"],
+                        help="What to do when a probe is due while the previous probe of the reporter is still "
+                             "in flight: skip it, queue it to start when the previous probe finishes, or "
+                             "cancel the previous probe. Skipped and cancelled probes are recorded in "
+                             f"{ResponseTimeMonitor.probe_schedule_filename}.")
+    parser.add_argument('--max-concurrent-probes', type=int, required=False,
+                        default=ResponseTimeMonitor.max_concurrent_runs,
+                        help="Maximum number of probes in flight at once")
+    parser.add_argument('--connection-mode', type=str, required=False, default="WARM",
+                        help="WARM to reuse pooled keep-alive connections (server latency), "
+                             "COLD to open a new connection per request (includes handshake latency)")
+    parser.add_argument('--mock-server-url', type=str, required=False, default=None,
+                        help="Send all requests to this mock server, e.g. one run by mock_terra_services, "
+                             "using a static Terra user token")
+    parser.add_argument('--output-format', type=str, required=False, default="csv", choices=OUTPUT_FORMATS,
+                        help="Format of the response time files: csv, or parquet for typed columnar files")
+    parser.add_argument('--live-metrics', action='store_true', default=False,
+                        help="Publish the latest samples and rolling latency percentiles to a memory-mapped file "
+                             "in the output directory, for live graphs, e.g. using live_metrics.LiveMetricsReader")
+    parser.add_argument('--drs-uri-manifest', type=str, required=False, action='append', default=None,
+                        help="Manifest file, or directory of manifest files, of the DRS URIs to probe in addition "
+                             "to the public DRS URI, reported separately as the 'cold' series. "
+                             "May be given more than once.")
+    parser.add_argument('--drs-uri-sampling', type=str, required=False, default="without-replacement",
+                        choices=["without-replacement", "with-replacement"],
+                        help="How the DRS URIs to probe are drawn from the manifest DRS URIs")
+    parser.add_argument('--drs-uri-seed', type=int, required=False, default=None,
+                        help="Random seed for drawing the DRS URIs to probe")
     args = parser.parse_args(arg_list)
+    if args.max_concurrent_probes < 1:
+        parser.error("--max-concurrent-probes must be at least 1")
     return args
 
 
@@ -582,25 +1034,75 @@ def create_output_directory(directory_path: str) -> None:
     Path(directory_path).mkdir(parents=True, exist_ok=True)
 
 
+def set_request_configuration(output_directory: str, sessions: HttpSessions, request_logger: logging.Logger,
+                              output_format: str = None) -> None:
+    """Set the output directory, HTTP sessions and logger used by the request and reporting methods,
+    for use by tools other than the response time monitor that also use them.
+    """
+    global output_dir, logger, http_sessions, metrics_writers, latency_histograms
+    create_output_directory(output_directory)
+    output_dir = output_directory
+    http_sessions = sessions
+    metrics_writers = MetricsWriters(output_directory, output_format=output_format)
+    latency_histograms = LatencyHistograms(output_directory)
+    logger = request_logger
+
+
+def use_mock_server(mock_server_url: str) -> None:
+    from terra_workflow_scale_test_tools.mock_terra_services import MOCK_TERRA_USER_TOKEN
+    DeploymentInfo.set_server_override(mock_server_url)
+    terra_user_token_cache.set_static_token(MOCK_TERRA_USER_TOKEN)
+
+
+def enable_live_metrics(output_directory: str) -> None:
+    global live_metrics_writer
+    live_metrics_writer = LiveMetricsWriter(output_directory)
+
+
+def load_drs_uri_pool(manifest_paths: List[str], with_replacement: bool = False, seed: int = None) -> None:
+    global drs_uri_pool
+    drs_uri_pool = DrsUriPool.from_manifests(manifest_paths, with_replacement, seed)
+
+
 def set_configuration(args: argparse.Namespace) -> None:
-    global output_dir, logger
     DeploymentInfo.set_project(args.project_name)
     DeploymentInfo.set_terra_deployment_tier(args.terra_deployment_tier)
+    if args.mock_server_url is not None:
+        use_mock_server(args.mock_server_url)
 
     # Call these now to raise any errors now rather than later while running.
     DeploymentInfo.terra_factory()
     DeploymentInfo.gen3_factory()
 
     create_output_directory(args.output_dir)
-    output_dir = args.output_dir
-    logger = configure_logging(args.output_dir)
+    set_request_configuration(args.output_dir, HttpSessions(ConnectionMode.from_name(args.connection_mode)),
+                              configure_logging(args.output_dir), args.output_format)
 
     logger.info("Monitoring Configuration:")
     logger.info(f"Project: {args.project_name}")
     logger.info(f"Terra Deployment Tier: {args.terra_deployment_tier}")
+    logger.info(f"Connection Mode: {http_sessions.connection_mode.name}")
+    logger.info(f"Probe Interval: {args.probe_interval_seconds} seconds")
+    logger.info(f"Overlap Policy: {args.overlap_policy}")
+    logger.info(f"Max Concurrent Probes: {args.max_concurrent_probes}")
+    logger.info(f"Output Format: {metrics_writers.output_format}")
+    if args.drs_uri_manifest is not None:
+        load_drs_uri_pool(args.drs_uri_manifest, args.drs_uri_sampling == "with-replacement", args.drs_uri_seed)
+        logger.info(f"DRS URI Pool: {len(drs_uri_pool)} DRS URIs from {args.drs_uri_manifest}, "
+                    f"sampled {args.drs_uri_sampling} ({drs_uri_pool.size_in_bytes} bytes)")
+    if args.live_metrics:
+        enable_live_metrics(args.output_dir)
+        logger.info(f"Live Metrics: {live_metrics_writer.filepath}")
+    if args.mock_server_url is not None:
+        logger.info(f"Mock Server: {args.mock_server_url}")
 
 
 responseTimeMonitor: ResponseTimeMonitor = None
+http_sessions: HttpSessions = None
+metrics_writers: MetricsWriters = None
+latency_histograms: LatencyHistograms = None
+drs_uri_pool: DrsUriPool = None
+live_metrics_writer: LiveMetricsWriter = None
 
 
 def main(arg_list: list = None) -> None:
@@ -609,7 +1111,8 @@ def main(arg_list: list = None) -> None:
 
     # Configure and start monitoring
     global responseTimeMonitor
-    responseTimeMonitor = ResponseTimeMonitor()
+    responseTimeMonitor = ResponseTimeMonitor(args.probe_interval_seconds, args.max_concurrent_probes,
+                                              OverlapPolicy.from_name(args.overlap_policy))
     responseTimeMonitor.configure_monitoring()
     responseTimeMonitor.start_monitoring()
 
@@ -619,11 +1122,21 @@ def main(arg_list: list = None) -> None:
 
 def start_monitoring_in_current_process(terra_deployment_tier: str,
                                         project_to_monitor: str,
-                                        monitoring_output_directory: str) -> None:
+                                        monitoring_output_directory: str,
+                                        connection_mode: str = "WARM",
+                                        mock_server_url: str = None,
+                                        output_format: str = "csv",
+                                        drs_uri_manifest: str = None) -> None:
 
     arg_list = ["--terra-deployment-tier", terra_deployment_tier,
                 "--project", project_to_monitor,
-                "--output-dir", monitoring_output_directory]
+                "--output-dir", monitoring_output_directory,
+                "--connection-mode", connection_mode,
+                "--output-format", output_format]
+    if mock_server_url is not None:
+        arg_list += ["--mock-server-url", mock_server_url]
+    if drs_uri_manifest is not None:
+        arg_list += ["--drs-uri-manifest", drs_uri_manifest]
     main(arg_list)
 
 
@@ -639,14 +1152,29 @@ def stop_monitoring_in_current_process() -> None:
 
 def start_monitoring_background_process(terra_deployment_tier: str,
                                         project_to_monitor: str,
-                                        monitoring_output_directory: str)\
+                                        monitoring_output_directory: str,
+                                        connection_mode: str = "WARM",
+                                        mock_server_url: str = None,
+                                        output_format: str = "csv",
+                                        drs_uri_manifest: str = None,
+                                        live_metrics: bool = False)\
         -> psutil.Process:
+    """Start monitoring in a new process, so that the probes do not compete with the caller for the GIL.
+    If `live_metrics` is True, the monitor publishes its latest samples and rolling latency percentiles
+    for the caller to read using `live_metrics.LiveMetricsReader(monitoring_output_directory)`.
+    """
     print("Starting monitoring background process ...")
+    mock_server_args = ["--mock-server-url", mock_server_url] if mock_server_url is not None else []
+    drs_uri_manifest_args = ["--drs-uri-manifest", drs_uri_manifest] if drs_uri_manifest is not None else []
+    live_metrics_args = ["--live-metrics"] if live_metrics else []
     process = psutil.Popen(["python3",
                             __file__,
                             "--terra-deployment-tier", terra_deployment_tier,
                             "--project", project_to_monitor,
-                            "--output-dir", monitoring_output_directory])
+                            "--output-dir", monitoring_output_directory,
+                            "--connection-mode", connection_mode,
+                            "--output-format", output_format] + mock_server_args + drs_uri_manifest_args +
+                           live_metrics_args)
     print(f"Started {process}")
     return process
 
@@ -661,8 +1189,22 @@ def stop_monitoring_background_process(process: psutil.Process) -> None:
 
 
 if __name__ == "__main__":
+    # Flush the buffered monitoring data when terminated by stop_monitoring_background_process.
+    # The handler is installed first, so that a SIGTERM received while starting is not lost.
+    stop_requested = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_requested.set())
+
     main()
 
+    # Keep the main thread alive until stopped: once it returns, the interpreter starts shutting down,
+    # after which work can no longer be submitted to executors or registered to run at exit,
+    # although the probe event loop thread keeps running.
+    try:
+        stop_requested.wait()
+    except KeyboardInterrupt:
+        pass
+    stop_monitoring_in_current_process()
+
     # # Run for a while
     # sleep_seconds = 90
     # print(f"Sleeping for {sleep_seconds} ...")
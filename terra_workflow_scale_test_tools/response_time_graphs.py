@@ -0,0 +1,467 @@
+"""Response Time Graphs
+This module displays the response time data collected by `monitor_response_times.py`,
+for use in Jupyter Notebooks, e.g. `graph_response_time_data.ipynb`.
+
+The samples of a short run are drawn as they are, with a marker for each response.
+When there are more samples than can be distinguished at the width of the graph,
+they are aggregated first into a bucket per few pixels of width: the minimum to maximum
+and a percentile range of each bucket are drawn as bands, the response times as a line
+through the samples selected by Largest-Triangle-Three-Buckets (LTTB) downsampling, and
+the errors as a marker per bucket and status code, sized by the number of errors.
+So the time taken to render a graph does not grow with the number of samples.
+"""
+
+import math
+import os
+from typing import Any, Tuple
+
+import matplotlib.colors as mcolors
+import matplotlib.dates as mdates
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from terra_workflow_scale_test_tools.latency_load_analysis import LatencyLoadAnalysis, PERCENTILES
+from terra_workflow_scale_test_tools.metrics_writer import get_current_parquet_filename
+
+# For colors available, see: https://matplotlib.org/stable/gallery/color/named_colors.html
+ERROR_MARKER_COLORS = {401: "k", 500: "r", 502: mcolors.TABLEAU_COLORS['tab:orange']}
+OTHER_ERROR_MARKER_COLOR = mcolors.TABLEAU_COLORS['tab:purple']
+
+
+def lttb_downsample(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Return the indexes of `threshold` points of the series selected by the Largest-Triangle-Three-Buckets
+    algorithm, which keeps the visual shape of the series, including its spikes, or all the indexes
+    if there are not more points than that.
+    """
+    point_count = len(x)
+    if threshold >= point_count or threshold < 3:
+        return np.arange(point_count)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    indexes = np.empty(threshold, dtype=np.int64)
+    indexes[0], indexes[-1] = 0, point_count - 1
+    # The first and last points are always selected, and the others from a bucket each.
+    bucket_edges = np.linspace(1, point_count - 1, threshold - 1).astype(np.int64)
+    selected = 0
+    for bucket in range(threshold - 2):
+        start, end = bucket_edges[bucket], bucket_edges[bucket + 1]
+        next_start = end
+        next_end = bucket_edges[bucket + 2] if bucket + 2 < len(bucket_edges) else point_count
+        next_x, next_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        # Select the point forming the largest triangle with the previously selected point
+        # and the average of the next bucket.
+        areas = np.abs((x[selected] - next_x) * (y[start:end] - y[selected]) -
+                       (x[selected] - x[start:end]) * (next_y - y[selected]))
+        selected = start + int(np.argmax(areas))
+        indexes[bucket + 1] = selected
+    return indexes
+
+
+class ResponseTimeDisplayMethods:
+    # Above this number of samples, the samples are aggregated before they are drawn.
+    max_raw_samples = 2000
+    # The width of each aggregation bucket in pixels
+    bucket_width_pixels = 2
+    # The percentile range drawn as a band, as well as the minimum to maximum
+    band_quantiles = (0.05, 0.95)
+    # The maximum number of hour and minute labels on the time axis
+    max_hour_labels = 24
+    max_minute_labels = 24
+
+    def __init__(self, input_filename: str,
+                 graph_title: str,
+                 timestamp_columnname: str,
+                 response_duration_columnname: str,
+                 response_code_columnname: str,
+                 response_reason_columnname: str,
+                 is_subplot: bool = False,
+                 figure_width: float = 10,
+                 figure_height: float = 6.18):
+        self.input_filename = input_filename
+        self.graph_title = graph_title
+        self.timestamp_columnname = timestamp_columnname
+        self.response_duration_columnname = response_duration_columnname
+        self.response_code_columnname = response_code_columnname
+        self.response_reason_columnname = response_reason_columnname
+        self.is_subplot = is_subplot
+        self.figure_width = figure_width
+        self.figure_height = figure_height
+        plt.style.use("fast")
+
+    def get_columnnames(self) -> list:
+        return [self.timestamp_columnname,
+                self.response_duration_columnname,
+                self.response_code_columnname,
+                self.response_reason_columnname]
+
+    def load_file_to_df(self, sep: str = ',') -> pd.DataFrame:
+        # Prefer the typed columnar file written by the monitor's "parquet" output format, if present
+        # and not left over from an earlier run. Only the columns to be graphed are read.
+        parquet_filename = get_current_parquet_filename(self.input_filename)
+        if parquet_filename is not None:
+            df = pd.read_parquet(parquet_filename, columns=self.get_columnnames())
+            # The timestamps are stored in UTC, as in the CSV files.
+            df[self.timestamp_columnname] = df[self.timestamp_columnname].dt.tz_localize(None)
+            return df
+        return pd.read_csv(self.input_filename, sep=sep, usecols=self.get_columnnames())
+
+    def clean_up_data(self, df: pd.DataFrame) -> pd.DataFrame:
+        # Extract the columns of interest from any others that may be present
+        df = df[self.get_columnnames()]
+
+        # Remove any rows that are completely empty
+        df = df.dropna(how='all')
+
+        # Sort by the timestamp column
+        df = df.sort_values(by=[self.timestamp_columnname])
+
+        return df
+
+    def update_timestamp_colum(self, df: pd.DataFrame) -> pd.DataFrame:
+        if not pd.api.types.is_datetime64_any_dtype(df[self.timestamp_columnname]):
+            df[self.timestamp_columnname] = pd.to_datetime(df[self.timestamp_columnname])
+
+        # Set the timestamp column as the first column
+        cols = list(df)
+        cols.insert(0, cols.pop(cols.index(self.timestamp_columnname)))
+        df = df.loc[:, cols]
+
+        df.set_index(self.timestamp_columnname, drop=False)
+        return df
+
+    def format_x_axis_time(self, time_span: pd.Timedelta = None) -> None:
+        ax = plt.gca() # Get current axes
+        # Over a long run, label fewer of the hours and minutes, so that the labels stay readable.
+        span_minutes = time_span / pd.Timedelta(minutes=1) if time_span is not None else 0
+        hour_interval = max(1, math.ceil(span_minutes / 60 / self.max_hour_labels))
+        ax.xaxis.set_major_locator(mdates.HourLocator(interval=hour_interval))
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y/%m/%d %H:%M'))
+        minute_interval = next((minutes for minutes in (5, 10, 15, 30)
+                                if span_minutes / minutes <= self.max_minute_labels), None)
+        if minute_interval is not None:
+            ax.xaxis.set_minor_locator(mdates.MinuteLocator(byminute=range(minute_interval, 60, minute_interval)))
+            ax.xaxis.set_minor_formatter(mdates.DateFormatter("%H:%M"))
+        for label in ax.get_xticklabels(which='major'):
+            label.set(rotation=90, horizontalalignment='right')
+        for label in ax.get_xticklabels(which='minor'):
+            label.set(rotation=90, horizontalalignment='right')
+
+    def add_legend(self) -> None:
+        ax = plt.gca() # Get current axes
+        ax.legend(loc='upper left', frameon=True, edgecolor="b")
+
+    def draw_axes_labels(self, df: pd.DataFrame) -> None:
+        plt.xlabel("Time (UTC)")
+        timestamps = df[self.timestamp_columnname]
+        self.format_x_axis_time(timestamps.iloc[-1] - timestamps.iloc[0] if df.shape[0] else None)
+        plt.ylabel("Response Time (seconds)")
+        plt.title(self.graph_title)
+
+    def draw_line_graph(self, df: pd.DataFrame) -> None:
+        self.draw_axes_labels(df)
+        plt.plot(df[self.timestamp_columnname], df[self.response_duration_columnname], linestyle="-", color="b")
+
+    def add_markers(self, df: pd.DataFrame,
+                    value_columnname: str, match_value: Any,
+                    marker: str, marker_color: str,
+                    label: str) -> None:
+        df_matches = df[df[value_columnname] == match_value]
+        if df_matches.shape[0] == 0: # No matching rows
+            return
+        x_axis_match_timestamps = df_matches[self.timestamp_columnname]
+        y_axis_match_response_duration = df_matches[self.response_duration_columnname]
+
+        plt.scatter(x_axis_match_timestamps, y_axis_match_response_duration,
+                    marker=marker, c=marker_color, label=label)
+
+    def draw_success_markers(self, df: pd.DataFrame) -> None:
+        self.add_markers(df, self.response_reason_columnname, "OK",
+                         marker='o', marker_color='g', label="Success (2xx)")
+
+    def draw_error_markers(self, df):
+        for status_code, color in ERROR_MARKER_COLORS.items():
+            self.add_markers(df, self.response_code_columnname, status_code,
+                             marker='v', marker_color=color, label=f"Error ({status_code})")
+
+    def draw_line_graph_with_error_markers(self, df: pd.DataFrame) -> None:
+        self.draw_line_graph(df)
+        self.draw_success_markers(df)
+        self.draw_error_markers(df)
+        self.add_legend()
+
+    def get_bucket_count(self) -> int:
+        """Return the number of aggregation buckets across the width of the current axes."""
+        width_pixels = plt.gca().get_window_extent().width
+        return max(3, int(width_pixels / self.bucket_width_pixels))
+
+    def get_buckets(self, df: pd.DataFrame, bucket_count: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the bucket number of each sample, and the timestamp at the middle of each bucket,
+        for `bucket_count` buckets of equal duration from the first sample to the last.
+        """
+        timestamps = df[self.timestamp_columnname].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        first_timestamp = timestamps[0]
+        bucket_nanoseconds = max(1, math.ceil((timestamps[-1] - first_timestamp + 1) / bucket_count))
+        buckets = (timestamps - first_timestamp) // bucket_nanoseconds
+        bucket_timestamps = (first_timestamp + np.arange(bucket_count) * bucket_nanoseconds +
+                             bucket_nanoseconds // 2).astype('datetime64[ns]')
+        return buckets, bucket_timestamps
+
+    def draw_aggregated_line_graph(self, df: pd.DataFrame, bucket_count: int) -> None:
+        self.draw_axes_labels(df)
+        df = df[df[self.response_duration_columnname].notna()]
+        if df.shape[0] == 0:
+            return
+        buckets, bucket_timestamps = self.get_buckets(df, bucket_count)
+        response_durations = df[self.response_duration_columnname].to_numpy(dtype=np.float64)
+
+        grouped = pd.Series(response_durations).groupby(buckets)
+        low_quantile, high_quantile = self.band_quantiles
+        bands = pd.DataFrame(dict(min=grouped.min(), max=grouped.max(),
+                                  low=grouped.quantile(low_quantile), high=grouped.quantile(high_quantile)))
+        band_timestamps = bucket_timestamps[bands.index.to_numpy()]
+        plt.fill_between(band_timestamps, bands['min'], bands['max'], step="mid",
+                         color="b", alpha=0.15, linewidth=0, label="Min to max")
+        plt.fill_between(band_timestamps, bands['low'], bands['high'], step="mid",
+                         color="b", alpha=0.35, linewidth=0,
+                         label=f"{low_quantile * 100:g}th to {high_quantile * 100:g}th percentile")
+
+        timestamps = df[self.timestamp_columnname].to_numpy(dtype='datetime64[ns]')
+        indexes = lttb_downsample(timestamps.view(np.int64), response_durations, bucket_count)
+        plt.plot(timestamps[indexes], response_durations[indexes], linestyle="-", linewidth=0.6, color="b",
+                 label="Response time (downsampled)")
+
+    def draw_error_counts(self, df: pd.DataFrame, bucket_count: int) -> None:
+        """Draw a marker for each status code in each bucket with errors, at the largest response time
+        of the errors, and sized by the number of errors.
+        """
+        buckets, bucket_timestamps = self.get_buckets(df, bucket_count)
+        response_codes = pd.to_numeric(df[self.response_code_columnname], errors='coerce').to_numpy()
+        is_error = ~np.isnan(response_codes) & ((response_codes < 200) | (response_codes >= 300))
+        if not is_error.any():
+            return
+        errors = pd.DataFrame(dict(bucket=buckets[is_error],
+                                   response_code=response_codes[is_error].astype(np.int64),
+                                   response_duration=df[self.response_duration_columnname].to_numpy()[is_error]))
+        error_counts = errors.groupby(['response_code', 'bucket'])['response_duration'].agg(['size', 'max'])
+        other_error_counts = error_counts[~error_counts.index.get_level_values('response_code')
+                                          .isin(list(ERROR_MARKER_COLORS))]
+        for status_code, color in ERROR_MARKER_COLORS.items():
+            if status_code in error_counts.index.get_level_values('response_code'):
+                self.draw_error_count_markers(error_counts.loc[status_code], bucket_timestamps, color,
+                                              f"Error ({status_code})")
+        if len(other_error_counts):
+            self.draw_error_count_markers(other_error_counts.droplevel('response_code'), bucket_timestamps,
+                                          OTHER_ERROR_MARKER_COLOR, "Error (other)")
+
+    @staticmethod
+    def draw_error_count_markers(bucket_error_counts: pd.DataFrame, bucket_timestamps: np.ndarray,
+                                 marker_color: str, label: str) -> None:
+        bucket_error_counts = bucket_error_counts.groupby(level='bucket').agg({'size': 'sum', 'max': 'max'})
+        plt.scatter(bucket_timestamps[bucket_error_counts.index.to_numpy()], bucket_error_counts['max'].fillna(0),
+                    s=20 * (1 + np.log2(bucket_error_counts['size'])), marker='v', c=marker_color,
+                    label=f"{label}, sized by count")
+
+    def draw_aggregated_graph_with_error_counts(self, df: pd.DataFrame) -> None:
+        bucket_count = self.get_bucket_count()
+        self.draw_aggregated_line_graph(df, bucket_count)
+        self.draw_error_counts(df, bucket_count)
+        self.add_legend()
+
+    def display_statistics(self, df: pd.DataFrame) -> None:
+        print(f"Maximum value:\t{round(df[self.response_duration_columnname].max(), 1)} seconds")
+        print(f"Mean value:\t{round(df[self.response_duration_columnname].mean(), 1)} seconds")
+        print(f"95th quantile:\t{round(df[self.response_duration_columnname].quantile(0.95), 1)} seconds")
+
+    def display_response_times(self) -> None:
+        print(self.graph_title)
+        df = self.load_file_to_df()
+        df = self.clean_up_data(df)
+        df = self.update_timestamp_colum(df)
+        self.display_statistics(df)
+        if not self.is_subplot:
+            plt.figure(1, figsize=(self.figure_width, self.figure_height))
+        if df.shape[0] > self.max_raw_samples:
+            self.draw_aggregated_graph_with_error_counts(df)
+        else:
+            self.draw_line_graph_with_error_markers(df)
+
+
+def get_graph_columnname_kwargs(basename: str, series_name: str = None):
+    # The response times of a series other than the default, e.g. "cold", have the series name appended.
+    if series_name is not None:
+        basename = f"{basename}_{series_name}"
+    return dict(timestamp_columnname=f"{basename}.start_time",
+                response_duration_columnname=f"{basename}.response_duration",
+                response_code_columnname=f"{basename}.response_code",
+                response_reason_columnname=f"{basename}.response_reason")
+
+
+def get_series_graph_title(graph_title: str, series_name: str = None) -> str:
+    return graph_title if series_name is None else f"{graph_title} ({series_name.capitalize()} DRS Objects)"
+
+
+def display_martha_response_times(input_filename: str, is_subplot: bool = False,
+                                  series_name: str = None) -> None:
+    graph_title = get_series_graph_title("Martha Response Time", series_name)
+    displayer = ResponseTimeDisplayMethods(input_filename, graph_title,
+                                           **get_graph_columnname_kwargs("martha", series_name),
+                                           is_subplot=is_subplot)
+    displayer.display_response_times()
+
+
+def display_fence_user_info_response_times(input_filename: str, is_subplot: bool = False) -> None:
+    graph_title = "Fence User Info Response Time"
+    displayer = ResponseTimeDisplayMethods(input_filename, graph_title,
+                                           **get_graph_columnname_kwargs("fence_user_info"),
+                                           is_subplot=is_subplot)
+    displayer.display_response_times()
+
+
+def display_bond_get_link_url_response_times(input_filename: str, is_subplot: bool = False) -> None:
+    graph_title = "Bond Get Link URL Response Time"
+    displayer = ResponseTimeDisplayMethods(input_filename, graph_title,
+                                           **get_graph_columnname_kwargs("bond_get_link_url"),
+                                           is_subplot=is_subplot)
+    displayer.display_response_times()
+
+
+def display_bond_get_link_status_response_times(input_filename: str, is_subplot: bool = False) -> None:
+    graph_title = "Bond Get Link Status Response Time"
+    displayer = ResponseTimeDisplayMethods(input_filename, graph_title,
+                                           **get_graph_columnname_kwargs("bond_get_link_status"),
+                                           is_subplot=is_subplot)
+    displayer.display_response_times()
+
+
+def display_indexd_get_metadata_response_times(input_filename: str, is_subplot: bool = False,
+                                               series_name: str = None) -> None:
+    graph_title = get_series_graph_title("Gen3 IndexD Get DRS Metadata Response Time", series_name)
+    displayer = ResponseTimeDisplayMethods(input_filename, graph_title,
+                                           **get_graph_columnname_kwargs("indexd_get_metadata", series_name),
+                                           is_subplot=is_subplot)
+    displayer.display_response_times()
+
+
+def display_bond_get_access_token_response_times(input_filename: str, is_subplot: bool = False,
+                                                 series_name: str = None) -> None:
+    graph_title = get_series_graph_title("Bond Get Access Token Response Time", series_name)
+    displayer = ResponseTimeDisplayMethods(input_filename, graph_title,
+                                           **get_graph_columnname_kwargs("bond_get_access_token", series_name),
+                                           is_subplot=is_subplot)
+    displayer.display_response_times()
+
+
+def display_bond_get_sa_key_response_times(input_filename: str, is_subplot: bool = False,
+                                           series_name: str = None) -> None:
+    graph_title = get_series_graph_title("Bond Get Service Account Key Response Time", series_name)
+    displayer = ResponseTimeDisplayMethods(input_filename, graph_title,
+                                           **get_graph_columnname_kwargs("bond_get_sa_key", series_name),
+                                           is_subplot=is_subplot)
+    displayer.display_response_times()
+
+
+def display_fence_get_signed_url_response_times(input_filename: str, is_subplot: bool = False,
+                                                series_name: str = None) -> None:
+    graph_title = get_series_graph_title("Gen3 Fence Get Signed URL Response Time", series_name)
+    displayer = ResponseTimeDisplayMethods(input_filename, graph_title,
+                                           **get_graph_columnname_kwargs("fence_get_signed_url", series_name),
+                                           is_subplot=is_subplot)
+    displayer.display_response_times()
+
+
+def display_drs_flow_component_response_times(input_filename: str, series_name: str = None) -> None:
+    plt.figure(figsize=(15, 15))
+    is_subplot = True
+
+    plt.subplot(2, 2, 1)
+    display_indexd_get_metadata_response_times(input_filename, is_subplot, series_name)
+
+    plt.subplot(2, 2, 2)
+    display_bond_get_access_token_response_times(input_filename, is_subplot, series_name)
+
+    plt.subplot(2, 2, 3)
+    display_fence_get_signed_url_response_times(input_filename, is_subplot, series_name)
+
+    plt.subplot(2, 2, 4)
+    display_bond_get_sa_key_response_times(input_filename, is_subplot, series_name)
+
+    plt.show()
+
+
+def display_bond_link_info_response_times(input_filename: str) -> None:
+    plt.figure(figsize=(15, 7))
+    is_subplot = True
+
+    plt.subplot(1, 2, 1)
+    display_bond_get_link_url_response_times(input_filename, is_subplot)
+
+    plt.subplot(1, 2, 2)
+    display_bond_get_link_status_response_times(input_filename, is_subplot)
+
+    plt.show()
+
+
+def display_submission_progress(input_filename: str) -> None:
+    """Display the workflow counts by status recorded while waiting for the submission to complete."""
+    if not os.path.exists(input_filename):
+        print(f"No submission progress data found: {input_filename}")
+        return
+    df = pd.read_csv(input_filename)
+    df["timestamp"] = pd.to_datetime(df["timestamp"], format="%Y/%m/%d %H:%M:%S")
+    status_columnnames = [columnname for columnname in df.columns[2:] if df[columnname].any()]
+
+    plt.figure(figsize=(10, 6.18))
+    for columnname in status_columnnames:
+        plt.plot(df["timestamp"], df[columnname], label=columnname)
+    plt.title("Submission Progress")
+    plt.xlabel("Time (UTC)")
+    plt.ylabel("Workflows")
+    ax = plt.gca()
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y/%m/%d %H:%M'))
+    for label in ax.get_xticklabels(which='major'):
+        label.set(rotation=90, horizontalalignment='right')
+    ax.legend(loc='upper left', frameon=True, edgecolor="b")
+    plt.show()
+
+
+def display_latency_summary(input_filename: str) -> None:
+    """Display the response time percentiles over the whole run, from the monitor's latency histograms."""
+    from IPython.display import display
+    if not os.path.exists(input_filename):
+        print(f"No latency summary found: {input_filename}")
+        return
+    df = pd.read_json(input_filename, orient="index")
+    df.index.name = "operation"
+    print("Response time percentiles (seconds)")
+    display(df.round(3))
+
+
+def display_latency_vs_load(analysis: LatencyLoadAnalysis, ncols: int = 2) -> None:
+    """Display the response time percentiles and the error rate of each endpoint versus the DRS data access rate,
+    with a line at the estimated knee.
+    """
+    endpoints = analysis.knees['endpoint'].tolist()
+    nrows = math.ceil(len(endpoints) / ncols)
+    plt.figure(figsize=(15, 6 * nrows))
+    for index, knee in enumerate(analysis.knees.itertuples()):
+        ax = plt.subplot(nrows, ncols, index + 1)
+        curve = analysis.curves[analysis.curves['endpoint'] == knee.endpoint]
+        for percentile in PERCENTILES:
+            ax.plot(curve['mean_load'], curve[f"p{percentile}"], marker='.', label=f"p{percentile}")
+        if not np.isnan(knee.knee_load):
+            ax.axvline(knee.knee_load, color="k", linestyle="--", linewidth=1,
+                       label=f"Knee ({knee.knee_load:.1f}/s)")
+        ax.set_title(f"{knee.endpoint} Response Time vs. Load")
+        ax.set_xlabel("DRS Data Access Rate (accesses/second)")
+        ax.set_ylabel("Response Time (seconds)")
+        ax.set_ylim(bottom=0)
+        ax.legend(loc='upper left', frameon=True, edgecolor="b")
+
+        error_rate_ax = ax.twinx()
+        band_widths = (curve['load_high'] - curve['load_low']) * 0.8
+        error_rate_ax.bar(curve['mean_load'], curve['error_rate'] * 100, width=band_widths, color="r", alpha=0.2)
+        error_rate_ax.set_ylabel("Error Rate (%)", color="r")
+        error_rate_ax.set_ylim(0, 100)
+    plt.tight_layout()
+    plt.show()
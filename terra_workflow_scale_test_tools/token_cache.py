@@ -0,0 +1,202 @@
+"""Access Token Cache
+This module provides a thread-safe cache for access tokens that refreshes each token
+shortly before it expires, rather than fetching a new token for every request.
+It is shared by the response time monitoring and the workflow status polling.
+"""
+
+import asyncio
+import threading
+import time
+
+from dataclasses import dataclass
+from datetime import timezone
+from typing import Awaitable, Callable, List, Optional
+
+
+@dataclass
+class FetchedToken:
+    token: str
+    # Expiry time in seconds since the epoch, if known
+    expires_at: Optional[float] = None
+    # Monitoring info for the request that fetched the token, if any
+    monitoring_info: Optional[dict] = None
+
+
+class TokenCache:
+    """ Thread-safe, expiry-aware access token cache
+
+    The token is refreshed when it is within `refresh_margin_seconds` of expiring.
+    When the fetch does not report an expiry time, `default_ttl_seconds` is used.
+    Listeners added with `add_fetch_listener` are called with the cache name and the
+    monitoring info of every fetch, so that the token fetch latency can be recorded
+    separately from the response times of the requests that use the token.
+    """
+    default_ttl_seconds = 600
+    refresh_margin_seconds = 300
+
+    def __init__(self, name: str,
+                 fetch_token: Callable[[], FetchedToken] = None,
+                 fetch_token_async: Callable[[], Awaitable[FetchedToken]] = None,
+                 default_ttl_seconds: float = None,
+                 refresh_margin_seconds: float = None):
+        assert fetch_token is not None or fetch_token_async is not None, "A token fetch function is required."
+        self.name = name
+        self.fetch_token = fetch_token
+        self.fetch_token_async = fetch_token_async
+        if default_ttl_seconds is not None:
+            self.default_ttl_seconds = default_ttl_seconds
+        if refresh_margin_seconds is not None:
+            self.refresh_margin_seconds = refresh_margin_seconds
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._async_lock: Optional[asyncio.Lock] = None
+        self._async_lock_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._token: Optional[str] = None
+        self._refresh_at: float = 0.0
+        self._fetch_listeners: List[Callable[[str, dict], None]] = list()
+
+    def add_fetch_listener(self, listener: Callable[[str, dict], None]) -> None:
+        with self._lock:
+            self._fetch_listeners.append(listener)
+
+    def remove_fetch_listener(self, listener: Callable[[str, dict], None]) -> None:
+        with self._lock:
+            if listener in self._fetch_listeners:
+                self._fetch_listeners.remove(listener)
+
+    def set_static_token(self, token: str) -> None:
+        """Use the given token rather than fetching one, for example with a mock server."""
+        def fetch_static_token() -> FetchedToken:
+            return FetchedToken(token)
+
+        async def fetch_static_token_async() -> FetchedToken:
+            return FetchedToken(token)
+
+        self.fetch_token = fetch_static_token
+        self.fetch_token_async = fetch_static_token_async
+        self.invalidate()
+
+    def invalidate(self) -> None:
+        """Discard the cached token, e.g. after it was rejected, so that the next use fetches a new one."""
+        with self._lock:
+            self._token = None
+            self._refresh_at = 0.0
+
+    def _get_cached_token(self) -> Optional[str]:
+        with self._lock:
+            if self._token is not None and time.time() < self._refresh_at:
+                return self._token
+            return None
+
+    def _store_fetched_token(self, fetched: FetchedToken, start_time: float) -> str:
+        monitoring_info = fetched.monitoring_info
+        if monitoring_info is None:
+            monitoring_info = dict(start_time=start_time, response_duration=round(time.time() - start_time, 3),
+                                   response_code=200, response_reason="OK")
+        expires_at = fetched.expires_at if fetched.expires_at is not None \
+            else start_time + self.default_ttl_seconds
+        with self._lock:
+            self._token = fetched.token
+            # Refresh early, but never sooner than halfway through a short token lifetime.
+            lifetime = expires_at - start_time
+            self._refresh_at = expires_at - min(self.refresh_margin_seconds, lifetime / 2)
+            listeners = list(self._fetch_listeners)
+        self._notify_listeners(listeners, monitoring_info)
+        return fetched.token
+
+    def _notify_failure(self, start_time: float, ex: Exception) -> None:
+        monitoring_info = dict(start_time=start_time, response_duration=round(time.time() - start_time, 3),
+                               response_code=None, response_reason=type(ex).__name__)
+        with self._lock:
+            listeners = list(self._fetch_listeners)
+        self._notify_listeners(listeners, monitoring_info)
+
+    def _notify_listeners(self, listeners: List[Callable[[str, dict], None]], monitoring_info: dict) -> None:
+        for listener in listeners:
+            listener(self.name, monitoring_info)
+
+    def get_token(self) -> str:
+        token = self._get_cached_token()
+        if token is not None:
+            return token
+        assert self.fetch_token is not None, f"Token cache '{self.name}' has no synchronous fetch function."
+        # Serialize refreshes so that concurrent callers share a single fetch.
+        with self._refresh_lock:
+            token = self._get_cached_token()
+            if token is not None:
+                return token
+            start_time = time.time()
+            try:
+                fetched = self.fetch_token()
+            except Exception as ex:
+                self._notify_failure(start_time, ex)
+                raise
+            return self._store_fetched_token(fetched, start_time)
+
+    def _get_async_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._async_lock is None or self._async_lock_loop is not loop:
+            self._async_lock = asyncio.Lock()
+            self._async_lock_loop = loop
+        return self._async_lock
+
+    async def _get_token_in_thread(self) -> str:
+        """Fetch the token synchronously in a new thread.
+        An executor is not used, because executors refuse new work once the interpreter has started to
+        shut down, which is the case in a process whose main thread has returned while the event loop
+        thread keeps running.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def set_outcome(token: Optional[str], ex: Optional[Exception]) -> None:
+            # The awaiting task may have been cancelled meanwhile.
+            if future.done():
+                return
+            if ex is not None:
+                future.set_exception(ex)
+            else:
+                future.set_result(token)
+
+        def get_token() -> None:
+            try:
+                token = self.get_token()
+            except Exception as ex:
+                loop.call_soon_threadsafe(set_outcome, None, ex)
+            else:
+                loop.call_soon_threadsafe(set_outcome, token, None)
+
+        threading.Thread(target=get_token, name=f"{self.name}_fetch", daemon=True).start()
+        return await future
+
+    async def get_token_async(self) -> str:
+        token = self._get_cached_token()
+        if token is not None:
+            return token
+        async with self._get_async_lock():
+            token = self._get_cached_token()
+            if token is not None:
+                return token
+            if self.fetch_token_async is None:
+                # Fetching synchronously performs blocking I/O, so keep it off the event loop.
+                return await self._get_token_in_thread()
+            start_time = time.time()
+            try:
+                fetched = await self.fetch_token_async()
+            except Exception as ex:
+                self._notify_failure(start_time, ex)
+                raise
+            return self._store_fetched_token(fetched, start_time)
+
+
+# When run in Terra, this returns the Terra user pet SA token
+def fetch_google_credentials_token() -> FetchedToken:
+    import google.auth.transport.requests
+    creds, projects = google.auth.default()
+    creds.refresh(google.auth.transport.requests.Request())
+    # google-auth reports the expiry as a naive UTC datetime.
+    expires_at = creds.expiry.replace(tzinfo=timezone.utc).timestamp() if creds.expiry else None
+    return FetchedToken(creds.token, expires_at)
+
+
+terra_user_token_cache = TokenCache("terra_user_token", fetch_token=fetch_google_credentials_token)
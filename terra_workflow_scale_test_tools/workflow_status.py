@@ -3,63 +3,114 @@ This script/module provides a simple data access object (DAO) for information ab
 It is primarily designed to be imported and used in Jupyter Notebooks.
 """
 
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timezone
 import json
 import time
+from typing import Callable
 
 import requests
 
+from terra_workflow_scale_test_tools.json_stream import materialize, parse_json_events
+from terra_workflow_scale_test_tools.metrics_writer import MetricsWriters
+from terra_workflow_scale_test_tools.token_cache import terra_user_token_cache
+
 
 class WorkflowDAO:
     """ Workflow information data access class
+
+    `update` fetches the complete submission information, including every workflow.
+    `update_status` is a lighter weight alternative for polling the submission status.
+    It parses the response as it is received, materializing only the submission summary
+    fields, and counts the workflows by status without keeping them.
     """
+    # The submission information fields other than the workflows
+    submission_summary_fields = {"status", "submissionDate", "methodConfigurationNamespace",
+                                 "methodConfigurationName", "submitter", "submissionId", "submissionEntity",
+                                 "useCallCache", "userComment"}
+    response_chunk_size = 64 * 1024
 
-    def __init__(self, terra_deployment_tier, workspace_namespace: str, workspace_name: str, wf_submission_id: str):
+    def __init__(self, terra_deployment_tier, workspace_namespace: str, workspace_name: str, wf_submission_id: str,
+                 firecloud_api_url: str = None):
         self.terra_deployment_tier = terra_deployment_tier
         self.workspace_namespace = workspace_namespace
         self.workspace_name = workspace_name
         self.wf_submission_id = wf_submission_id
-        self.firecloud_api_url = \
+        # The API server URL may be overridden, e.g. to use a local mock server.
+        self.firecloud_api_url = firecloud_api_url if firecloud_api_url is not None else \
             f"https://firecloud-orchestration.dsde-{self.terra_deployment_tier.lower()}.broadinstitute.org"
         self.workflow_info: dict = None
+        self.submission_summary: dict = None
+        self.workflow_status_counts: Counter = None
+        # The time the submission information was requested, in seconds since the epoch
+        self.updated_at: float = None
+        # Reuse the connection to the API server across updates.
+        self.session = requests.Session()
 
     @staticmethod
     def _get_terra_user_token() -> str:
-        import google.auth.transport.requests
-        creds, projects = google.auth.default()
-        creds.refresh(google.auth.transport.requests.Request())
-        token = creds.token
-        return token
+        return terra_user_token_cache.get_token()
 
-    # TODO Make this more efficient
-    def update(self):
+    def _get_submission(self, stream: bool = False) -> requests.Response:
         terra_user_token = self._get_terra_user_token()
+        self.updated_at = time.time()
 
         headers = {
             'authorization': f"Bearer {terra_user_token}",
             'content-type': "application/json"
         }
 
-        resp = requests.get(f"{self.firecloud_api_url}/api/workspaces/{self.workspace_namespace}/{self.workspace_name}/submissions/{self.wf_submission_id}",
-                            headers=headers)
+        resp = self.session.get(f"{self.firecloud_api_url}/api/workspaces/{self.workspace_namespace}/{self.workspace_name}/submissions/{self.wf_submission_id}",
+                                headers=headers, stream=stream)
         # print(f"Request URL: {resp.request.url}")  # Debugging
+        if resp.status_code == 401:
+            # Fetch a new token for the next update.
+            terra_user_token_cache.invalidate()
         resp.raise_for_status()
+        return resp
+
+    def update(self):
+        resp = self._get_submission()
         self.workflow_info = resp.json() if resp.ok else None
+        self.submission_summary = {key: value for key, value in self.workflow_info.items() if key != 'workflows'}
+        self.workflow_status_counts = Counter(workflow['status'] for workflow in self.workflow_info['workflows'])
+
+    def update_status(self):
+        workflow_status_counts = Counter()
+
+        def count_workflow_status(prefix, event, value):
+            if prefix == "workflows.item.status":
+                workflow_status_counts[value] += 1
+
+        with self._get_submission(stream=True) as resp:
+            self.submission_summary = materialize(parse_json_events(resp.iter_content(self.response_chunk_size)),
+                                                  self.submission_summary_fields, count_workflow_status)
+        self.workflow_status_counts = workflow_status_counts
 
     def get_workflow_info(self) -> dict:
         if self.workflow_info is None:
             self.update()
         return self.workflow_info
 
+    def get_submission_summary(self) -> dict:
+        if self.submission_summary is None:
+            self.update_status()
+        return self.submission_summary
+
+    def get_workflow_status_counts(self) -> Counter:
+        if self.workflow_status_counts is None:
+            self.update_status()
+        return self.workflow_status_counts
+
     def get_submission_status(self) -> str:
-        return self.get_workflow_info()['status']
+        return self.get_submission_summary()['status']
 
     def is_in_process(self) -> bool:
         in_process_status_list = ["Queued", "Submitted", "Running"]
-        return self.get_workflow_info()['status'] in in_process_status_list
+        return self.get_submission_summary()['status'] in in_process_status_list
 
     def get_submission_time(self, strftime_format_string: str = None):
-        submission_date = self.get_workflow_info()['submissionDate']
+        submission_date = self.get_submission_summary()['submissionDate']
         if strftime_format_string is not None:
             # Convert submissionDate format to the specific ISO format supported by `fromisoformat`
             iso_submission_date = submission_date.replace('Z', '+00:00')
@@ -68,23 +119,23 @@ class WorkflowDAO:
             return submission_date
 
     def get_method_configuration_display_name(self) -> str:
-        return f"{self.get_workflow_info()['methodConfigurationNamespace']}/{self.get_workflow_info()['methodConfigurationName']}"
+        return f"{self.get_submission_summary()['methodConfigurationNamespace']}/{self.get_submission_summary()['methodConfigurationName']}"
 
     def get_submitter(self) -> str:
-        return self.get_workflow_info()['submitter']
+        return self.get_submission_summary()['submitter']
 
     def get_submission_id(self) -> str:
-        return self.get_workflow_info()['submissionId']
+        return self.get_submission_summary()['submissionId']
 
     def get_submission_entity_display_name(self) -> str:
-        submission_entity = self.get_workflow_info()['submissionEntity']
+        submission_entity = self.get_submission_summary()['submissionEntity']
         return f"{submission_entity['entityType']}:{submission_entity['entityName']}"
 
     def get_use_call_cache(self) -> str:
-        return self.get_workflow_info()['useCallCache']
+        return self.get_submission_summary()['useCallCache']
 
     def get_user_comment(self) -> str:
-        return self.get_workflow_info()['userComment']
+        return self.get_submission_summary()['userComment']
 
     def get_workflow_summary_display_string(self) -> str:
         return "\n".join([f"Method Configuration: {self.get_method_configuration_display_name()}",
@@ -98,14 +149,99 @@ class WorkflowDAO:
                           f"User Comment: {self.get_user_comment()}"])
 
 
-def wait_for_workflow_to_complete(workflow_dao: WorkflowDAO) -> None:
-    sleep_seconds = 30
-    while workflow_dao.is_in_process():
-        print(f"Submission status: {workflow_dao.get_submission_status()}")
-        print(f"Sleeping for {sleep_seconds} seconds ...")
-        time.sleep(sleep_seconds)
-        print("Getting current submission status ... ")
-        workflow_dao.update()
+class AdaptivePollInterval:
+    """ Submission status poll interval
+
+    The interval backs off while the workflow counts by status are unchanged, and is
+    reset when they change. Once most workflows have finished, the minimum interval is
+    used so that the end of the submission is detected promptly.
+    """
+    min_seconds = 10
+    initial_seconds = 30
+    max_seconds = 120
+    backoff_factor = 1.5
+    near_completion_fraction = 0.9
+    finished_workflow_statuses = ["Succeeded", "Failed", "Aborted"]
+
+    def __init__(self):
+        self.seconds = self.initial_seconds
+        self._previous_status_counts: Counter = None
+
+    def next_interval(self, workflow_status_counts: Counter) -> int:
+        workflow_count = sum(workflow_status_counts.values())
+        finished_count = sum(workflow_status_counts[status] for status in self.finished_workflow_statuses)
+        if workflow_count > 0 and finished_count >= self.near_completion_fraction * workflow_count:
+            self.seconds = self.min_seconds
+        elif workflow_status_counts == self._previous_status_counts:
+            self.seconds = min(self.seconds * self.backoff_factor, self.max_seconds)
+        else:
+            self.seconds = self.initial_seconds
+        self._previous_status_counts = Counter(workflow_status_counts)
+        return round(self.seconds)
+
+
+class SubmissionProgressRecorder:
+    """ Records the workflow counts by status at each poll of the submission status
+
+    The time series shows how many workflows Cromwell was running concurrently over the test.
+    """
+    output_filename = "submission_progress.csv"
+    # The Terra workflow statuses, any other status is counted as Unknown.
+    workflow_statuses = ["Queued", "Launching", "Submitted", "Running", "Aborting",
+                         "Succeeded", "Failed", "Aborted", "Unknown"]
+
+    def __init__(self, output_dir: str):
+        self.metrics_writers = MetricsWriters(output_dir)
+        self.writer = self.metrics_writers.get_writer(self.output_filename,
+                                                      ["timestamp", "submission_status"] + self.workflow_statuses)
+
+    def record(self, workflow_dao: WorkflowDAO) -> None:
+        row = dict.fromkeys(self.workflow_statuses, 0)
+        for status, count in workflow_dao.get_workflow_status_counts().items():
+            row[status if status in row else "Unknown"] += count
+        row["timestamp"] = datetime.fromtimestamp(workflow_dao.updated_at, timezone.utc).strftime("%Y/%m/%d %H:%M:%S")
+        row["submission_status"] = workflow_dao.get_submission_status()
+        self.writer.write_row(row)
+
+    def close(self) -> None:
+        self.metrics_writers.close_all()
+
+
+def format_workflow_status_counts(workflow_status_counts: Counter) -> str:
+    return ", ".join(f"{status}: {count}" for status, count in sorted(workflow_status_counts.items()))
+
+
+def wait_for_workflow_to_complete(workflow_dao: WorkflowDAO, poll_interval: AdaptivePollInterval = None,
+                                  progress_output_dir: str = None,
+                                  on_poll: Callable[[WorkflowDAO], None] = None) -> None:
+    """Poll the submission status until it is complete.
+
+    If `progress_output_dir` is given, the workflow counts by status at each poll are
+    recorded in `submission_progress.csv` in that directory.
+    If `on_poll` is given, it is called with the workflow DAO after each poll, e.g. to refresh live graphs.
+    """
+    poll_interval = AdaptivePollInterval() if poll_interval is None else poll_interval
+    progress_recorder = SubmissionProgressRecorder(progress_output_dir) if progress_output_dir is not None else None
+    try:
+        # Get the current status, rather than any earlier one, for the first progress record.
+        workflow_dao.update_status()
+        while True:
+            if progress_recorder is not None:
+                progress_recorder.record(workflow_dao)
+            if on_poll is not None:
+                on_poll(workflow_dao)
+            if not workflow_dao.is_in_process():
+                break
+            print(f"Submission status: {workflow_dao.get_submission_status()}")
+            print(f"Workflow statuses: {format_workflow_status_counts(workflow_dao.get_workflow_status_counts())}")
+            sleep_seconds = poll_interval.next_interval(workflow_dao.get_workflow_status_counts())
+            print(f"Sleeping for {sleep_seconds} seconds ...")
+            time.sleep(sleep_seconds)
+            print("Getting current submission status ... ")
+            workflow_dao.update_status()
+    finally:
+        if progress_recorder is not None:
+            progress_recorder.close()
     print(f"Final Submission status: {workflow_dao.get_submission_status()}")
 
 